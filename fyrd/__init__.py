@@ -173,6 +173,10 @@ from . import queue
 from . import job
 from . import helpers
 from . import batch_systems
+from . import poll
+from . import watch
+from . import throttle
+from . import snapshot
 from . import conf
 from .run import check_pid as _check_pid
 
@@ -183,12 +187,17 @@ from .batch_systems import options
 
 from .job import Job
 from .basic import submit
+from .basic import submit_array
 from .basic import submit_file
 from .basic import make_job_file
 from .basic import clean
 from .basic import clean_dir
 from .basic import wait
 from .basic import get
+from .basic import as_completed
+from .bulk import submit_many
+
+from .executor import Executor
 
 from .helpers import jobify
 
@@ -200,9 +209,11 @@ option_help = batch_systems.options.option_help
 
 #  import fyrd.batch_system as batch_system
 
-__all__ = ['Job', 'Queue', 'wait', 'get', 'submit', 'submit_file', 'jobify',
-           'make_job_file', 'clean', 'clean_dir', 'check_queue', 'option_help',
-           'set_profile', 'get_profile', 'get_profiles', 'conf', 'helpers',
+__all__ = ['Job', 'Queue', 'Executor', 'wait', 'get', 'as_completed',
+           'submit', 'submit_array', 'submit_many', 'submit_file',
+           'jobify', 'make_job_file', 'clean', 'clean_dir', 'check_queue',
+           'option_help', 'set_profile', 'get_profile', 'get_profiles',
+           'conf', 'helpers',
            'FYRD_SUCCESS', 'FYRD_NOT_RUNNING_ERROR',
            'FYRD_STILL_RUNNING_ERROR', 'FYRD_URI_NOT_FOUND_ERROR',
            'FYRD_CONNECTION_ERROR']
@@ -564,6 +564,10 @@ def queue(args):
     else:
         q = fyrd.queue.Queue(user='self', remote=args.remote, uri=args.uri)
 
+    if args.follow:
+        follow_queue(q, args.users)
+        return
+
     q.update(job_id=args.job_id)
 
     # Get jobs
@@ -601,13 +605,7 @@ def queue(args):
             if args.users or args.all_users:
                 cols.append(job.owner)
             if args.nodes:
-                nodes = {}
-                for node in job.nodes:
-                    node = node.split('/')[0]
-                    if node in nodes:
-                        nodes[node] += 1
-                    else:
-                        nodes[node] = 1
+                nodes = job.nodes.counts() if job.nodes else {}
                 cols.append(','.join(['{0}({1})'.format(n, c)
                                       for n, c in nodes.items()]))
             out_table.append(cols)
@@ -621,6 +619,25 @@ def queue(args):
         print('\n' + tabulate(out_table, headers=headers) + '\n')
 
 
+def follow_queue(q, users=None):
+    """Print changes to the queue as they happen, until interrupted."""
+    for change in q.changes():
+        if users:
+            job = q[change.job_id]
+            if job is not None and job.owner not in users:
+                continue
+        job_id = change.job_id
+        if change.array_id is not None:
+            job_id += '_{0}'.format(change.array_id)
+        if change.event == 'new':
+            print('{0}\tnew\t{1}'.format(job_id, change.new_state))
+        else:
+            print('{0}\t{1}\t{2} -> {3}'.format(
+                job_id, change.event, change.old_state, change.new_state
+            ))
+        sys.stdout.flush()
+
+
 def wait(args):
     """Wait on jobs."""
     q = fyrd.queue.Queue()
@@ -1078,6 +1095,9 @@ def command_line_parser():
                             help="Print job count only")
     queue_disp.add_argument('-n', '--nodes', action='store_true',
                             help='Also display node list (normal mode only)')
+    queue_disp.add_argument('-f', '--follow', action='store_true',
+                            help='Print changes to the queue as they ' +
+                            'happen, until interrupted')
 
     # Set function
     queue_sub.set_defaults(func=queue)
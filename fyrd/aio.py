@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio API for Job and Queue, only imported on python 3.7 or newer.
+
+Adds these methods to fyrd.queue.Queue and fyrd.job.Job through mixins:
+
+    Queue.async_wait(jobs, return_disp=False)
+    Queue.async_as_completed(jobs, timeout=None)
+    Job.async_wait()
+    Job.async_get()
+
+All waits on a Queue share a single background poller task per event loop,
+which updates the queue in an executor and resolves a future per watched job,
+so any number of jobs can be awaited without a thread or a scheduler query per
+job.
+
+Classes
+-------
+QueueMixin
+    The async methods of fyrd.queue.Queue.
+JobMixin
+    The async methods of fyrd.job.Job.
+"""
+import asyncio as _asyncio
+from time import time as _time
+from collections import OrderedDict as _OrderedDict
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import run   as _run
+from . import conf  as _conf
+from . import logme as _logme
+from . import batch_systems as _batch
+from . import ClusterError as _ClusterError
+
+__all__ = ['QueueMixin', 'JobMixin']
+
+GOOD_STATES      = _batch.GOOD_STATES
+UNCERTAIN_STATES = _batch.UNCERTAIN_STATES
+DONE_STATES      = _batch.DONE_STATES
+
+
+###############################################################################
+#                                 Queue Mixin                                 #
+###############################################################################
+
+
+class QueueMixin(object):
+
+    """The asyncio methods of fyrd.queue.Queue."""
+
+    async def async_wait(self, jobs, return_disp=False):
+        """Wait for jobs to complete without blocking the event loop.
+
+        All waiting coroutines of this Queue share one background poller
+        task, which updates the queue in an executor.
+
+        Parameters
+        ----------
+        jobs : list
+            List of either fyrd.job.Job, fyrd.queue.QueueJob, job_id
+        return_disp : bool, optional
+            If a job disappeares from the queue, return 'disapeared' instead of
+            False
+
+        Returns
+        -------
+        bool or str
+            True on success False on failure unless return_disp is True
+            and the job disappeares, then returns 'disappeared'
+        """
+        jobs = _run.listify(jobs)
+        check_jobs = self._normalize_job_ids(jobs)
+        poller = self._get_poller()
+        states = await _asyncio.gather(
+            *[poller.watch(job_string, ids)
+              for job_string, ids in check_jobs.items()]
+        )
+        final = dict(zip(check_jobs, states))
+        for job in jobs:
+            if isinstance(job, self._Job):
+                self._finish_job(job, final[str(job.id)])
+        dispo = True
+        for job_string, job_state in final.items():
+            if job_state == 'disappeared':
+                dispo = 'disappeared' if return_disp else False
+            elif job_state not in GOOD_STATES:
+                _logme.log('Job {} failed with state {}'
+                           .format(job_string, job_state), 'error')
+                return False
+        return dispo
+
+    async def async_as_completed(self, jobs, timeout=None):
+        """Asynchronously yield jobs as they finish, in order of completion.
+
+        Asyncio version of as_completed, for use with `async for`.
+
+        Parameters
+        ----------
+        jobs : list
+            List of fyrd.Job objects
+        timeout : int, optional
+            Maximum number of seconds to wait for all jobs
+
+        Yields
+        ------
+        fyrd.Job
+
+        Raises
+        ------
+        fyrd.queue.QueueError
+            If timeout is exceeded before all jobs finish.
+        """
+        from .queue import QueueError  # Circular import
+        jobs = _run.listify(jobs)
+        for job in jobs:
+            if not isinstance(job, self._Job):
+                raise _ClusterError('This only works with cluster job '
+                                    'objects')
+        tasks = [_asyncio.ensure_future(self._async_finish(job))
+                 for job in jobs]
+        try:
+            for task in _asyncio.as_completed(tasks, timeout=timeout):
+                try:
+                    job = await task
+                except _asyncio.TimeoutError:
+                    raise QueueError('Jobs not complete after {} seconds'
+                                     .format(timeout))
+                yield job
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _get_poller(self):
+        """Return the background poller for the running event loop."""
+        loop = _asyncio.get_running_loop()
+        if self._poller is None or self._poller.loop is not loop:
+            self._poller = _AsyncPoller(self, loop)
+        return self._poller
+
+    async def _async_finish(self, job):
+        """Wait for a single fyrd.Job to finish and its files to appear.
+
+        Unsubmitted jobs are submitted first if auto_submit is set, as in
+        Job.wait(), submission runs in an executor.
+
+        Returns
+        -------
+        fyrd.Job
+
+        Raises
+        ------
+        fyrd.ClusterError
+            If the job is not submitted and auto_submit is not set.
+        """
+        if not job.submitted:
+            if not _conf.get_option('jobs', 'auto_submit'):
+                raise _ClusterError('Job {} has not been submitted'
+                                    .format(job.name))
+            _logme.log('Auto-submitting as not submitted yet', 'debug')
+            await _asyncio.get_running_loop().run_in_executor(None,
+                                                              job.submit)
+        if job.state not in DONE_STATES:
+            job_string, ids = list(
+                self._normalize_job_ids([job]).items()
+            )[0]
+            job_state = await self._get_poller().watch(job_string, ids)
+            self._finish_job(job, job_state)
+        if job.state == 'completed':
+            file_time = float(_conf.get_option('jobs', 'file_block_time', 30))
+            policy = self.poll_policy(initial=0.1,
+                                      maximum=max(file_time/10, 0.1))
+            start = _time()
+            while not job._check_files():
+                if _time() - start > file_time:
+                    _logme.log('Job {} complete, but output files have not '
+                               'appeared for >{} seconds'
+                               .format(job.id, file_time), 'warn')
+                    break
+                await _asyncio.sleep(policy.next())
+        return job
+
+
+###############################################################################
+#                                  Job Mixin                                  #
+###############################################################################
+
+
+class JobMixin(object):
+
+    """The asyncio methods of fyrd.job.Job."""
+
+    async def async_wait(self):
+        """Wait for the job to complete without blocking the event loop.
+
+        Uses the single background poller of the Queue, so any number of
+        jobs can be awaited without a thread per job.
+
+        Returns
+        -------
+        success : bool or str
+            True if exitcode == 0, False if not, 'disappeared' if job lost from
+            queue.
+        """
+        await self.queue._async_finish(self)
+        return self._finished_status()
+
+    async def async_get(self, save=True, cleanup=None, delete_outfiles=None,
+                        del_no_save=None, raise_on_error=True):
+        """Wait for the job without blocking and return its output.
+
+        Coroutine version of get(), see get() for arguments.
+
+        Returns
+        -------
+        str
+            Function output if Function, else STDOUT
+        """
+        status = await self.async_wait()
+        return self._get_finished(
+            status, save=save, cleanup=cleanup,
+            delete_outfiles=delete_outfiles, del_no_save=del_no_save,
+            raise_on_error=raise_on_error
+        )
+
+
+###############################################################################
+#                          Asynchronous Queue Polling                         #
+###############################################################################
+
+
+class _AsyncPoller(object):
+
+    """Poll the queue in the background and resolve futures for jobs.
+
+    One poller is used per Queue and event loop, it runs as a single task
+    while there are jobs to watch and updates the queue in an executor, so
+    any number of coroutines can wait on jobs with only one polling loop.
+    """
+
+    def __init__(self, queue, loop):
+        """Create the poller, the task is only started by watch()."""
+        self.queue     = queue
+        self.loop      = loop
+        self.task      = None
+        self.waiters   = {}  # {job_string: ((job_id, array_id), [futures])}
+        self.missing   = {}  # {job_string: time first found missing}
+        self.uncertain = {}  # {job_string: time first seen uncertain}
+
+    def watch(self, job_string, ids):
+        """Return a future that resolves to the final state of a job.
+
+        Parameters
+        ----------
+        job_string : str
+        ids : tuple
+            (job_id, array_id) as returned by Queue._normalize_job_ids
+
+        Returns
+        -------
+        asyncio.Future
+        """
+        future = self.loop.create_future()
+        self.waiters.setdefault(job_string, (ids, []))[1].append(future)
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self.run())
+        return future
+
+    async def run(self):
+        """Update the queue and resolve futures until nothing is watched."""
+        res_time = float(_conf.get_option('queue', 'res_time'))
+        policy   = self.queue._new_policy(track=False)
+        while self.waiters:
+            # Forget jobs nobody is waiting on anymore
+            for job_string, (_, futures) in list(self.waiters.items()):
+                futures[:] = [f for f in futures if not f.done()]
+                if not futures:
+                    self.waiters.pop(job_string)
+            if not self.waiters:
+                break
+            try:
+                await self.loop.run_in_executor(None, self.queue.update)
+            except Exception as err:
+                for _, futures in self.waiters.values():
+                    for future in futures:
+                        future.set_exception(err)
+                self.waiters = {}
+                break
+            check_jobs = _OrderedDict(
+                (k, v[0]) for k, v in self.waiters.items()
+            )
+            for job_string, job_state in self.queue._resolve_job_states(
+                    check_jobs, self.missing):
+                if job_state in UNCERTAIN_STATES:
+                    self.uncertain.setdefault(job_string, _time())
+                    if _time() - self.uncertain[job_string] < res_time:
+                        continue
+                elif job_state not in DONE_STATES \
+                        and job_state != 'disappeared':
+                    continue
+                for future in self.waiters.pop(job_string)[1]:
+                    if not future.done():
+                        future.set_result(job_state)
+                self.missing.pop(job_string, None)
+                self.uncertain.pop(job_string, None)
+            if self.waiters:
+                policy.observe(len(self.waiters))
+                await _asyncio.sleep(policy.next())
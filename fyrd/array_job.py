@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Run one function over many sets of arguments as a single job array.
+
+Submitting thousands of tiny Jobs costs one script, one pickle and one
+scheduler submission each. An ArrayJob writes one script, one function pickle
+and one indexed arguments file, and submits them once as a native job array
+(slurm --array, torque -t, LSF name[1-N]). Every array task reads only its
+own arguments and writes its own result pickle::
+
+    job = fyrd.submit_array(my_function, [1, 2, 3, (4, 5)], cores=1)
+    results = job.get()  # [my_function(1), ..., my_function(4, 5)]
+
+Classes
+-------
+ArrayJob
+    A Job that runs a function once per item of an argument list.
+"""
+import os as _os
+
+import cloudpickle as _pickle
+from six import reraise as _reraise
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import run   as _run
+from . import logme as _logme
+from . import ClusterError  as _ClusterError
+from .job import Job as _Job
+from .submission_scripts import ArrayFunction as _ArrayFunction
+
+__all__ = ['ArrayJob']
+
+# Patterns the batch systems replace with the task id in output file names,
+# torque appends -<task id> itself and the local queue adds it on submit.
+TASK_PATTERNS = {'slurm': '%a', 'lsf': '%I'}
+
+
+###############################################################################
+#                             The ArrayJob Class                              #
+###############################################################################
+
+
+class ArrayJob(_Job):
+
+    """A function run once per set of arguments as one native job array.
+
+    Works like a function Job, except that outputs are lists with one entry
+    per task, in the same order as arglist.
+
+    Attributes
+    ----------
+    arglist : list of tuple
+        The positional arguments of every task
+    tasks : range
+        The task ids, starting at 1
+    task_states : dict
+        {task_id: state} from the last queue update
+
+    Methods
+    -------
+    get_task(task_id, raise_on_error=True)
+        Get the output of a single task
+    task_outfile(task_id)
+        Return the output pickle for a single task
+    """
+
+    _function_class = _ArrayFunction
+
+    def __init__(self, function, arglist, kwargs=None, name=None, qtype=None,
+                 profile=None, queue=None, **kwds):
+        """Create an array of function calls.
+
+        Parameters
+        ----------
+        function : function
+            The function to call in every task
+        arglist : list
+            One entry per task, tuples are used as the positional arguments,
+            anything else is passed as the single argument.
+        kwargs : dict, optional
+            Keyword arguments passed to every call
+        name : str, optional
+            Optional name of the job.
+        qtype : str, optional
+            Override the default queue type
+        profile : str, optional
+            The name of a profile saved in the conf
+        queue : fyrd.queue.Queue, optional
+            An already initiated Queue class to use.
+        kwds
+            *All other keywords are parsed into cluster keywords by the options
+            system.* For available keywords see `fyrd.option_help()`
+        """
+        if not callable(function):
+            raise _ClusterError('ArrayJob can only run functions')
+        self.arglist = [
+            args if isinstance(args, tuple) else (args,) for args in arglist
+        ]
+        if not self.arglist:
+            raise _ClusterError('ArrayJob needs at least one set of arguments')
+        kwds['array'] = '1-{}'.format(len(self.arglist))
+        super(ArrayJob, self).__init__(
+            function, kwargs=kwargs, name=name, qtype=qtype, profile=profile,
+            queue=queue, **kwds
+        )
+
+    ################
+    #  Properties  #
+    ################
+
+    @property
+    def tasks(self):
+        """The task ids, starting at 1."""
+        return range(1, len(self.arglist)+1)
+
+    @property
+    def task_states(self):
+        """A dictionary of {task_id: state} from the queue."""
+        if not self.submitted:
+            return {}
+        if not self._updating:
+            self.update()
+        info = self.queue[self.id]
+        if not info or not getattr(info, 'children', None):
+            return {}
+        return {int(k): v.state for k, v in info.children.items()}
+
+    @property
+    def outfiles(self):
+        """A list of all outfiles associated with this Job."""
+        outfiles = []
+        for task in self.tasks:
+            outfiles += [_task_file(self.outfile, task),
+                         _task_file(self.errfile, task),
+                         self.task_outfile(task)]
+        return outfiles
+
+    @property
+    def incomplete_outfiles(self):
+        """The task output pickles, if they haven't been fetched."""
+        if self._got_out or not self.poutfile:
+            return []
+        return [self.task_outfile(task) for task in self.tasks]
+
+    ###############################
+    #  Core Job Handling Methods  #
+    ###############################
+
+    def initialize(self):
+        """Make self runnable, add the task pattern to the output files."""
+        super(ArrayJob, self).initialize()
+        pattern = TASK_PATTERNS.get(self.qtype)
+        if pattern:
+            for key in ['outfile', 'errfile']:
+                self._kwargs[key] = _task_file(self._kwargs[key], pattern)
+        return self
+
+    ####################
+    #  Output Methods  #
+    ####################
+
+    def task_outfile(self, task_id):
+        """Return the path to the output pickle of one task.
+
+        Parameters
+        ----------
+        task_id : int
+            Numbered from 1
+
+        Returns
+        -------
+        str
+        """
+        return '{}.{}'.format(self.poutfile, task_id)
+
+    def get_task(self, task_id, raise_on_error=True):
+        """Get the output of a single task, blocks until it is written.
+
+        Parameters
+        ----------
+        task_id : int
+            Numbered from 1
+        raise_on_error : bool, optional
+            If the task raised an Exception, raise it.
+
+        Returns
+        -------
+        output : anything
+        """
+        if task_id not in self.tasks:
+            raise _ClusterError('Task {} not in array of {} tasks'
+                                .format(task_id, len(self.arglist)))
+        if self._got_out:
+            out = self._out[task_id-1]
+        else:
+            pfile = self.task_outfile(task_id)
+            if not _os.path.isfile(pfile):
+                self.wait()
+            out = _load_pickle(pfile)
+        if raise_on_error and _run.is_exc(out):
+            _reraise(*out)
+        return out
+
+    def get_output(self, save=True, delete_file=None, update=True,
+                   raise_on_error=True):
+        """Get the output of every task as a list.
+
+        Parameters
+        ----------
+        save : bool, optional
+            Save the output to self.out, default True.
+        delete_file : bool, optional
+            Delete the output pickles when getting
+        update : bool, optional
+            Update job info from queue first.
+        raise_on_error : bool, optional
+            If any task returned an Exception, raise the first one.
+
+        Returns
+        -------
+        list
+            The output of every task, in the order of arglist
+        """
+        if delete_file is None:
+            delete_file = self.clean_outputs
+        if self.done and self._got_out:
+            _logme.log('Getting output from _out', 'debug')
+            out = self._out
+        else:
+            if update and not self._updating and not self.done:
+                self.update()
+            if not self.done:
+                _logme.log('Cannot get pickled output before job completes',
+                           'warn')
+                return None
+            if update:
+                self._wait_for_files()
+            out = []
+            for task in self.tasks:
+                pfile = self.task_outfile(task)
+                if not _os.path.isfile(pfile):
+                    _logme.log('No file at {} even though job has completed!'
+                               .format(pfile), 'critical')
+                    raise IOError('File not found: {}'.format(pfile))
+                out.append(_load_pickle(pfile))
+                if delete_file is True or self.clean_files is True:
+                    _os.remove(pfile)
+            if save:
+                self._out     = out
+                self._got_out = True
+        if raise_on_error:
+            for task_out in out:
+                if _run.is_exc(task_out):
+                    _logme.log('{} failed with exception {}'
+                               .format(self, task_out[1]), 'error')
+                    _reraise(*task_out)
+        return out
+
+    def get_stdout(self, save=True, delete_file=None, update=True):
+        """Get the STDOUT of every task as a list, None if missing."""
+        out = self._get_task_files(self.outfile, delete_file, update)
+        if save:
+            self._stdout = out
+            self._got_stdout = self.done
+        return out
+
+    def get_stderr(self, save=True, delete_file=None, update=True):
+        """Get the STDERR of every task as a list, None if missing."""
+        out = self._get_task_files(self.errfile, delete_file, update)
+        if save:
+            self._stderr = out
+            self._got_stderr = self.done
+        return out
+
+    def get_times(self, update=True, stdout=None):
+        """Array tasks have separate times, use the queue info instead."""
+        self._got_times = True
+        return self.start, self.end
+
+    ######################
+    # Internal Functions #
+    ######################
+
+    def _get_task_files(self, path, delete_file, update):
+        """Read the per-task version of path for every task."""
+        if delete_file is None:
+            delete_file = self.clean_outputs
+        if update and not self._updating and not self.done:
+            self.update()
+        out = []
+        for task in self.tasks:
+            task_path = _task_file(path, task)
+            if not _os.path.isfile(task_path):
+                out.append(None)
+                continue
+            with open(task_path) as fin:
+                contents = fin.read()
+            # Strip the time tracking the script runner adds
+            lines = contents.strip().split('\n')
+            if len(lines) > 4 and lines[-3] == 'Done':
+                contents = '\n'.join(lines[2:-3]) + '\n'
+            out.append(contents)
+            if delete_file is True or self.clean_files is True:
+                _os.remove(task_path)
+        return out
+
+    def __repr__(self):
+        """Add the number of tasks to the Job repr."""
+        return super(ArrayJob, self).__repr__().replace(
+            'Job:', 'ArrayJob[{}]:'.format(len(self.arglist)), 1
+        )
+
+
+###############################################################################
+#                              Helper Functions                               #
+###############################################################################
+
+
+def _task_file(path, task_id):
+    """Return path with -<task_id> added, task_id may be a pattern."""
+    if not path:
+        return path
+    return '{}-{}'.format(path, task_id)
+
+
+def _load_pickle(path):
+    """Load a task output pickle."""
+    with open(path, 'rb') as fin:
+        return _pickle.load(fin)
@@ -6,6 +6,8 @@ Functions
 ---------
 submit
     Submit a script to the cluster
+submit_array
+    Submit a function with many sets of arguments as one job array
 make_job
     Make a job compatible with the chosen cluster but do not submit
 make_job_file
@@ -22,6 +24,8 @@ wait
     Wait for jobs to finish.
 get
     Get results of jobs when they complete.
+as_completed
+    Yield jobs as they complete.
 """
 import os  as _os
 import sys as _sys
@@ -40,9 +44,11 @@ from . import logme as _logme
 from . import batch_systems as _batch
 from . import ClusterError as _ClusterError
 from .job import Job
+from .array_job import ArrayJob
 
-__all__ = ['submit', 'make_job', 'make_job_file', 'submit_file', 'clean_dir',
-           'clean_work_dirs', 'clean', 'wait', 'get']
+__all__ = ['submit', 'submit_array', 'make_job', 'make_job_file',
+           'submit_file', 'clean_dir', 'clean_work_dirs', 'clean', 'wait',
+           'get', 'as_completed']
 
 ###############################################################################
 #                            Submission Functions                             #
@@ -94,6 +100,49 @@ def submit(command, args=None, kwargs=None, name=None, qtype=None,
     return job
 
 
+def submit_array(function, arglist, kwargs=None, name=None, qtype=None,
+                 profile=None, queue=None, **kwds):
+    """Submit a function as one job array, one task per item of arglist.
+
+    Parameters
+    ----------
+    function : function
+        The function to call in every task
+    arglist : list
+        One entry per task, tuples are used as the positional arguments,
+        anything else is passed as the single argument.
+    kwargs : dict, optional
+        Keyword arguments passed to every call
+    name : str, optional
+        Optional name of the job.
+    qtype : str, optional
+        Override the default queue type
+    profile : str, optional
+        The name of a profile saved in the conf
+    queue : fyrd.queue.Queue, optional
+        An already initiated Queue class to use.
+    kwds
+        *All other keywords are parsed into cluster keywords by the options
+        system.* For available keywords see `fyrd.option_help()`
+
+    Returns
+    -------
+    fyrd.array_job.ArrayJob
+        get() returns a list of outputs in the order of arglist
+    """
+
+    _batch.check_queue()  # Make sure the queue.MODE is usable
+
+    job = ArrayJob(function, arglist, kwargs=kwargs, name=name, qtype=qtype,
+                   profile=profile, queue=queue, **kwds)
+
+    job.write()
+    job.submit()
+    job.update()
+
+    return job
+
+
 #########################
 #  Job file generation  #
 #########################
@@ -438,3 +487,28 @@ def get(jobs, queue=None):
     """
     q = queue if queue else _queue.default_queue()
     return q.get(jobs)
+
+
+def as_completed(jobs, timeout=None, queue=None):
+    """Yield jobs as they complete.
+
+    Only works on user jobs by default. To work on jobs so someone else,
+    initialize a fyrd.queue.Queue class with their user info and pass as an
+    argument to queue.
+
+    Parameters
+    ----------
+    jobs : fyrd.job.Job or list of fyrd.job.Job
+    timeout : int, optional
+        Maximum number of seconds to wait for all jobs
+    queue : fyrd.queue.Queue, optional
+        An already initiated Queue class to use.
+
+    Yields
+    ------
+    fyrd.job.Job
+        Each job as soon as it is complete and its outputs exist, or as soon
+        as it fails. Call `job.get()` to get the outputs.
+    """
+    q = queue if queue else _queue.default_queue()
+    return q.as_completed(jobs, timeout=timeout)
@@ -19,6 +19,7 @@ from . import slurm as _slurm
 from . import torque as _torque
 from . import lsf as _lsf
 from .base import BatchSystemError, BatchSystemClient
+from .nodeset import NodeSet
 
 from .. import run as _run
 from .. import logme as _logme
@@ -1,12 +1,14 @@
 import sys as _sys
 import os as _os
 import time as _time
+import re as _re
 import errno as _errno
 import pkgutil as _pkgutil
 from functools import wraps
 
 from fyrd import logme as _logme
 from fyrd import conf as _conf
+from fyrd import throttle as _throttle
 from fyrd import FYRD_SUCCESS, \
     FYRD_NOT_RUNNING_ERROR, FYRD_STILL_RUNNING_ERROR
 
@@ -378,6 +380,17 @@ class BatchSystemClient(metaclass=MetaClassDecorator):
         server = self.get_server()
         return server.kill(job_ids)
 
+    def throttle_stats(self):
+        """Return the time spent rate limiting scheduler commands.
+
+        Returns
+        -------
+        dict
+            {'submit': dict, 'query': dict}, see fyrd.throttle.stats()
+        """
+        server = self.get_server()
+        return server.throttle_stats()
+
     ###########################################################################
     #                              Queue Parsing                              #
     ###########################################################################
@@ -390,8 +403,9 @@ class BatchSystemClient(metaclass=MetaClassDecorator):
             User name to pass to qstat to filter queue with
         partiton : str, optional
             Partition to filter the queue with
-        job_id: str, optional
-            Job ID to filter the queue with
+        job_id: str or list, optional
+            Job ID or IDs to filter the queue with, passed to the scheduler
+            so that only these jobs are queried.
 
         Yields
         ------
@@ -401,7 +415,7 @@ class BatchSystemClient(metaclass=MetaClassDecorator):
         userid : str
         partition : str
         state :str
-        nodelist : list
+        nodelist : NodeSet
         numnodes : int
         cntpernode : int or None
         exit_code : int or Nonw
@@ -438,6 +452,9 @@ class BatchSystemClient(metaclass=MetaClassDecorator):
 class BatchSystemServer(object):
     NAME = None
 
+    # Maximum number of job IDs passed to a single scheduler query
+    ID_BATCH = 100
+
     @Pyro4.expose
     @property
     def python_path(self):
@@ -493,6 +510,42 @@ class BatchSystemServer(object):
 
         return modules
 
+    @staticmethod
+    def _filter_ids(job_id):
+        """Return job_id as a list of job ID strings, or None.
+
+        Parameters
+        ----------
+        job_id : str, int or list
+            One or more job IDs, strings can be comma separated. Array IDs
+            like 1234_1 are reduced to the parent ID. Anything that is not a
+            numeric ID is dropped.
+
+        Returns
+        -------
+        list of str or None
+            None if no valid IDs, meaning no filter.
+        """
+        if not job_id:
+            return None
+        if not isinstance(job_id, (list, tuple, set)):
+            job_id = str(job_id).split(',')
+        ids = []
+        for jid in job_id:
+            jid = _re.split(r'[_\[.]', str(jid).strip())[0]
+            if jid.isdigit() and jid not in ids:
+                ids.append(jid)
+        return ids if ids else None
+
+    @classmethod
+    def _id_batches(cls, ids):
+        """Yield ids in lists of at most ID_BATCH, or [None] if no ids."""
+        if not ids:
+            yield None
+            return
+        for i in range(0, len(ids), cls.ID_BATCH):
+            yield ids[i:i+cls.ID_BATCH]
+
     def _server_running(self):
         """Return True if server currently running.
         """
@@ -644,6 +697,17 @@ class BatchSystemServer(object):
     def ping(self):
         return 'pong'
 
+    @Pyro4.expose
+    def throttle_stats(self):
+        """Return the rate limiter metrics of the server process.
+
+        Returns
+        -------
+            stats: dict
+                {'submit': dict, 'query': dict}, see fyrd.throttle.stats()
+        """
+        return _throttle.stats()
+
     ###########################################################################
     #                         Pure Virtual Functions                          #
     ###########################################################################
@@ -17,6 +17,7 @@ keyword arguments, the only arguments we pay attention to are:
     errfile : STDERR goes here
     cores : Sets the number of threads per process
     depends : Job dependencies
+    array : Job array task ids, one job is queued per task
 
 All others are ignored (although note that many others are actually handled by
 the Job object anyway).
@@ -31,11 +32,16 @@ import socket as _socket    # Used to get hostname
 import getpass as _getpass  # Used to get usernames for queue
 import argparse as _argparse
 import subprocess
+import heapq as _heapq
+from collections import deque as _deque
+from uuid import uuid4 as _uuid
+import threading as _threading
 import multiprocessing as mp
+from multiprocessing.connection import wait as _wait
+from time import time as _time
 from time import sleep as _sleep
 from datetime import datetime as _dt
 from datetime import timedelta as _td
-from collections import OrderedDict as _OD
 
 try:
     from Queue import Empty
@@ -56,10 +62,14 @@ from sqlalchemy import create_engine as _create_engine
 from sqlalchemy import Column as _Column
 from sqlalchemy import String as _String
 from sqlalchemy import Integer as _Integer
+from sqlalchemy import text as _text
+from sqlalchemy import bindparam as _bindparam
+from sqlalchemy import event as _event
+from sqlalchemy import func as _func
+from sqlalchemy import select as _select
 
 from sqlalchemy.types import DateTime as _DateTime
 from sqlalchemy.orm import sessionmaker as _sessionmaker
-from sqlalchemy.orm import scoped_session as _scoped_session
 from sqlalchemy.ext.declarative import declarative_base as _base
 
 # Fyrd imports (not necessary for main functionality) no relative imports
@@ -85,9 +95,6 @@ PID_FILE = _os.path.join(RUN_DIR, 'local_queue.pid')
 URI_FILE = _os.path.join(RUN_DIR, 'local_queue.uri')
 DATABASE = _os.path.join(RUN_DIR, 'local_queue.db')
 
-# Time to block between looping in job_runner
-SLEEP_LEN = 0.1
-
 # Time in seconds to wait for QueueManager to terminate
 STOP_WAIT = 5
 
@@ -95,6 +102,22 @@ STOP_WAIT = 5
 # config file, this just sets the default
 CLEAN_OLDER_THAN = 7
 
+# Seconds between automatic cleans of old jobs, clean() runs on every get()
+CLEAN_INTERVAL = 60
+
+# Compact the database file after cleaning at least this many jobs
+COMPACT_ROWS = 10000
+
+# Cleans whose deleted jobs are kept for get_changes(), clients that have not
+# asked for changes since the oldest of these get every job instead
+DELETED_LOG = 10
+
+# Set on every database connection. WAL lets readers work during writes and
+# makes commits cheap, with synchronous NORMAL a power loss can lose the
+# last commits but never corrupts the database.
+DB_PRAGMAS = [('journal_mode', 'WAL'), ('synchronous', 'NORMAL'),
+              ('busy_timeout', 5000)]
+
 # Default max jobs, can be overriden by config file or QueueManager init
 MAX_JOBS = mp.cpu_count()-1
 MAX_JOBS = MAX_JOBS if MAX_JOBS >= 0 else 1
@@ -137,6 +160,14 @@ class QueueError(Exception):
 ###############################################################################
 
 
+def _set_pragmas(dbapi_connection, _):
+    """Tune every new SQLite connection with DB_PRAGMAS."""
+    cursor = dbapi_connection.cursor()
+    for pragma, value in DB_PRAGMAS:
+        cursor.execute('PRAGMA {}={}'.format(pragma, value))
+    cursor.close()
+
+
 class Job(Base):
 
     """A Job record for every queued job.
@@ -161,6 +192,12 @@ class Job(Base):
         Path to the directory to run in
     outfile, errfile : str, optional
         Paths to the output files
+    array_job : int, optional
+        The jobno of the first task if this job is an array task
+    array_id : int, optional
+        The task id if this job is an array task
+    seq : int
+        The QueueManager sequence number of the last change to this job
     """
 
     __tablename__ = 'jobs'
@@ -168,7 +205,7 @@ class Job(Base):
     jobno       = _Column(_Integer, primary_key=True, index=True)
     name        = _Column(_String, nullable=False)
     command     = _Column(_String, nullable=False)
-    submit_time = _Column(_DateTime, nullable=False)
+    submit_time = _Column(_DateTime, nullable=False, index=True)
     threads     = _Column(_Integer, nullable=False)
     state       = _Column(_String, nullable=False, index=True)
     exitcode    = _Column(_Integer)
@@ -176,6 +213,9 @@ class Job(Base):
     runpath     = _Column(_String)
     outfile     = _Column(_String)
     errfile     = _Column(_String)
+    array_job   = _Column(_Integer, index=True)
+    array_id    = _Column(_Integer)
+    seq         = _Column(_Integer, index=True)
 
     def __repr__(self):
         """Display summary."""
@@ -200,8 +240,13 @@ class LocalQueue(object):
         self.engine  = _create_engine(
             'sqlite:///{}?check_same_thread=False'.format(self.db_file)
         )
+        _event.listen(self.engine, 'connect', _set_pragmas)
+        # Sessions share the pooled connections of the engine
+        self._session_factory = _sessionmaker(bind=self.engine)
         if not _os.path.isfile(self.db_file):
             self.create_database(confirm=False)
+        else:
+            self.add_missing_columns()
 
     ##########################################################################
     #                           Basic Connectivity                           #
@@ -209,9 +254,7 @@ class LocalQueue(object):
 
     def get_session(self):
         """Return session for this database."""
-        session_factory = _sessionmaker(bind=self.engine)
-        Session = _scoped_session(session_factory)
-        return Session()
+        return self._session_factory()
 
     @property
     def session(self):
@@ -300,6 +343,59 @@ class LocalQueue(object):
         Base.metadata.create_all(self.engine)
         _logme.log('Done', 'info', also_write='stderr')
 
+    def add_missing_columns(self):
+        """Add any columns or indexes missing from an old database."""
+        with self.engine.begin() as conn:
+            existing = [
+                i[1] for i in conn.execute(_text('PRAGMA table_info(jobs)'))
+            ]
+            if not existing:
+                return
+            for column in Job.__table__.columns:
+                if column.name not in existing:
+                    _logme.log('Adding column {} to the local queue database'
+                               .format(column.name), 'debug')
+                    conn.execute(_text(
+                        'ALTER TABLE jobs ADD COLUMN {} {}'.format(
+                            column.name,
+                            column.type.compile(self.engine.dialect)
+                        )
+                    ))
+            for index in Job.__table__.indexes:
+                index.create(conn, checkfirst=True)
+
+    def delete_older_than(self, cutoff):
+        """Delete all jobs submitted before cutoff in one statement.
+
+        Parameters
+        ----------
+        cutoff : datetime
+
+        Returns
+        -------
+        count : int
+            The number of jobs deleted
+        job_ids : list of int
+            The deleted job numbers, array jobs by their first task
+        """
+        table = Job.__table__
+        old = table.c.submit_time < cutoff
+        with self.engine.begin() as conn:
+            job_ids = [i[0] for i in conn.execute(
+                _select(_func.coalesce(table.c.array_job, table.c.jobno))
+                .where(old).distinct()
+            )]
+            result = conn.execute(table.delete().where(old))
+        return result.rowcount, job_ids
+
+    def compact(self):
+        """Shrink the database file after many jobs were deleted."""
+        _logme.log('Compacting the local queue database', 'debug')
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            conn.execute(_text('VACUUM'))
+            conn.execute(_text('PRAGMA wal_checkpoint(TRUNCATE)'))
+
     ##########################################################################
     #                               Internals                                #
     ##########################################################################
@@ -500,6 +596,36 @@ def get_queue_manager():
     return get_server()
 
 
+class _RunnerInbox(object):
+
+    """Send messages to the job_runner over a pipe.
+
+    The job_runner waits on the reader connection together with the
+    sentinels of its jobs. Puts are locked, as the server makes them from
+    many threads.
+    """
+
+    def __init__(self):
+        """Open the pipe, reader is passed to the job_runner."""
+        self.reader, self._writer = mp.Pipe(duplex=False)
+        self._lock = _threading.Lock()
+
+    @property
+    def closed(self):
+        """True once close() was called."""
+        return self._writer.closed
+
+    def put(self, item):
+        """Send item to the job_runner."""
+        with self._lock:
+            self._writer.send(item)
+
+    def close(self):
+        """Close the sending end of the pipe."""
+        with self._lock:
+            self._writer.close()
+
+
 @Pyro4.expose
 class QueueManager(object):
 
@@ -517,14 +643,29 @@ class QueueManager(object):
     max_jobs : int
         The maximum number of jobs to run at one time. Defaults to current
         CPUs - 1
+    seq : int
+        The sequence number of the last change to the database, every
+        change to a job stores a new number in its seq column
+    epoch : str
+        A random token for this server, sequence numbers from another server
+        are not comparable
     """
 
     jobs = {}
     all_jobs = []
     max_jobs = None
-    inqueue  = mp.Queue()
+    inqueue  = _RunnerInbox()
     outqueue = mp.Queue()
 
+    _last_clean = 0  # Time of the last clean()
+    _cleaned    = 0  # Jobs cleaned since the last compaction
+
+    seq   = 0
+    epoch = None
+    _deleted       = None  # deque of (seq, [job IDs]) deleted by clean()
+    _deleted_floor = 0     # get_changes() sends all jobs if older than this
+    _seq_lock      = _threading.Lock()
+
     _job_runner = None
 
     def __init__(self, daemon, max_jobs=None):
@@ -550,6 +691,7 @@ class QueueManager(object):
         self.db = LocalQueue(DATABASE)
         self.daemon = daemon
         self.all_jobs = [i[0] for i in self.db.query(Job.jobno).all()]
+        self._start_changes()
         self.check_runner()
         # Set all existing to disappeared, as they must be dead if we are
         # starting again
@@ -561,6 +703,7 @@ class QueueManager(object):
         for job in q.all():
             bad.append(str(job.jobno))
             job.state = 'killed'
+            job.seq   = self.seq
         session.commit()
         session.close()
         if bad:
@@ -574,7 +717,8 @@ class QueueManager(object):
 
     @Pyro4.expose
     def submit(self, command, name, threads=1, dependencies=None,
-               stdout=None, stderr=None, runpath=None):
+               stdout=None, stderr=None, runpath=None, array_job=None,
+               array_id=None):
         """Submit a job and add it to the database.
 
         Parameters
@@ -591,6 +735,9 @@ class QueueManager(object):
             A path to a file to write STDOUT and STDERR to respectively
         runpath : str, optional
             A path to execute the command in
+        array_job, array_id : int, optional
+            The first jobno and the task id of an array task, if array_id is
+            set without array_job, this job is the first task.
 
         Returns
         -------
@@ -622,18 +769,25 @@ class QueueManager(object):
             job.errfile = stderr
         if runpath:
             job.runpath = runpath
-        try:
-            session.add(job)
-        except InvalidRequestError:
-            # In case open in another thread
-            local_job = session.merge(job)
-            other_session = session.object_session(job)
-            session.add(local_job)
+        if array_id is not None:
+            job.array_id  = int(array_id)
+            job.array_job = array_job
+        with self._seq_lock:
+            job.seq = self._next_seq()
+            try:
+                session.add(job)
+            except InvalidRequestError:
+                # In case open in another thread
+                local_job = session.merge(job)
+                other_session = session.object_session(job)
+                session.add(local_job)
+                session.commit()
+                other_session.close()
+            session.flush()
+            jobno = int(job.jobno)
+            if array_id is not None and array_job is None:
+                job.array_job = jobno
             session.commit()
-            other_session.close()
-        session.flush()
-        jobno = int(job.jobno)
-        session.commit()
         session.close()
         self.check_runner()
         self.inqueue.put(
@@ -644,6 +798,44 @@ class QueueManager(object):
         self.all_jobs.append(jobno)
         return jobno
 
+    @Pyro4.expose
+    def submit_array(self, command, name, tasks, threads=1,
+                     dependencies=None, stdout=None, stderr=None,
+                     runpath=None):
+        """Submit one job per array task, the task id is in the environment.
+
+        Each task runs with FYRD_ARRAY_TASK_ID set and writes its outputs to
+        stdout and stderr with -<task id> appended.
+
+        Parameters
+        ----------
+        command : str
+            A full executable shell script/shell command.
+        name : str
+            A name to give the job
+        tasks : list of int
+            The task ids
+        threads, dependencies, stdout, stderr, runpath
+            As for submit()
+
+        Returns
+        -------
+        jobno : int
+            The jobno of the first task, used as the id of the whole array
+        """
+        first = None
+        for task in tasks:
+            jobno = self.submit(
+                'FYRD_ARRAY_TASK_ID={} {}'.format(task, command), name,
+                threads=threads, dependencies=dependencies,
+                stdout='{}-{}'.format(stdout, task) if stdout else None,
+                stderr='{}-{}'.format(stderr, task) if stderr else None,
+                runpath=runpath, array_job=first, array_id=task
+            )
+            if first is None:
+                first = jobno
+        return first
+
     @Pyro4.expose
     def get(self, jobs=None, preclean=True):
         """Return a list of updated jobs.
@@ -659,20 +851,72 @@ class QueueManager(object):
         -------
         jobs : list of tuple
             [(jobno, name, command, state, threads,
-              exitcode, runpath, outfile, errfile)]
+              exitcode, runpath, outfile, errfile, array_job, array_id)]
+            Passing the jobno of the first task of an array gets all tasks.
         """
         if preclean:
             self.clean()
+        if jobs:
+            jobs = [jobs] if isinstance(jobs, (_int, _str, _txt)) else jobs
+            jobs = [int(j) for j in jobs]
+            return self._job_tuples(
+                Job.jobno.in_(jobs) | Job.array_job.in_(jobs)
+            )
+        return self._job_tuples()
+
+    @Pyro4.expose
+    def get_changes(self, token=None):
+        """Return only the jobs changed or deleted since token.
+
+        Clients keep the returned token and pass it on their next call, so a
+        poll only sends the jobs that changed instead of the whole history.
+        If the token is from another server, or older than the deletions
+        kept from the last DELETED_LOG cleans, all jobs are sent and full is
+        True.
+
+        Parameters
+        ----------
+        token : list, optional
+            The token returned by the last call, None gets all jobs
+
+        Returns
+        -------
+        token : list
+            [epoch, seq], pass to the next call
+        full : bool
+            True if jobs contains every job in the database
+        jobs : list of tuple
+            As returned by get()
+        deleted : list of int
+            Job numbers (array jobs by their first task) deleted since token,
+            empty if full
+        """
+        self.clean()
+        epoch, since = token if token else (None, 0)
+        since = int(since)
+        with self._seq_lock:
+            # Every change up to seq is committed while we hold the lock
+            seq  = self.seq
+            full = epoch != self.epoch or since < self._deleted_floor
+            deleted = set()
+            if not full:
+                for deleted_seq, job_ids in self._deleted:
+                    if deleted_seq > since:
+                        deleted.update(job_ids)
+        if full:
+            return [self.epoch, seq], True, self._job_tuples(), []
+        return ([self.epoch, seq], False, self._job_tuples(Job.seq > since),
+                sorted(deleted))
+
+    def _job_tuples(self, *filters):
+        """Return tuples of the jobs matching filters, ordered by jobno."""
         session = self.db.get_session()
         # Pyro cannot serialize Job objects, so we get a tuple instead
         q = session.query(
             Job.jobno, Job.name, Job.command, Job.state, Job.threads,
-            Job.exitcode, Job.runpath, Job.outfile, Job.errfile
-        )
-        if jobs:
-            jobs = [jobs] if isinstance(jobs, (_int, _str, _txt)) else jobs
-            jobs = [int(j) for j in jobs]
-            q = q.filter(Job.jobno.in_(jobs))
+            Job.exitcode, Job.runpath, Job.outfile, Job.errfile,
+            Job.array_job, Job.array_id
+        ).filter(*filters).order_by(Job.jobno)
         res = q.all()
         session.close()
         return res
@@ -681,8 +925,9 @@ class QueueManager(object):
     def clean(self, days=None):
         """Delete all jobs in the queue older than days days.
 
-        Very fast if no jobs are older than the cutoff as the query returns
-        an empty set.
+        A single indexed DELETE, the database is compacted after every
+        COMPACT_ROWS deleted jobs. Without days, this is skipped if the last
+        clean was less than CLEAN_INTERVAL seconds ago.
 
         Parameters
         ----------
@@ -692,27 +937,29 @@ class QueueManager(object):
         if days:
             clean_days = int(days)
         else:
+            # Automatic cleans only run every CLEAN_INTERVAL seconds
+            if _time() - self._last_clean < CLEAN_INTERVAL:
+                return
             clean_days = int(_conf.get_option(
                 'local', 'local_clean_days',CLEAN_OLDER_THAN
             ))
+        self._last_clean = _time()
         current_time = _dt.now()
         cutoff = current_time - _td(days=clean_days)
-        jobs = self.db.query().filter(Job.submit_time < cutoff).all()
-        if not jobs:
+        count, job_ids = self.db.delete_older_than(cutoff)
+        if not count:
             return
-        session = self.db.get_session()
-        for job in jobs:
-            try:
-                session.delete(job)
-            except InvalidRequestError:
-                # In case open in another thread
-                local_job = session.merge(job)
-                other_session = session.object_session(job)
-                session.delete(local_job)
-                session.commit()
-                other_session.close()
-        session.commit()
-        session.close()
+        with self._seq_lock:
+            # Deleted rows cannot be found by seq, so log them for clients
+            self._deleted.append((self._next_seq(), job_ids))
+            while len(self._deleted) > DELETED_LOG:
+                self._deleted_floor = self._deleted.popleft()[0]
+        _logme.log('Cleaned {} old jobs from the local queue'.format(count),
+                   'debug')
+        self._cleaned += count
+        if self._cleaned >= COMPACT_ROWS:
+            self.db.compact()
+            self._cleaned = 0
 
     @Pyro4.expose
     def kill(self, jobs):
@@ -721,6 +968,12 @@ class QueueManager(object):
         Parameters
         ----------
         jobs : list of int
+            Passing the jobno of the first task of an array kills all tasks.
+
+        Returns
+        -------
+        bool
+            False if any job does not exist or is not yet dead
         """
         if isinstance(jobs, (_str, _txt)):
             jobs = [int(jobs)]
@@ -731,9 +984,14 @@ class QueueManager(object):
                 jobs = list(jobs)
             except TypeError:
                 jobs = [jobs]
+        jobs = [int(job) for job in jobs]
+        # Check every job, so all unknown ones are logged
+        if not all([self.check_jobno(job) for job in jobs]):
+            return False
+        # Kill every task of arrays
+        jobs = [i[0] for i in self.get(jobs, preclean=False)]
         for job in jobs:
-            self.check_jobno(job)
-            self.inqueue.put('kill', int(job))
+            self.inqueue.put(('kill', int(job)))
         jobs = self.get(jobs)
         ok_states = ['killed', 'completed', 'failed']
         for job in jobs:
@@ -771,10 +1029,70 @@ class QueueManager(object):
             job.exitcode = exitcode
         if isinstance(pid, int):
             job.pid = pid
-        session.flush()
-        session.commit()
+        with self._seq_lock:
+            job.seq = self._next_seq()
+            session.flush()
+            session.commit()
         session.close()
 
+    @Pyro4.expose
+    def update_jobs(self, updates):
+        """Apply many job updates in a single transaction.
+
+        Rows are updated with one executemany UPDATE per set of changed
+        columns, without loading any Job objects. All rows get the same new
+        seq.
+
+        Parameters
+        ----------
+        updates : list of tuple
+            `[(jobno, state, exitcode, pid), ...]`, None values are left
+            unchanged, later updates of the same job win.
+        """
+        rows = {}  # {jobno: {column: value}}
+        for jobno, state, exitcode, pid in updates:
+            row = rows.setdefault(int(jobno), {})
+            if state:
+                row['state'] = state
+            if isinstance(exitcode, int):
+                row['exitcode'] = exitcode
+            if isinstance(pid, int):
+                row['pid'] = pid
+        groups = {}  # {columns: [params, ...]}
+        for jobno, row in rows.items():
+            if not row:
+                continue
+            params = {'b_' + k: v for k, v in row.items()}
+            params['b_jobno'] = jobno
+            groups.setdefault(tuple(sorted(row)), []).append(params)
+        if not groups:
+            return
+        table = Job.__table__
+        with self._seq_lock, self.db.engine.begin() as conn:
+            seq = self._next_seq()
+            for columns, params in groups.items():
+                values = {k: _bindparam('b_' + k) for k in columns}
+                values['seq'] = seq
+                conn.execute(
+                    table.update()
+                    .where(table.c.jobno == _bindparam('b_jobno'))
+                    .values(values),
+                    params
+                )
+
+    def _start_changes(self):
+        """Start a new change feed, clients of an older one get all jobs."""
+        with self._seq_lock:
+            self.epoch = _uuid().hex
+            self.seq   = (self.db.query(_func.max(Job.seq)).scalar() or 0) + 1
+            self._deleted       = _deque()
+            self._deleted_floor = 0
+
+    def _next_seq(self):
+        """Return a new sequence number, call with _seq_lock held."""
+        self.seq += 1
+        return self.seq
+
     #  def _housekeeping(self):
         #  """Run by Pyro4, update all_jobs, db cache, and clean up."""
         #  self.clean()
@@ -795,7 +1113,7 @@ class QueueManager(object):
     def shutdown_jobs(self):
         """Kill all jobs and terminate."""
         result = None
-        if not self.inqueue._closed:
+        if not self.inqueue.closed:
             self.inqueue.put('stop')
             print('waiting for jobs to terminate gracefully')
             try:
@@ -836,7 +1154,7 @@ class QueueManager(object):
             return self._job_runner
         runner = mp.Process(
             target=job_runner,
-            args=(self.inqueue, self.outqueue, self.max_jobs)
+            args=(self.inqueue.reader, self.outqueue, self.max_jobs)
         )
         runner.start()
         self._job_runner = runner
@@ -900,15 +1218,146 @@ class QueueManager(object):
         #  )
 
 
+def _run_job(command, stdout, stderr):
+    """Run a job command, exit with its exit code."""
+    code = _run.cmd(command, stdout=stdout, stderr=stderr)[0]
+    sys.exit(code)
+
+
+class _DependencyGraph(object):
+
+    """Queued jobs of the job_runner, indexed by their dependencies.
+
+    Every queued job has a count of unfinished dependencies and every job a
+    list of the jobs depending on it, so finishing a job only touches its
+    dependents. Jobs with no unfinished dependencies wait in a heap ordered
+    by jobno, i.e. in submission order.
+
+    A failed or killed job cancels every job depending on it, recursively.
+    """
+
+    def __init__(self):
+        """Create an empty graph."""
+        self.jobs       = {}  # {jobno: info} of queued jobs
+        self.unresolved = {}  # {jobno: unfinished dependency count}
+        self.dependents = {}  # {jobno: [dependent jobno, ...]}
+        self.finished   = {}  # {jobno: True if successful}
+        self.ready      = []  # Heap of jobnos with no unfinished dependencies
+
+    def add(self, jobno, info, depends=None):
+        """Queue a job.
+
+        Parameters
+        ----------
+        jobno : int
+        info : dict
+            Must have 'threads'
+        depends : list of int, optional
+
+        Returns
+        -------
+        cancelled : list of int
+            [jobno] if a dependency already failed, else empty
+        """
+        self.jobs[jobno] = info
+        count  = 0
+        failed = False
+        for dep in set(depends or []):
+            if dep in self.finished:
+                failed = failed or not self.finished[dep]
+            else:
+                self.dependents.setdefault(dep, []).append(jobno)
+                count += 1
+        if failed:
+            self.jobs.pop(jobno)
+            self.finished[jobno] = False
+            return [jobno] + self.finish(jobno, False)
+        self.unresolved[jobno] = count
+        if not count:
+            _heapq.heappush(self.ready, jobno)
+        return []
+
+    def pop(self, cores):
+        """Remove and return the ready jobs that fit into cores.
+
+        Jobs are taken in jobno order, jobs too big for the remaining cores
+        are skipped for smaller ones and stay ready.
+
+        Returns
+        -------
+        list
+            [(jobno, info), ...]
+        """
+        started = []
+        skipped = []
+        while self.ready and cores > 0:
+            jobno = _heapq.heappop(self.ready)
+            if jobno not in self.unresolved:
+                continue  # Killed while ready
+            info = self.jobs[jobno]
+            if info['threads'] > cores:
+                skipped.append(jobno)
+                continue
+            cores -= info['threads']
+            self.jobs.pop(jobno)
+            self.unresolved.pop(jobno)
+            started.append((jobno, info))
+        for jobno in skipped:
+            _heapq.heappush(self.ready, jobno)
+        return started
+
+    def finish(self, jobno, success=True):
+        """Record a job as finished, or remove it from the queue if killed.
+
+        Parameters
+        ----------
+        jobno : int
+        success : bool, optional
+            False cancels every job depending on this one
+
+        Returns
+        -------
+        cancelled : list of int
+            The dependent jobs that were cancelled
+        """
+        self.jobs.pop(jobno, None)
+        self.unresolved.pop(jobno, None)
+        self.finished[jobno] = success
+        if success:
+            for child in self.dependents.pop(jobno, []):
+                if child in self.unresolved:
+                    self.unresolved[child] -= 1
+                    if not self.unresolved[child]:
+                        _heapq.heappush(self.ready, child)
+            return []
+        cancelled = []
+        stack = self.dependents.pop(jobno, [])
+        while stack:
+            child = stack.pop()
+            if child not in self.jobs:
+                continue
+            self.jobs.pop(child)
+            self.unresolved.pop(child, None)
+            self.finished[child] = False
+            cancelled.append(child)
+            stack.extend(self.dependents.pop(child, []))
+        return cancelled
+
+    def __len__(self):
+        """The number of queued jobs."""
+        return len(self.jobs)
+
+
 def job_runner(inqueue, outqueue, max_jobs):
     """Run jobs with dependency tracking.
 
-    Terminate by sending 'stop' to inqueue
+    Terminate by sending 'stop' to inqueue. Jobs depending on a job that
+    failed or was killed are cancelled.
 
     Parameters
     ----------
-    inqueue : multiprocessing.Queue
-        inqueue puts must be in the form : (command, extra):
+    inqueue : multiprocessing.connection.Connection
+        The reader of a pipe, messages must be in the form (command, extra):
             `('stop')` : immediately shutdown this process
             `('queue', job_info)` : queue and run this job
             `('kill', jobno)` : immediately kill this job
@@ -954,32 +1403,35 @@ def job_runner(inqueue, outqueue, max_jobs):
         max_jobs = 4
     available_cores = max_jobs
     running = {}     # {jobno: Process}
-    queued  = _OD()  # {jobno: {'command': command, 'depends': depends, ...}
-    done    = {}     # {jobno: Process}
-    jobs    = []     # [jobno, ...]
+    queued  = _DependencyGraph()
+    jobs    = set()  # {jobno, ...}
+    killed  = set()  # Running jobs that were killed, not yet exited
+    waiting = {}     # {Process.sentinel: jobno} of running jobs
+    updates = []     # [(jobno, state, exitcode, pid)], sent once per pass
     put_core_info = False
     while True:
-        # Get everything from the input queue first, queue everything
-        while True:
-            if inqueue.empty():
-                break
-            info = inqueue.get()  # Will block if input queue empty
+        # Block until a message arrives or a job exits, no polling
+        ready = _wait([inqueue] + list(waiting))
+        # Get everything from the input pipe first, queue everything
+        while inqueue.poll():
+            info = inqueue.recv()
             if info == 'stop' or info[0] == 'stop':
                 good = True
                 pids = []
                 if running:
                     good = False
                     for jobno, job in running.items():
-                        qserver.update_job(jobno, state='killed')
+                        updates.append((jobno, 'killed', None, None))
                         pids.append(job.pid)
                         job.terminate()
                 if queued:
                     good = False
-                    for jobno, job in queued.items():
-                        qserver.update_job(jobno, state='killed')
+                    for jobno in queued.jobs:
+                        updates.append((jobno, 'killed', None, None))
                 for pid in pids:
                     if _pid_exists(pid):
                         _os.kill(pid, _signal.SIGKILL)
+                qserver.update_jobs(updates)
                 outqueue.put(good)
                 return good
             if info == 'available_cores' or info[0] == 'available_cores':
@@ -987,13 +1439,15 @@ def job_runner(inqueue, outqueue, max_jobs):
                 continue
             if info[0] == 'kill':
                 jobno = int(info[1])
-                if jobno in running:
+                if jobno in running and jobno not in killed:
+                    # Reaped when its sentinel fires
                     running[jobno].terminate()
-                    qserver.update_job(jobno, state='killed')
-                    running.pop(jobno)
-                if jobno in queued:
-                    queued.pop(jobno)
-                    qserver.update_job(jobno, state='killed')
+                    killed.add(jobno)
+                    updates.append((jobno, 'killed', None, None))
+                if jobno in queued.jobs:
+                    updates.append((jobno, 'killed', None, None))
+                    for child in queued.finish(jobno, False):
+                        updates.append((child, 'cancelled', None, None))
                 continue
             if info[0] != 'queue':
                 raise QueueError('Invalid argument: {0}'.format(info[0]))
@@ -1010,26 +1464,33 @@ def job_runner(inqueue, outqueue, max_jobs):
             if jobno in jobs:
                 # This should never happen
                 raise QueueError('Job already submitted!')
-            jobs.append(jobno)
-            queued[jobno] = {'command': command, 'threads': threads,
-                             'depends': depends, 'stdout': stdout,
-                             'stderr': stderr, 'runpath': runpath}
-            qserver.update_job(jobno, state='pending')
-        # Update running and done queues
-        for jobno, process in running.items():
-            if process.is_alive():
+            jobs.add(jobno)
+            updates.append((jobno, 'pending', None, None))
+            cancelled = queued.add(
+                jobno, {'command': command, 'threads': threads,
+                        'stdout': stdout, 'stderr': stderr,
+                        'runpath': runpath},
+                [int(i) for i in depends] if depends else None
+            )
+            for child in cancelled:
+                updates.append((child, 'cancelled', None, None))
+        # Collect the jobs that exited
+        for sentinel in ready:
+            if sentinel not in waiting:
                 continue
-            # Completed
+            jobno = waiting.pop(sentinel)
+            process = running.pop(jobno)
             process.join()
-            code = process.exitcode
-            state = 'completed' if code == 0 else 'failed'
-            qserver.update_job(jobno, state=state, exitcode=code)
-            done[jobno] = process
-        # Remove completed jobs from running
-        for jobno in done:
-            if jobno in running:
-                p = running.pop(jobno)
-                available_cores += p.cores
+            available_cores += process.cores
+            if jobno in killed:
+                killed.discard(jobno)
+                code = None
+            else:
+                code = process.exitcode
+                state = 'completed' if code == 0 else 'failed'
+                updates.append((jobno, state, code, None))
+            for child in queued.finish(jobno, code == 0):
+                updates.append((child, 'cancelled', None, None))
         # Start jobs if can run
         if available_cores > max_jobs:
             available_cores = max_jobs
@@ -1038,40 +1499,27 @@ def job_runner(inqueue, outqueue, max_jobs):
         if put_core_info:
             outqueue.put(available_cores)
             put_core_info = False
-        for jobno, info in queued.items():
-            if info['depends']:
-                not_done = []
-                for dep_id in info['depends']:
-                    if dep_id not in done:
-                        not_done.append(dep_id)
-                if not_done:
-                    continue
-            if info['threads'] <= available_cores:
-                if info['runpath']:
-                    curpath = _os.path.abspath('.')
-                    _os.chdir(info['runpath'])
-                p = mp.Process(
-                    target=_run.cmd,
-                    args=(info['command'],),
-                    kwargs={
-                        'stdout': info['stdout'],
-                        'stderr': info['stderr'],
-                    }
-                )
-                p.daemon = True
-                p.start()
-                running[jobno] = p
-                available_cores -= info['threads']
-                p.cores = info['threads']
-                if info['runpath']:
-                    _os.chdir(curpath)
-            qserver.update_job(jobno, state='running', pid=p.pid)
-        # Clear running jobs from queue
-        for jobno in running:
-            if jobno in queued:
-                queued.pop(jobno)
-        # Block for a moment to avoid running at 100% cpu
-        _sleep(SLEEP_LEN)
+        for jobno, info in queued.pop(available_cores):
+            if info['runpath']:
+                curpath = _os.path.abspath('.')
+                _os.chdir(info['runpath'])
+            p = mp.Process(
+                target=_run_job,
+                args=(info['command'], info['stdout'], info['stderr'])
+            )
+            p.daemon = True
+            p.start()
+            running[jobno] = p
+            waiting[p.sentinel] = jobno
+            available_cores -= info['threads']
+            p.cores = info['threads']
+            if info['runpath']:
+                _os.chdir(curpath)
+            updates.append((jobno, 'running', None, p.pid))
+        # One database transaction for everything that changed
+        if updates:
+            qserver.update_jobs(updates)
+            updates = []
 
 
 ###############################################################################
@@ -1330,6 +1778,18 @@ def normalize_job_id(job_id):
     return str(int(job_id)), None
 
 
+def parse_array(array):
+    """Convert an array string like '1-10,12' into a list of task ids."""
+    tasks = []
+    for part in str(array).split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            tasks += list(range(int(start), int(end)+1))
+        elif part:
+            tasks.append(int(part))
+    return tasks
+
+
 def normalize_state(state):
     """Convert state into standardized (slurm style) state."""
     state = state.lower()
@@ -1426,7 +1886,8 @@ def submit(script, dependencies=None, job=None, args=None, kwds=None):
     """
     job._mode = 'remote'
     params = {}
-    needed_params = ['cores', 'outfile', 'errfile', 'runpath', 'name']
+    needed_params = ['cores', 'outfile', 'errfile', 'runpath', 'name',
+                     'array']
     if job:
         params['cores'] = job.cores
         params['outfile'] = job.outfile
@@ -1462,11 +1923,19 @@ def submit(script, dependencies=None, job=None, args=None, kwds=None):
     _logme.log("Submitting job '{}' with params: {}".format(command,
                                                             str(params)),
                'debug')
-    jobno = server.submit(
-        command, params['name'], threads=params['cores'],
-        dependencies=dependencies, stdout=params['outfile'],
-        stderr=params['errfile'], runpath=params['runpath']
-    )
+    if params['array']:
+        jobno = server.submit_array(
+            command, params['name'], parse_array(params['array']),
+            threads=params['cores'], dependencies=dependencies,
+            stdout=params['outfile'], stderr=params['errfile'],
+            runpath=params['runpath']
+        )
+    else:
+        jobno = server.submit(
+            command, params['name'], threads=params['cores'],
+            dependencies=dependencies, stdout=params['outfile'],
+            stderr=params['errfile'], runpath=params['runpath']
+        )
     job._mode = 'local'
     return str(jobno)
 
@@ -1497,7 +1966,7 @@ def kill(job_ids):
 ###############################################################################
 
 
-def queue_parser(user=None, partition=None):
+def queue_parser(user=None, partition=None, job_id=None):
     """Iterator for queue parsing.
 
     Simply ignores user and partition requests.
@@ -1508,6 +1977,8 @@ def queue_parser(user=None, partition=None):
         User name to pass to qstat to filter queue with
     partition : str, NOT IMPLEMENTED
         Partition to filter the queue with
+    job_id : str or list, optional
+        Job ID or IDs to get from the database
 
     Yields
     ------
@@ -1523,11 +1994,55 @@ def queue_parser(user=None, partition=None):
     exit_code : int or Nonw
     """
     server = get_server(start=True)
+    jobs = None
+    if job_id:
+        jobs = [int(j) for i in _run.listify(job_id)
+                for j in str(i).split(',') if j.strip().isdigit()]
+    # Get all jobs in the database if no IDs
+    for job in _parse_jobs(server.get(jobs)):
+        yield job
+
+
+def queue_changes(token=None, user=None, partition=None):
+    """Return only the jobs changed since the last call.
+
+    Used by fyrd.queue.Queue instead of queue_parser for updates without job
+    IDs. Every Queue keeps its own token, so the server only sends the jobs
+    that changed since that Queue last asked.
+
+    Parameters
+    ----------
+    token : list, optional
+        The token returned by the last call, None gets all jobs
+    user : str, NOT IMPLEMENTED
+    partition : str, NOT IMPLEMENTED
+
+    Returns
+    -------
+    token : list
+        Pass to the next call
+    full : bool
+        True if jobs has every job, jobs missing from it are gone
+    jobs : iterator
+        The changed jobs, in the same format as queue_parser
+    deleted : list of str
+        IDs of jobs deleted from the queue since token, empty if full
+    """
+    server = get_server(start=True)
+    token, full, jobs, deleted = server.get_changes(token)
+    return token, full, _parse_jobs(jobs), [str(i) for i in deleted]
+
+
+def _parse_jobs(jobs):
+    """Yield queue_parser rows from QueueManager.get() tuples."""
     user = _getpass.getuser()
     host = _socket.gethostname()
-    for job in server.get():  # Get all jobs in the database
+    for job in jobs:
         job_id     = str(job[0])
         array_id   = None
+        if job[10] is not None:
+            job_id   = str(job[9])
+            array_id = str(job[10])
         name       = job[1]
         userid     = user
         partition  = None
@@ -1563,7 +2078,7 @@ def parse_strange_options(option_dict):
         Ends up in the `args` parameter of the submit function
     """
     outlist = []
-    good_items = ['outfile', 'cores', 'errfile', 'runpath']
+    good_items = ['outfile', 'cores', 'errfile', 'runpath', 'array']
     for opt, var in option_dict.items():
         if opt in good_items:
             outlist.append((opt, var))
@@ -5,7 +5,7 @@ LSF parsing functions.
 import os as _os
 import re as _re
 import sys as _sys
-import pwd as _pwd     # Used to get usernames for queue
+import json as _json
 import datetime as _dt
 
 from six import text_type as _txt
@@ -17,11 +17,13 @@ import Pyro4
 from .. import run as _run
 from .. import conf as _conf
 from .. import logme as _logme
+from .. import throttle as _throttle
 from .. import ClusterError as _ClusterError
 from .. import script_runners as _scrpts
 from .. import submission_scripts as _sscrpt
 
 from .base import BatchSystemClient, BatchSystemServer
+from .nodeset import NodeSet as _NodeSet
 
 _Script = _sscrpt.Script
 
@@ -42,11 +44,37 @@ LSF_SLURM_STATES = {
     'ZOMBI': 'killed'       # ZOMBI: In zombi state
 }
 
+# bjobs -o fields used by queue_parser
+BJOBS_FIELDS = [
+    'jobid', 'name', 'user', 'queue', 'stat',
+    'exec_host', 'nexec_host', 'slots', 'exit_code'
+]
+# The same fields as named in bjobs -json records
+BJOBS_KEYS = [
+    'JOBID', 'JOB_NAME', 'USER', 'QUEUE', 'STAT',
+    'EXEC_HOST', 'NEXEC_HOST', 'SLOTS', 'EXIT_CODE'
+]
+BJOBS_DELIM = '\x1f'  # ASCII unit separator, for LSF without -json
+
+# Parsing expressions, compiled once
+JOB_QUERY     = _re.compile(r'(\d+)(\[(\d+)\])?')    # 1234[1]
+SUBMIT_QUERY  = _re.compile(r'<(\d+)>')               # Job <1234> is...
+TIME_QUERY    = _re.compile(r'^([^ELX]+)( [ELX])?$')  # Aug 18 14:31 E
+ELAPSED_QUERY = _re.compile(r'^(\d+) second\(s\)$')   # 122 second(s)
+
+# Errors from bjobs versions without the -json option
+_NO_JSON = _re.compile(r'illegal option|invalid option|usage', _re.I)
+
 
 @Pyro4.expose
 class LSFServer(BatchSystemServer):
     NAME = 'lsf'
 
+    def __init__(self):
+        """Create the server, bjobs -json support is checked on first use."""
+        super(LSFServer, self).__init__()
+        self._bjobs_json = True
+
     def metrics(self, job_id=None):
         """Iterator to get metrics from LSF system.
 
@@ -96,7 +124,7 @@ class LSFServer(BatchSystemServer):
             bjobs = [
                 [k[i:i+fwdth].strip() if field != none else "Not Available"
                      for i, field in zip(range(0, fwdth*flen, fwdth), fields)]
-                for k in _run.cmd(qargs)[1].split('\n')
+                for k in _throttle.cmd('query', qargs)[1].split('\n')
             ]
         except Exception as e:
             _logme.log('Error running bjobs to get the metrics: {}'
@@ -161,8 +189,7 @@ class LSFServer(BatchSystemServer):
         # Look for job_id and array_id.
         # Arrays are specified in LSF using the following syntax:
         #   - job_id[array_id] (e.g. 1234[1])
-        jobquery = _re.compile(r'(\d+)(\[(\d+)\])?')
-        job_id, _, array_id = jobquery.match(job_id).groups()
+        job_id, _, array_id = JOB_QUERY.match(job_id).groups()
 
         return job_id, array_id
 
@@ -193,8 +220,7 @@ class LSFServer(BatchSystemServer):
             return 'None'
 
         # Remove optional job estimation modifiers [ELX]
-        timequery = _re.compile(r'^([^ELX]+)( [ELX])?$')
-        lsf_time, est_mod = timequery.match(lsf_time).groups()
+        lsf_time, est_mod = TIME_QUERY.match(lsf_time).groups()
 
         # Convert to LSF time
         date = _dt.datetime.strptime(lsf_time, LSF_FORMAT)
@@ -215,8 +241,7 @@ class LSFServer(BatchSystemServer):
             return '00:00'
 
         # Parse seconds from LSF format
-        elapsedquery = _re.compile(r'^(\d+) second\(s\)$')
-        lsf_elapsed = int(elapsedquery.match(lsf_elapsed).groups()[0])
+        lsf_elapsed = int(ELAPSED_QUERY.match(lsf_elapsed).groups()[0])
 
         # Convert to LSF elapsed format
         elapsed = _dt.timedelta(seconds=lsf_elapsed)
@@ -293,12 +318,11 @@ class LSFServer(BatchSystemServer):
         else:
             args = ['bsub', '<', script_file_name]
         # Try to submit job 5 times
-        code, stdout, stderr = _run.cmd(args, tries=5)
+        code, stdout, stderr = _throttle.cmd('submit', args, tries=5)
         if code == 0:
             # Job id is returned like this by LSF:
             #   'Job <165793> is submitted to queue <sequential>.'
-            jobquery = _re.compile(r'<(\d+)>')
-            job_id, _ = self.normalize_job_id(jobquery.findall(stdout)[0])
+            job_id, _ = self.normalize_job_id(SUBMIT_QUERY.findall(stdout)[0])
         else:
             _logme.log('bsub failed with code {}\n'.format(code) +
                        'stdout: {}\nstderr: {}'.format(stdout, stderr),
@@ -325,8 +349,10 @@ class LSFServer(BatchSystemServer):
         -------
         success : bool
         """
-        o = _run.cmd('bkill {0}'.format(' '.join(_run.listify(job_ids))),
-                     tries=5)
+        o = _throttle.cmd(
+            'submit', 'bkill {0}'.format(' '.join(_run.listify(job_ids))),
+            tries=5
+        )
         return o[0] == 0
 
     ###########################################################################
@@ -346,8 +372,9 @@ class LSFServer(BatchSystemServer):
             User name to pass to bjobs to filter queue with
         partiton : str, optional
             Partition to filter the queue with
-        job_id: str, optional
-            Job ID to filter the queue with
+        job_id: str or list, optional
+            Job ID or IDs to filter the queue with, passed to bjobs in
+            batches of ID_BATCH.
 
         Yields
         ------
@@ -357,113 +384,159 @@ class LSFServer(BatchSystemServer):
         userid : str
         partition : str
         state :str
-        nodelist : list
+        nodelist : NodeSet
         numnodes : int
         cntpernode : int or None
         exit_code : int or None
         """
-        try:
-            if job_id:
-                int(job_id)
-        except ValueError:
-            job_id = None
+        ids = self._filter_ids(job_id)
+        idset = set(ids) if ids else None
+        for batch in self._id_batches(ids):
+            for binfo in self._bjobs(user, partition, batch):
+                binfo = self._parse_row(binfo, user, partition, idset)
+                if binfo:
+                    yield binfo
 
-        fwdth = 400  # Used for fixed-width parsing of bjobs
-        fields = [
-            'jobid', 'name', 'user', 'queue', 'stat',
-            'exec_host', 'nexec_host', 'slots', 'exit_code'
-        ]
-        flen = len(fields)
+    def _bjobs(self, user=None, partition=None, job_ids=None):
+        """Yield bjobs rows as tuples of strings.
+
+        Uses `bjobs -json` on LSF 10 and newer. If bjobs does not know the
+        option, this and all later queries use delimited output read line by
+        line instead.
+
+        Parameters
+        ----------
+        user : str, optional
+        partition : str, optional
+        job_ids : list of str, optional
 
+        Yields
+        ------
+        tuple
+            (jobid, name, user, queue, stat, exec_host, nexec_host, slots,
+             exit_code)
+        """
         # Arguments used for bjobs:
         #   - noheader: remove header from 1st row
         #   - a: show jobs in all states
         #   - X: display uncondensed output for hosts
         #   - o: customized output formats
+        #   - u, q: filter by user and queue in the scheduler
+        #   - job IDs last, if any
         #
-        qargs = [
-            'bjobs', '-noheader', '-a', '-X', '-o',
-            '"{}"'.format(' '.join(['{0}:{1}'.format(field, fwdth)
-                                    for field in fields]))
-        ]
-        #
-        # Parse queue info by length
-        #  - Each job entry is separated by '\n'
-        #  - Each job entry is a tuple with each field value
-        # [ (fld1, fld2, fl3, ...), (...) ]
-        #
-        # bjobs returns 'No unfinished job found' on stderr when list is empty
-        #
-        bjobs = [
-            tuple(
-                [k[i:i+fwdth].strip() for i in range(0, fwdth*flen, fwdth)]
-            ) for k in _run.cmd(qargs)[1].split('\n') if k
-        ]
-
-        # Sanitize data
-        for binfo in bjobs:
-
-            if len(binfo) == len(fields):
-                # jobid -> bid ($jobid)
-                # name -> bname ($job_name | $job_name[#array_num])
-                # user -> buser ($user_name)
-                # queue -> bpartition ($queue)
-                # stat -> bstate (PEND | RUN | DONE | EXIT...)
-                # exec_host -> bndlst (cpus*nodeid:cpus*nodeid...)
-                # nexec_host -> bnodes ($num_nodes)
-                # slots -> bcpus ($total_tasks)
-                # exit_code -> bcode ($exit_code)
-                [bid, bname, buser, bpartition, bstate,
-                 bndlst, bnodes, bcpus, bcode] = binfo
+        filters = []
+        if user:
+            filters += ['-u', user]
+        if partition:
+            filters += ['-q', partition]
+        if job_ids:
+            filters += job_ids
+        if self._bjobs_json:
+            qargs = ['bjobs', '-json', '-a', '-X', '-o',
+                     '"{}"'.format(' '.join(BJOBS_FIELDS))] + filters
+            code, stdout, stderr = _throttle.cmd('query', qargs)
+            if code != 0 and not stdout.strip() and _NO_JSON.search(stderr):
+                _logme.log('bjobs has no -json option, using delimited '
+                           'output', 'debug')
+                self._bjobs_json = False
             else:
-                _sys.stderr.write('{}'.format(repr(binfo)))
-                raise _ClusterError('Queue parsing error, expected {} items '
-                                    'in output of bjobs, got {}\n'
-                                    .format(len(fields), len(binfo)))
-
-            # If not my partition go to next extry
-            if partition and bpartition != partition:
+                for binfo in self._parse_json(stdout):
+                    yield binfo
+                return
+        # bjobs returns 'No unfinished job found' on stderr when list is
+        # empty, and 'Job <id> is not found' for each missing job ID
+        qargs = ['bjobs', '-noheader', '-a', '-X', '-o', '{} delimiter=\'{}\''
+                 .format(' '.join(BJOBS_FIELDS), BJOBS_DELIM)] + filters
+        for line in _throttle.cmd_lines('query', qargs):
+            if line.strip():
+                yield tuple(i.strip() for i in line.split(BJOBS_DELIM))
+
+    @staticmethod
+    def _parse_json(stdout):
+        """Yield bjobs rows from the output of bjobs -json."""
+        if not stdout.strip():
+            return
+        try:
+            records = _json.loads(stdout).get('RECORDS', [])
+        except ValueError:
+            _logme.log('Could not parse bjobs -json output:\n{}'
+                       .format(stdout[:1000]), 'error')
+            raise _ClusterError('bjobs -json output is not valid JSON')
+        for record in records:
+            # Missing job IDs are reported as records with only an error
+            if 'ERROR' in record:
                 continue
+            yield tuple(str(record.get(k, '')).strip() for k in BJOBS_KEYS)
 
-            # Normalize bid and barr
-            if not isinstance(bid, (_str, _txt)):
-                bid = str(bid) if bid else None
-            bid, barr = self.normalize_job_id(bid)
-
-            # Normalize nodes, cpus, state and exit_code
-            # '-'
-            if not isinstance(bnodes, _int):
-                bnodes = self.normalize_int(bnodes)
-            if not isinstance(bcpus, _int):
-                bcpus = self.normalize_int(bcpus)
-            if not isinstance(bcode, _int):
-                bcode = self.normalize_int(bcode)
-            bstate = self.normalize_state(bstate)
-
-            # If user or job id are used to filter skip to next if not found
-            if buser.isdigit():
-                buser = _pwd.getpwuid(int(buser)).pw_name
-            if user and buser != user:
-                continue
-            if job_id and (job_id != bid):
-                continue
+    def _parse_row(self, binfo, user=None, partition=None, idset=None):
+        """Sanitize one bjobs row, None if filtered out.
 
-            # Attempt to parse nodelist
-            #   LSF node list:"16*s01r1b14:16*s01r1b12:16*s01r1b08:16*s01r1b28"
-            bnodelist = []
-            nodequery = _re.compile(r'(\d+\*)?(\w+)')
-            if bndlst:
-                # [ (cores, node1), (cores, node2), ...]
-                if nodequery.search(bndlst):
-                    nsplit = nodequery.findall(bndlst)
-                    for nrg in nsplit:
-                        cores, node = nrg
-                        bnodelist.append(node)
-                else:
-                    bnodelist = bndlst.split(':')
-
-            yield (bid, barr, bname, buser, bpartition, bstate, bnodelist,
-                   bnodes, bcpus, bcode)
+        Parameters
+        ----------
+        binfo : tuple
+            A row from _bjobs
+        user : str, optional
+        partition : str, optional
+        idset : set, optional
+            Job IDs to keep
+
+        Returns
+        -------
+        tuple or None
+            (job_id, array_id, name, user, partition, state, nodelist,
+             numnodes, cntpernode, exit_code)
+        """
+        if len(binfo) == len(BJOBS_FIELDS):
+            # jobid -> bid ($jobid)
+            # name -> bname ($job_name | $job_name[#array_num])
+            # user -> buser ($user_name)
+            # queue -> bpartition ($queue)
+            # stat -> bstate (PEND | RUN | DONE | EXIT...)
+            # exec_host -> bndlst (cpus*nodeid:cpus*nodeid...)
+            # nexec_host -> bnodes ($num_nodes)
+            # slots -> bcpus ($total_tasks)
+            # exit_code -> bcode ($exit_code)
+            [bid, bname, buser, bpartition, bstate,
+             bndlst, bnodes, bcpus, bcode] = binfo
+        else:
+            _sys.stderr.write('{}'.format(repr(binfo)))
+            raise _ClusterError('Queue parsing error, expected {} items '
+                                'in output of bjobs, got {}\n'
+                                .format(len(BJOBS_FIELDS), len(binfo)))
+
+        # If not my partition go to next extry
+        if partition and bpartition != partition:
+            return None
+
+        # Normalize bid and barr
+        if not isinstance(bid, (_str, _txt)):
+            bid = str(bid) if bid else None
+        bid, barr = self.normalize_job_id(bid)
+
+        # Normalize nodes, cpus, state and exit_code
+        # '-'
+        if not isinstance(bnodes, _int):
+            bnodes = self.normalize_int(bnodes)
+        if not isinstance(bcpus, _int):
+            bcpus = self.normalize_int(bcpus)
+        if not isinstance(bcode, _int):
+            bcode = self.normalize_int(bcode)
+        bstate = self.normalize_state(bstate)
+
+        # If user or job id are used to filter skip to next if not found
+        if buser.isdigit():
+            buser = _run.uid_to_name(buser)
+        if user and buser != user:
+            return None
+        if idset and bid not in idset:
+            return None
+
+        # Parse nodelist, counting the cores on every node
+        #   LSF node list:"16*s01r1b14:16*s01r1b12:16*s01r1b08:16*s01r1b28"
+        bnodelist = _NodeSet.from_lsf(bndlst)
+
+        return (bid, barr, bname, buser, bpartition, bstate, bnodelist,
+                bnodes, bcpus, bcode)
 
     def parse_strange_options(self, option_dict):
         """Parse all options that cannot be handled by the regular function.
@@ -506,8 +579,7 @@ class LSFClient(BatchSystemClient):
         """Convert the job id into job_id, array_id."""
         # Look for job_id and array_id:
         # e.g.: 1234[1]
-        jobquery = _re.compile(r'(\d+)(\[(\d+)\])?')
-        job_id, _, array_id = jobquery.match(job_id).groups()
+        job_id, _, array_id = JOB_QUERY.match(job_id).groups()
 
         return job_id, array_id
 
@@ -698,4 +770,10 @@ class LSFClient(BatchSystemClient):
         if 'qos' in option_dict:
             option_dict.pop('qos')
 
+        # Job arrays are part of the job name in LSF: name[1-N]
+        if 'array' in option_dict:
+            array = option_dict.pop('array')
+            name = option_dict.pop('name', 'fyrd')
+            outlist.append('{} -J "{}[{}]"'.format(self.PREFIX, name, array))
+
         return outlist, option_dict, None
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Compact node lists.
+
+Batch systems report the nodes of a job in a compressed form, e.g. slurm's
+``node[001-512]``, torque's ``node1/0-3+node2/0-3`` (one entry per core) and
+LSF's ``16*node1:16*node2``. A NodeSet keeps the ranges instead of a list of
+every node name, so a 512 node MPI job costs a few objects instead of 512
+strings on every queue update. Node names are generated lazily when iterated.
+
+Every node also has a count, the number of cores (torque, LSF) or times the
+node was listed, as shown by `fyrd queue --nodes`.
+
+Classes
+-------
+NodeSet
+    A set of node names stored as ranges, with a count per node.
+"""
+import re as _re
+from collections import OrderedDict as _OrderedDict
+
+import Pyro4
+from six import string_types as _str
+
+__all__ = ['NodeSet']
+
+# Slurm style ranges, e.g. node[001-004,010]-ib
+RANGE_QUERY = _re.compile(r'^([^\[\]]*)\[([^\]]+)\](.*)$')
+
+# Optional count prefix, e.g. 16*node1
+COUNT_QUERY = _re.compile(r'^(\d+)\*(.+)$')
+
+
+###############################################################################
+#                              The NodeSet Class                              #
+###############################################################################
+
+
+class NodeSet(object):
+
+    """A set of node names stored as ranges, with a count per node.
+
+    Iterating yields each node name once, in the order they were added. The
+    length is the number of distinct nodes.
+
+    Attributes
+    ----------
+    total : int
+        The sum of the counts of all nodes
+
+    Methods
+    -------
+    from_slurm(nodelist)
+        Parse a slurm node list, e.g. node[1-4],gpu1
+    from_torque(exec_host)
+        Parse a torque exec_host, e.g. node1/0-3+node2/0
+    from_lsf(exec_host)
+        Parse an LSF exec_host, e.g. 16*node1:16*node2
+    add(node, count=1)
+        Add a node name or a range
+    update(nodes)
+        Add all nodes from another NodeSet or an iterable of names
+    counts()
+        Return an OrderedDict of {node: count}
+    """
+
+    __slots__ = ['_ranges', '_singles']
+
+    def __init__(self, nodes=None):
+        """Create a NodeSet.
+
+        Parameters
+        ----------
+        nodes : str, list, or NodeSet, optional
+            A string is parsed as a comma separated slurm node list, where
+            every entry can have a count prefix, e.g. '16*node[1-2],node5'
+            (the format of str(NodeSet)). A list is used as node names.
+        """
+        # [prefix, first, last, width, suffix, count], last is included
+        self._ranges  = []
+        # {name: count}
+        self._singles = _OrderedDict()
+        if nodes:
+            if isinstance(nodes, _str):
+                self._parse(nodes)
+            else:
+                self.update(nodes)
+
+    ####################
+    #  Public Methods  #
+    ####################
+
+    @classmethod
+    def from_slurm(cls, nodelist):
+        """Parse a slurm node list, e.g. node[1-4],gpu1."""
+        return cls(nodelist)
+
+    @classmethod
+    def from_torque(cls, exec_host):
+        """Parse a torque exec_host, e.g. node1/0-3,5+node2/0.
+
+        Every core is one count of the node.
+        """
+        nodeset = cls()
+        for host in exec_host.split('+') if exec_host else []:
+            if not host:
+                continue
+            if '/' not in host:
+                nodeset.add(host)
+                continue
+            name, cores = host.split('/', 1)
+            count = 0
+            for core in cores.split(','):
+                if '-' in core:
+                    first, last = core.split('-')
+                    count += int(last) - int(first) + 1
+                else:
+                    count += 1
+            nodeset.add(name, count)
+        return nodeset
+
+    @classmethod
+    def from_lsf(cls, exec_host):
+        """Parse an LSF exec_host, e.g. 16*node1:16*node2."""
+        nodeset = cls()
+        if not exec_host or exec_host == '-':
+            return nodeset
+        for host in exec_host.split(':'):
+            if host:
+                nodeset._add_entry(host)
+        return nodeset
+
+    def add(self, node, count=1):
+        """Add a node name or a slurm style range, e.g. node[1-4].
+
+        Parameters
+        ----------
+        node : str
+        count : int, optional
+            Added to the count of every node
+        """
+        match = RANGE_QUERY.match(node)
+        if not match:
+            self._singles[node] = self._singles.get(node, 0) + count
+            return
+        prefix, ranges, suffix = match.groups()
+        for rng in ranges.split(','):
+            first, _, last = rng.partition('-')
+            last = last if last else first
+            self._ranges.append(
+                [prefix, int(first), int(last), len(first), suffix, count]
+            )
+
+    def update(self, nodes):
+        """Add all nodes from another NodeSet or an iterable of names."""
+        if isinstance(nodes, NodeSet):
+            self._ranges += [list(i) for i in nodes._ranges]
+            for name, count in nodes._singles.items():
+                self._singles[name] = self._singles.get(name, 0) + count
+        elif isinstance(nodes, _str):
+            self._parse(nodes)
+        else:
+            for node in nodes:
+                self.add(node)
+
+    def counts(self):
+        """Return an OrderedDict of {node: count}."""
+        counts = _OrderedDict()
+        for prefix, first, last, width, suffix, count in self._ranges:
+            for i in range(first, last+1):
+                name = '{}{}{}'.format(prefix, str(i).zfill(width), suffix)
+                counts[name] = counts.get(name, 0) + count
+        for name, count in self._singles.items():
+            counts[name] = counts.get(name, 0) + count
+        return counts
+
+    @property
+    def total(self):
+        """The sum of the counts of all nodes."""
+        return sum(
+            (i[2] - i[1] + 1)*i[5] for i in self._ranges
+        ) + sum(self._singles.values())
+
+    ######################
+    # Internal Functions #
+    ######################
+
+    def _parse(self, nodes):
+        """Add a comma separated node list, brackets can contain commas."""
+        depth = 0
+        start = 0
+        for i, char in enumerate(nodes):
+            if char == '[':
+                depth += 1
+            elif char == ']':
+                depth -= 1
+            elif char == ',' and not depth:
+                self._add_entry(nodes[start:i])
+                start = i + 1
+        self._add_entry(nodes[start:])
+
+    def _add_entry(self, entry):
+        """Add one node or range, with an optional count prefix."""
+        entry = entry.strip()
+        if not entry:
+            return
+        match = COUNT_QUERY.match(entry)
+        if match:
+            self.add(match.group(2), int(match.group(1)))
+        else:
+            self.add(entry)
+
+    ###############
+    #  Internals  #
+    ###############
+
+    def __iter__(self):
+        """Yield every node name once, generated from the ranges."""
+        if len(self._ranges) == 1 and not self._singles:
+            # The common case, a single range cannot repeat names
+            prefix, first, last, width, suffix, _ = self._ranges[0]
+            for i in range(first, last+1):
+                yield '{}{}{}'.format(prefix, str(i).zfill(width), suffix)
+            return
+        for name in self.counts():
+            yield name
+
+    def __len__(self):
+        """The number of nodes."""
+        if not self._ranges:
+            return len(self._singles)
+        if len(self._ranges) == 1 and not self._singles:
+            return self._ranges[0][2] - self._ranges[0][1] + 1
+        return len(self.counts())
+
+    def __contains__(self, node):
+        """Check a node name without expanding the ranges."""
+        if node in self._singles:
+            return True
+        for prefix, first, last, width, suffix, _ in self._ranges:
+            if not node.startswith(prefix) or not node.endswith(suffix):
+                continue
+            number = node[len(prefix):len(node)-len(suffix)]
+            if number.isdigit() and len(number) >= width and (
+                    len(number) == width or not number.startswith('0')):
+                if first <= int(number) <= last:
+                    return True
+        return False
+
+    def __add__(self, other):
+        """Return a new NodeSet with the nodes of both."""
+        new = NodeSet(self)
+        new.update(other)
+        return new
+
+    def __eq__(self, other):
+        """Compare nodes and counts, lists are compared as node names."""
+        if isinstance(other, NodeSet):
+            return self.counts() == other.counts()
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        """Inverse of __eq__."""
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __getstate__(self):
+        """Pickle as the compact string."""
+        return str(self)
+
+    def __setstate__(self, state):
+        """Restore from the compact string."""
+        self._ranges  = []
+        self._singles = _OrderedDict()
+        self._parse(state)
+
+    def __str__(self):
+        """Compact form, e.g. 16*node[1-2],node5, parsed by NodeSet()."""
+        entries = []
+        for prefix, first, last, width, suffix, count in self._ranges:
+            rng = str(first).zfill(width)
+            if last != first:
+                rng += '-' + str(last).zfill(width)
+            entries.append('{}{}[{}]{}'.format(
+                '{}*'.format(count) if count != 1 else '', prefix, rng, suffix
+            ))
+        for name, count in self._singles.items():
+            entries.append(
+                '{}*{}'.format(count, name) if count != 1 else name
+            )
+        return ','.join(entries)
+
+    def __repr__(self):
+        """Show the compact form."""
+        return 'NodeSet<{}>'.format(str(self))
+
+
+###############################################################################
+#                              Pyro Serialization                             #
+###############################################################################
+
+
+def _to_dict(nodeset):
+    """Serialize a NodeSet for Pyro as its compact string."""
+    return {'__class__': 'fyrd.NodeSet', 'nodes': str(nodeset)}
+
+
+def _from_dict(classname, data):
+    """Recreate a NodeSet sent by Pyro."""
+    return NodeSet(data['nodes'])
+
+
+Pyro4.util.SerializerBase.register_class_to_dict(NodeSet, _to_dict)
+Pyro4.util.SerializerBase.register_dict_to_class('fyrd.NodeSet', _from_dict)
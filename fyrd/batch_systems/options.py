@@ -158,6 +158,11 @@ CLUSTER_OPTS = _OD([
      {'help': 'Comma separated list of environmental variables to export',
       'default': None, 'type': str,
       'slurm': '--export={}', 'torque': '-v {}', 'lsf': '-env {}'}),
+    ('array',
+     {'help': 'Submit as a job array with these task ids (e.g. 1-100)',
+      'default': None, 'type': str,
+      # LSF in parse_strange_options (added to the job name)
+      'slurm': '--array={}', 'torque': '-t {}'}),
 ])
 
 ###############################################################################
@@ -3,9 +3,13 @@
 SLURM parsing functions.
 """
 import os as _os
-import re as _re
 import sys as _sys
-import pwd as _pwd     # Used to get usernames for queue
+import threading as _threading
+from time import time as _time
+from time import strftime as _strftime
+from time import localtime as _localtime
+from uuid import uuid4 as _uuid
+from collections import OrderedDict as _OrderedDict
 
 from six import text_type as _txt
 from six import string_types as _str
@@ -16,21 +20,63 @@ import Pyro4
 from .. import run as _run
 from .. import conf as _conf
 from .. import logme as _logme
+from .. import throttle as _throttle
 from .. import ClusterError as _ClusterError
 from .. import script_runners as _scrpts
 from .. import submission_scripts as _sscrpt
 
 from .base import BatchSystemClient, BatchSystemServer
+from .nodeset import NodeSet as _NodeSet
 
 _Script = _sscrpt.Script
 
 SUFFIX = 'sbatch'
 
+# squeue fields, fixed width mode pads each to SQUEUE_WIDTH characters
+SQUEUE_WIDTH  = 400
+SQUEUE_FIELDS = [
+    'jobid', 'arraytaskid', 'name', 'userid', 'partition',
+    'state', 'nodelist', 'numnodes', 'numcpus', 'exit_code'
+]
+
+# The same fields for delimited mode, squeue --format has no exit code
+SQUEUE_FORMAT = ['%F', '%K', '%j', '%u', '%P', '%T', '%N', '%D', '%C']
+SQUEUE_DELIM  = '\x1f'  # ASCII unit separator
+
+# Finished job states in squeue, delimited mode gets their exit codes from
+# sacct
+SQUEUE_DONE = {
+    'completed', 'cancelled', 'failed', 'timeout', 'node_fail', 'boot_fail',
+    'preempted', 'deadline', 'out_of_memory'
+}
+
+# sacct node lists of jobs that never ran
+NO_NODES = {'', 'None assigned', '(null)'}
+
 
 @Pyro4.expose
 class SlurmServer(BatchSystemServer):
     NAME = 'slurm'
 
+    # Seconds before the last sacct query to ask for again, so that jobs that
+    # changed state while it ran are not missed
+    SACCT_OVERLAP = 120
+
+    # Most jobs kept in the sacct history of each user and partition
+    SACCT_HISTORY = 200000
+
+    def __init__(self):
+        """Create the server with an empty sacct history."""
+        super(SlurmServer, self).__init__()
+        # {(user, partition): [time of last query, {sacct jobid: (seq, row)}]}
+        # Rows are kept in seq order, seq is bumped when a row is added or
+        # changes, so callers can ask for the rows changed since a seq
+        self._sacct_history = {}
+        self._sacct_lock    = _threading.Lock()
+        self._sacct_seq     = 0
+        # Tokens from another server start are not valid here
+        self._sacct_epoch   = _uuid().hex
+
     def metrics(self, job_id=None):
         _logme.log('Getting job metrics', 'debug')
 
@@ -47,7 +93,7 @@ class SlurmServer(BatchSystemServer):
             qargs.append('-j {}'.format(job_id))
         try:
             sacct = [tuple(i.strip(' |').split('|')) for i in
-                     _run.cmd(qargs)[1].split('\n')]
+                     _throttle.cmd('query', qargs)[1].split('\n')]
         except Exception as e:
             _logme.log('Error running sacct to get the metrics', 'error')
             sacct = []
@@ -164,7 +210,7 @@ class SlurmServer(BatchSystemServer):
         else:
             args = ['sbatch', script_file_name]
         # Try to submit job 5 times
-        code, stdout, stderr = _run.cmd(args, tries=5)
+        code, stdout, stderr = _throttle.cmd('submit', args, tries=5)
         if code == 0:
             job_id, _ = self.normalize_job_id(stdout.split(' ')[-1])
         else:
@@ -193,8 +239,10 @@ class SlurmServer(BatchSystemServer):
         -------
         success : bool
         """
-        o = _run.cmd('scancel {0}'.format(' '.join(_run.listify(job_ids))),
-                     tries=5)
+        o = _throttle.cmd(
+            'submit', 'scancel {0}'.format(' '.join(_run.listify(job_ids))),
+            tries=5
+        )
         return o[0] == 0
 
     ###########################################################################
@@ -203,12 +251,14 @@ class SlurmServer(BatchSystemServer):
     def queue_parser(self, user=None, partition=None, job_id=None):
         """Iterator for slurm queues.
 
-        Use the `squeue -O` command to get standard data across implementation,
+        Use the `squeue` command to get standard data across implementation,
         supplement this data with the results of `sacct`. sacct returns data
         only for the current user but retains a much longer job history. Only
         jobs not returned by squeue are added with sacct, and they are added
         to *the end* of the returned queue, i.e. *out of order with respect to
-        the actual queue*.
+        the actual queue*. After the first query, sacct is only asked for jobs
+        since the last query, see `_sacct`, but every job in the sacct history
+        is still returned, use queue_changes to get only the changed jobs.
 
         Parameters
         ----------
@@ -216,8 +266,9 @@ class SlurmServer(BatchSystemServer):
             User name to pass to qstat to filter queue with
         partiton : str, optional
             Partition to filter the queue with
-        job_id: str, optional
-            Job ID to filter the queue with
+        job_id: str or list, optional
+            Job ID or IDs to filter the queue with, passed to squeue and sacct
+            with -j, in batches of ID_BATCH.
 
         Yields
         ------
@@ -227,64 +278,94 @@ class SlurmServer(BatchSystemServer):
         userid : str
         partition : str
         state :str
-        nodelist : list
+        nodelist : NodeSet
         numnodes : int
         cntpernode : int or None
         exit_code : int or Nonw
         """
-        try:
-            if job_id:
-                int(job_id)
-        except ValueError:
-            job_id = None
-        nodequery = _re.compile(r'([^\[,]+)(\[[^\[]+\])?')
-        fwdth = 400  # Used for fixed-width parsing of squeue
-        fields = [
-            'jobid', 'arraytaskid', 'name', 'userid', 'partition',
-            'state', 'nodelist', 'numnodes', 'numcpus', 'exit_code'
-        ]
-        flen = len(fields)
-        qargs = [
-            'squeue', '-h', '-O',
-            ','.join(['{0}:{1}'.format(field, fwdth) for field in fields])
-        ]
-        # Parse queue info by length
-        squeue = [
-            tuple(
-                [k[i:i+fwdth].rstrip() for i in range(0, fwdth*flen, fwdth)]
-            ) for k in _run.cmd(qargs)[1].split('\n')
-        ]
-        # SLURM sometimes clears the queue extremely fast, so we use sacct
-        # to get old jobs by the current user
-        qargs = ['sacct', '-p',
-                 '--format=jobid,jobname,user,partition,state,' +
-                 'nodelist,reqnodes,ncpus,exitcode']
-        try:
-            sacct = [tuple(i.strip(' |').split('|')) for i in
-                     _run.cmd(qargs)[1].split('\n')]
-            sacct = sacct[1:]
-        # This command isn't super stable and we don't care that much, so I
-        # will just let it die no matter what
-        except Exception as e:
-            if _logme.MIN_LEVEL == 'debug':
-                raise e
-            else:
+        return self._parse_queue(user, partition, job_id)
+
+    def queue_changes(self, token=None, user=None, partition=None):
+        """Return the queue, with only the sacct jobs changed since token.
+
+        Every job in squeue is always returned, jobs only in sacct are only
+        returned if they are new or changed since the call that returned
+        token. Jobs that leave squeue are sent again by sacct once they have
+        finished, so only finished jobs are ever left out.
+
+        Parameters
+        ----------
+        token : list, optional
+            The token returned by the last call, None gets all jobs
+        user : str, optional
+        partition : str, optional
+
+        Returns
+        -------
+        token : list
+            Pass to the next call
+        full : bool
+            Always True, every unfinished job is listed
+        jobs : list
+            Same format as queue_parser
+        deleted : list
+            Always empty, sacct does not forget jobs
+        """
+        if not token or token[0] != self._sacct_epoch:
+            token = [self._sacct_epoch, 0]
+        token = list(token)
+        jobs  = list(self._parse_queue(user, partition, token=token))
+        return token, True, jobs, []
+
+    def _parse_queue(self, user=None, partition=None, job_id=None,
+                     token=None):
+        """Yield queue_parser rows.
+
+        If token is given as [epoch, seq], only sacct rows changed after seq
+        are yielded and seq is set to the last seq of the history.
+        """
+        ids = self._filter_ids(job_id)
+        idset = set(ids) if ids else None
+        # Filter in the scheduler, in batches if there are many job IDs
+        for batch in self._id_batches(ids):
+            jobids = set()  # Jobs in squeue, skipped in sacct
+            done   = {}     # Finished jobs in squeue without an exit code
+            for sinfo in self._squeue(user, partition, batch):
+                if sinfo[9] is None and sinfo[5].lower() in SQUEUE_DONE:
+                    done[sinfo[:2]] = sinfo
+                    continue
+                jobids.add(sinfo[0])
+                sinfo = self._parse_row(sinfo, user, partition, idset)
+                if sinfo:
+                    yield sinfo
+
+            # SLURM sometimes clears the queue extremely fast, so we use sacct
+            # to get old jobs by the current user
+            try:
+                seq, sacct = self._sacct(
+                    user, partition, batch, token[1] if token else 0
+                )
+                if token:
+                    token[1] = seq
+            # This command isn't super stable and we don't care that much, so
+            # I will just let it die no matter what
+            except Exception as e:
+                if _logme.MIN_LEVEL == 'debug':
+                    raise e
                 sacct = []
 
-        if sacct:
-            if len(sacct[0]) != 9:
-                _logme.log('sacct parsing failed unexpectedly as there  ' +
-                           'are not 9 columns, aborting.', 'critical')
-                raise ValueError('sacct output does not have 9 columns. Has:' +
-                                 '{}: {}'.format(len(sacct[0]), sacct[0]))
-            jobids = [i[0] for i in squeue]
+            if sacct:
+                if len(sacct[0]) != 9:
+                    _logme.log('sacct parsing failed unexpectedly as there  ' +
+                               'are not 9 columns, aborting.', 'critical')
+                    raise ValueError(
+                        'sacct output does not have 9 columns. Has:' +
+                        '{}: {}'.format(len(sacct[0]), sacct[0])
+                    )
+            else:
+                _logme.log('No job info in sacct', 'debug')
+
             for sinfo in sacct:
-                # Skip job steps, only index whole jobs
-                if '.' in sinfo[0]:
-                    _logme.log('Skipping {} '.format(sinfo[0]) +
-                               "in sacct processing as it is a job part.",
-                               'verbose')
-                    continue
                 # These are the values I expect
                 try:
                     [sid, sname, suser, spartition, sstate,
@@ -305,69 +386,227 @@ class SlurmServer(BatchSystemServer):
                     _logme.log('{} still in squeue output'.format(sid),
                                'verbose')
                     continue
+                done.pop((sid, sarr), None)
                 scode = int(scode.split(':')[-1])
-                squeue.append((sid, sarr, sname, suser, spartition, sstate,
-                               snodelist, snodes, scpus, scode))
-        else:
-            _logme.log('No job info in sacct', 'debug')
+                sinfo = self._parse_row(
+                    (sid, sarr, sname, suser, spartition, sstate, snodelist,
+                     snodes, scpus, scode), user, partition, idset
+                )
+                if sinfo:
+                    yield sinfo
+
+            # Finished jobs that sacct did not send, sacct only sends changed
+            # jobs, so take the exit code from the history if it is there
+            for (sid, sarr), sinfo in done.items():
+                scode = self._history_exitcode(user, partition, sid, sarr)
+                if scode is not None:
+                    sinfo = tuple(sinfo[:9]) + (scode,)
+                sinfo = self._parse_row(sinfo, user, partition, idset)
+                if sinfo:
+                    yield sinfo
+
+    def _squeue(self, user=None, partition=None, job_ids=None):
+        """Yield squeue rows as they are read.
+
+        The squeue_format option picks `squeue --format` with SQUEUE_DELIM
+        between fields ('delimited', the default) or `squeue -O` with fields
+        padded to SQUEUE_WIDTH ('fixed'). Only fixed width mode has exit codes.
 
-        # Sanitize data
-        for sinfo in squeue:
-            if len(sinfo) == 10:
-                [sid, sarr, sname, suser, spartition, sstate, sndlst,
-                 snodes, scpus, scode] = sinfo
-            else:
-                _sys.stderr.write('{}'.format(repr(sinfo)))
-                raise _ClusterError('Queue parsing error, expected 10 items '
-                                    'in output of squeue and sacct, got {}\n'
-                                    .format(len(sinfo)))
-            if partition and spartition != partition:
+        Parameters
+        ----------
+        user : str, optional
+        partition : str, optional
+        job_ids : list of str, optional
+
+        Yields
+        ------
+        tuple
+            (job_id, array_id, name, user, partition, state, nodelist,
+             numnodes, numcpus, exit_code), all str or None
+        """
+        fixed = _conf.get_option('queue', 'squeue_format') == 'fixed'
+        if fixed:
+            qargs = ['squeue', '-h', '-O', ','.join(
+                ['{0}:{1}'.format(i, SQUEUE_WIDTH) for i in SQUEUE_FIELDS]
+            )]
+            flen = len(SQUEUE_FIELDS)
+        else:
+            qargs = ['squeue', '--noheader',
+                     '--format', SQUEUE_DELIM.join(SQUEUE_FORMAT)]
+        if job_ids:
+            qargs += ['-j', ','.join(job_ids)]
+        if user:
+            qargs += ['-u', user]
+        if partition:
+            qargs += ['-p', partition]
+        for line in _throttle.cmd_lines('query', qargs):
+            if not line.strip():
                 continue
-            if not isinstance(sid, (_str, _txt)):
-                sid = str(sid) if sid else None
+            if fixed:
+                # Parse queue info by length
+                row = [line[i:i+SQUEUE_WIDTH].rstrip()
+                       for i in range(0, SQUEUE_WIDTH*flen, SQUEUE_WIDTH)]
             else:
-                sarr = None
-            if not isinstance(snodes, _int):
-                snodes = int(snodes) if snodes else None
-            if not isinstance(scpus, _int):
-                scpus = int(scpus) if scpus else None
-            if not isinstance(scode, _int):
-                scode = int(scode) if scode else None
-            sstate = sstate.lower()
-            # Convert user from ID to name
-            if suser.isdigit():
-                suser = _pwd.getpwuid(int(suser)).pw_name
-            if user and suser != user:
-                continue
-            if job_id and (job_id != sid):
-                continue
-            # Attempt to parse nodelist
-            snodelist = []
-            if sndlst:
-                if nodequery.search(sndlst):
-                    nsplit = nodequery.findall(sndlst)
-                    for nrg in nsplit:
-                        node, rge = nrg
-                        if not rge:
-                            snodelist.append(node)
-                        else:
-                            for reg in rge.strip('[]').split(','):
-                                # Node range
-                                if '-' in reg:
-                                    start, end = [
-                                            int(i) for i in reg.split('-')
-                                            ]
-                                    for i in range(start, end):
-                                        snodelist.append(
-                                                '{}{}'.format(node, i)
-                                                )
-                                else:
-                                    snodelist.append('{}{}'.format(node, reg))
-                else:
-                    snodelist = sndlst.split(',')
-
-            yield (sid, sarr, sname, suser, spartition, sstate, snodelist,
-                   snodes, scpus, scode)
+                row = line.split(SQUEUE_DELIM) + [None]
+            if row[1] in ('N/A', ''):
+                row[1] = None
+            yield tuple(row)
+
+    def _parse_row(self, sinfo, user=None, partition=None, idset=None):
+        """Sanitize one squeue or sacct row, None if filtered out.
+
+        Parameters
+        ----------
+        sinfo : tuple
+            (job_id, array_id, name, user, partition, state, nodelist,
+             numnodes, numcpus, exit_code)
+        user : str, optional
+        partition : str, optional
+        idset : set, optional
+            Job IDs to keep
+
+        Returns
+        -------
+        tuple or None
+            Same order as sinfo, with ints and a list of nodes
+        """
+        if len(sinfo) == 10:
+            [sid, sarr, sname, suser, spartition, sstate, sndlst,
+             snodes, scpus, scode] = sinfo
+        else:
+            _sys.stderr.write('{}'.format(repr(sinfo)))
+            raise _ClusterError('Queue parsing error, expected 10 items '
+                                'in output of squeue and sacct, got {}\n'
+                                .format(len(sinfo)))
+        if partition and spartition != partition:
+            return None
+        if not isinstance(sid, (_str, _txt)):
+            sid = str(sid) if sid else None
+        if not isinstance(snodes, _int):
+            snodes = int(snodes) if snodes else None
+        if not isinstance(scpus, _int):
+            scpus = int(scpus) if scpus else None
+        if not isinstance(scode, _int):
+            scode = int(scode) if scode else None
+        sstate = sstate.lower()
+        # Convert user from ID to name
+        if suser.isdigit():
+            suser = _run.uid_to_name(suser)
+        if user and suser != user:
+            return None
+        if idset and sid not in idset:
+            return None
+        # Keep node ranges compact
+        snodelist = _NodeSet()
+        if sndlst and sndlst not in NO_NODES:
+            snodelist = _NodeSet.from_slurm(sndlst)
+
+        return (sid, sarr, sname, suser, spartition, sstate, snodelist,
+                snodes, scpus, scode)
+
+    def _history_exitcode(self, user, partition, job_id, array_id=None):
+        """Return the exit code of a job in the sacct history, or None."""
+        if array_id is not None:
+            job_id = '{}_{}'.format(job_id, array_id)
+        with self._sacct_lock:
+            history = self._sacct_history.get((user, partition))
+            entry   = history[1].get(job_id) if history else None
+        if entry is None:
+            return None
+        return int(entry[1][8].split(':')[-1])
+
+    def _sacct(self, user=None, partition=None, job_ids=None, since=0):
+        """Return changed sacct rows for whole jobs, job steps are skipped.
+
+        Without job_ids, only jobs since the last successful query (minus
+        SACCT_OVERLAP seconds) are requested from sacct and merged into a
+        history of up to SACCT_HISTORY jobs for this user and partition. Only
+        the rows added or changed after seq since are returned.
+
+        With job_ids, the rows of those jobs are returned, from the history
+        if sacct fails.
+
+        Parameters
+        ----------
+        user : str, optional
+        partition : str, optional
+        job_ids : list of str, optional
+            Query only these jobs
+        since : int, optional
+            Return only history rows changed after this seq, 0 for all
+
+        Returns
+        -------
+        seq : int
+            The last seq in the history, pass as since to get later changes
+        rows : list of tuple
+            (jobid, jobname, user, partition, state, nodelist, reqnodes,
+             ncpus, exitcode)
+        """
+        qargs = ['sacct', '-p', '-n',
+                 '--format=jobid,jobname,user,partition,state,' +
+                 'nodelist,reqnodes,ncpus,exitcode']
+        if job_ids:
+            qargs.append('-j {}'.format(','.join(job_ids)))
+        if user:
+            qargs.append('-u {}'.format(user))
+        if partition:
+            qargs.append('-r {}'.format(partition))
+
+        with self._sacct_lock:
+            history = self._sacct_history.setdefault(
+                (user, partition), [None, _OrderedDict()]
+            )
+            jobs = history[1]
+            if history[0] and not job_ids:
+                qargs.append('--starttime={}'.format(_strftime(
+                    '%Y-%m-%dT%H:%M:%S',
+                    _localtime(history[0] - self.SACCT_OVERLAP)
+                )))
+            start = _time()
+            code, stdout, _ = _throttle.cmd('query', qargs)
+            rows = [
+                tuple(i.strip(' |').split('|'))
+                for i in stdout.split('\n') if i.strip()
+            ]
+            # Skip job steps, only index whole jobs
+            rows = [i for i in rows if '.' not in i[0]]
+            if code != 0:
+                _logme.log('sacct failed with code {}, using the old history'
+                           .format(code), 'debug')
+                if job_ids:
+                    job_ids = set(job_ids)
+                    return self._sacct_seq, [
+                        row for _, row in jobs.values()
+                        if self.normalize_job_id(row[0])[0] in job_ids
+                    ]
+                rows = []
+            changed = 0
+            for row in rows:
+                old = jobs.get(row[0])
+                if old and old[1] == row:
+                    continue
+                # Move changed jobs to the end, so the history stays in seq
+                # order and the oldest are dropped
+                jobs.pop(row[0], None)
+                self._sacct_seq += 1
+                jobs[row[0]] = (self._sacct_seq, row)
+                changed += 1
+            while len(jobs) > self.SACCT_HISTORY:
+                jobs.popitem(last=False)
+            if job_ids:
+                return self._sacct_seq, rows
+            if code == 0:
+                history[0] = start
+            _logme.log('{} changed sacct rows, {} jobs in history'
+                       .format(changed, len(jobs)), 'debug')
+            new = []
+            for job_id in reversed(jobs):
+                seq, row = jobs[job_id]
+                if seq <= since:
+                    break
+                new.append(row)
+            return self._sacct_seq, new[::-1]
 
     def parse_strange_options(self, option_dict):
         """Parse all options that cannot be handled by the regular function.
@@ -406,6 +645,15 @@ class SlurmClient(BatchSystemClient):
         server = self.get_server()
         return server.metrics(job_id=job_id)
 
+    def queue_changes(self, token=None, user=None, partition=None):
+        """Return the queue with only the sacct jobs changed since token.
+
+        Used by fyrd.queue.Queue instead of queue_parser for updates without
+        job IDs, see SlurmServer.queue_changes.
+        """
+        server = self.get_server()
+        return server.queue_changes(token, user=user, partition=partition)
+
     def normalize_job_id(self, job_id):
         """Convert the job id into job_id, array_id."""
         if '_' in job_id:
@@ -3,10 +3,11 @@
 Define functions for using the Torque batch system
 """
 import os as _os
-import re as _re
 from time import sleep as _sleep
 import xml.etree.ElementTree as _ET
-from subprocess import check_output as _check_output
+import tempfile as _tempfile
+from subprocess import Popen as _Popen
+from subprocess import PIPE as _PIPE
 from subprocess import CalledProcessError as _CalledProcessError
 
 import Pyro4
@@ -14,11 +15,13 @@ import Pyro4
 from .. import run as _run
 from .. import conf as _conf
 from .. import logme as _logme
+from .. import throttle as _throttle
 from .. import ClusterError as _ClusterError
 from .. import script_runners as _scrpts
 from .. import submission_scripts as _sscrpt
 
 from .base import BatchSystemClient, BatchSystemServer
+from .nodeset import NodeSet as _NodeSet
 
 _Script = _sscrpt.Script
 
@@ -38,6 +41,71 @@ TORQUE_SLURM_STATES = {
     'S': 'suspended',
 }
 
+# Control characters are not allowed in XML, but can be in the environment
+# qstat prints in Variable_List
+_XML_BAD_BYTES = bytes(i for i in range(32) if i not in (9, 10, 13))
+
+
+class _CleanStream(object):
+
+    """Wrap a binary stream, dropping bytes that are invalid in XML."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, size=-1):
+        """Read up to size clean bytes, b'' only at the end of the stream."""
+        while True:
+            data = self.stream.read(size)
+            clean = data.translate(None, _XML_BAD_BYTES)
+            if clean or not data:
+                return clean
+
+
+def _stream_jobs(qargs):
+    """Run qstat and yield every <Job> element, cleared after use.
+
+    The output is parsed with iterparse straight from the pipe, the
+    Variable_List (the job environment) is dropped as soon as it is read, and
+    parsed jobs are removed from the root, so memory does not grow with the
+    size of the queue.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If qstat exits with an error, STDERR is in the stderr attribute.
+    xml.etree.ElementTree.ParseError
+        If qstat succeeded but the output is not XML, e.g. it is empty.
+    """
+    with _tempfile.TemporaryFile() as err:
+        pp = _Popen(qargs, stdout=_PIPE, stderr=err)
+        root = None
+        try:
+            for event, elem in _ET.iterparse(_CleanStream(pp.stdout),
+                                             events=('start', 'end')):
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    continue
+                if elem.tag == 'Variable_List':
+                    elem.clear()
+                elif elem.tag == 'Job':
+                    yield elem
+                    root.clear()
+        except _ET.ParseError:
+            # Report the qstat error instead if there is one
+            pp.stdout.close()
+            if pp.wait() == 0:
+                raise
+        finally:
+            pp.stdout.close()
+            code = pp.wait()
+        if code != 0:
+            err.seek(0)
+            raise _CalledProcessError(
+                code, qargs, stderr=err.read().decode(errors='replace')
+            )
+
 
 @Pyro4.expose
 class TorqueServer(BatchSystemServer):
@@ -133,7 +201,7 @@ class TorqueServer(BatchSystemServer):
             args = ['qsub', file_name]
 
         # Try to submit job 5 times
-        code, stdout, stderr = _run.cmd(args, tries=5)
+        code, stdout, stderr = _throttle.cmd('submit', args, tries=5)
         if code == 0:
             job_id, _ = normalize_job_id(stdout.split('.')[0])
         elif code == 17 and 'Unable to open script file' in stderr:
@@ -146,7 +214,7 @@ class TorqueServer(BatchSystemServer):
             _logme.log('renamed script {} to {}, resubmitting'
                        .format(args[1], new_name), 'info')
             args[1] = new_name
-            code, stdout, stderr = _run.cmd(args, tries=5)
+            code, stdout, stderr = _throttle.cmd('submit', args, tries=5)
             if code == 0:
                 job_id, _ = normalize_job_id(stdout.split('.')[0])
             else:
@@ -183,7 +251,10 @@ class TorqueServer(BatchSystemServer):
         -------
         success : bool
         """
-        o = _run.cmd('qdel {0}'.format(' '.join(_run.listify(job_ids))), tries=5)
+        o = _throttle.cmd(
+            'submit', 'qdel {0}'.format(' '.join(_run.listify(job_ids))),
+            tries=5
+        )
         return o[0] == 0
 
 
@@ -203,8 +274,9 @@ class TorqueServer(BatchSystemServer):
             User name to pass to qstat to filter queue with
         partiton : str, optional
             Partition to filter the queue with
-        job_id: str, optional
-            Job ID to filter the queue with
+        job_id: str or list, optional
+            Job ID or IDs to filter the queue with, passed to qstat in batches
+            of ID_BATCH.
 
         Yields
         ------
@@ -214,7 +286,7 @@ class TorqueServer(BatchSystemServer):
         userid : str
         partition : str
         state :str
-        nodelist : list
+        nodelist : NodeSet
         numnodes : int
         cntpernode : int or None
         exit_code : int or Nonw
@@ -222,53 +294,24 @@ class TorqueServer(BatchSystemServer):
         cntpernode is currently always 1 as most torque queues treat every core as
         a node.
         """
-        try:
-            if job_id:
-                int(job_id)
-        except ValueError:
-            job_id = None
-        # I am not using run.cmd because I want to catch XML errors also
-        try_count = 0
-        qargs = ['qstat', '-x', '-t']
-        r = _re.compile('<Variable_List>.*?</Variable_List>')
-        while True:
-            try:
-                xmlstr = _check_output(qargs)
-                try:
-                    xmlstr = xmlstr.decode()
-                except AttributeError:
-                    pass
-                # Get rid of the Variable_List as it is just the environment
-                # and can sometimes have nonsensical characters.
-                xmlstr = xmlstr.replace('\x1b', '')
-                xmlstr = r.sub('', xmlstr)
-                xmlqueue = _ET.fromstring(xmlstr)
-            except _CalledProcessError:
-                _sleep(1)
-                if try_count == 5:
-                    raise
-                else:
-                    try_count += 1
-            except _ET.ParseError:
-                # ElementTree throws error when string is empty
-                _sleep(1)
-                if try_count == 1:
-                    xmlqueue = None
-                    break
-                else:
-                    try_count += 1
+        ids = self._filter_ids(job_id)
+        idset = set(ids) if ids else None
+        for batch in self._id_batches(ids):
+            # qstat takes either job IDs or a destination queue
+            if batch:
+                qargs = ['qstat', '-x', '-t'] + batch
+            elif partition:
+                qargs = ['qstat', '-x', '-t', partition]
             else:
-                break
-
-        if xmlqueue is not None:
-            for xmljob in xmlqueue:
-                j_id, array_id = normalize_job_id(xmljob.find('Job_Id').text)
+                qargs = ['qstat', '-x', '-t']
+            for xmljob in self._qstat(qargs, bool(batch)):
+                j_id, array_id = self.normalize_job_id(
+                    xmljob.find('Job_Id').text
+                )
                 job_owner = xmljob.find('Job_Owner').text.split('@')[0]
                 if user and job_owner != user:
                     continue
-                if job_id and job_id != j_id:
-                    # TODO: Check that this is really working, I don't have
-                    # a torque queue systems atm to test this.
+                if idset and j_id not in idset:
                     continue
                 job_name  = xmljob.find('Job_Name').text
                 job_queue = xmljob.find('queue').text
@@ -278,27 +321,12 @@ class TorqueServer(BatchSystemServer):
                            'debug')
                 ndsx = xmljob.find('exec_host')
                 if hasattr(ndsx, 'text') and ndsx.text:
-                    nds = ndsx.text.split('+')
+                    nodes = _NodeSet.from_torque(ndsx.text)
                 else:
-                    nds = []
-                nodes = []
-                # Convert node range to individual nodes in list
-                for node in nds:
-                    if '/' in node:
-                        nm, nums = node.split('/')
-                        for num in nums.split(','):
-                            if '-' in num:
-                                nstart, nend = [int(i) for i in num.split('-')]
-                            else:
-                                nstart = nend = int(num)
-                            nend += 1
-                            for i in range(nstart, nend):
-                                nodes.append(nm + '/' + str(i).zfill(2))
-                    else:
-                        nodes.append(node)
+                    nodes = _NodeSet()
                 # I assume that every 'node' is a core, as that is the
                 # default for torque, but it isn't always true
-                job_threads  = len(nodes)
+                job_threads  = nodes.total
                 exitcode     = xmljob.find('exit_status')
                 if hasattr(exitcode, 'text'):
                     exitcode = int(exitcode.text)
@@ -313,6 +341,60 @@ class TorqueServer(BatchSystemServer):
                 yield (j_id, array_id, job_name, job_owner, job_queue, job_state,
                        nodes, job_threads, scpus, exitcode)
 
+    def _qstat(self, qargs, by_id=False):
+        """Run qstat and yield the <Job> elements as they are parsed.
+
+        Each element is cleared after the next one is requested, so only one
+        job is held in memory at a time.
+
+        Parameters
+        ----------
+        qargs : list
+            The qstat command
+        by_id : bool, optional
+            qargs contains job IDs, qstat exits with an error if any of them
+            are unknown, but still writes the others to STDOUT.
+
+        Yields
+        ------
+        xml.etree.ElementTree.Element
+        """
+        try_count = 0
+        throttle = _throttle.get_throttle('query')
+        while True:
+            found = 0
+            throttle.acquire()
+            try:
+                for xmljob in _stream_jobs(qargs):
+                    found += 1
+                    yield xmljob
+            except _CalledProcessError as err:
+                if by_id and 'Unknown Job' in err.stderr:
+                    throttle.ok()
+                    return
+                if found:
+                    raise
+                if _throttle.is_busy(err.stderr):
+                    throttle.backoff()
+                else:
+                    _sleep(1)
+                if try_count == 5:
+                    raise
+                try_count += 1
+                continue
+            except _ET.ParseError as err:
+                if found:
+                    raise _ClusterError('Could not parse qstat output after '
+                                        '{} jobs: {}'.format(found, err))
+                # ElementTree throws error when output is empty
+                _sleep(1)
+                if try_count:
+                    return
+                try_count += 1
+                continue
+            throttle.ok()
+            return
+
     def parse_strange_options(self, option_dict):
         """Parse all options that cannot be handled by the regular function.
         Handled on client side.
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Submit many jobs at once.
+
+Job.submit() writes its scripts, checks the queue and submits, one job at a
+time, so submitting a large parameter sweep is limited by file system latency
+and one scheduler round trip per job. submit_many() instead:
+
+    1. Generates and writes all scripts in a thread pool.
+    2. Splits the jobs into waves, so that jobs are always submitted after
+       any of their dependencies in the same batch.
+    3. Takes one queue snapshot per wave for the dependency and max_jobs
+       checks, dependencies submitted by this call are trusted without
+       appearing in the queue.
+    4. Submits every wave concurrently in the thread pool, limited to
+       `submit_rate` submissions per second.
+
+Each thread uses its own connection to the batch system server.
+
+Functions
+---------
+submit_many
+    Write and submit many jobs concurrently.
+"""
+import threading as _threading
+from functools import partial as _partial
+from concurrent import futures as _futures
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import conf  as _conf
+from . import logme as _logme
+from . import throttle as _throttle
+from . import ClusterError as _ClusterError
+from .job import Job as _Job
+
+__all__ = ['submit_many']
+
+
+###############################################################################
+#                              Bulk Submission                                #
+###############################################################################
+
+
+def submit_many(jobs, workers=None, rate=None, max_jobs=None,
+                wait_on_max_queue=True, additional_keywords=None):
+    """Write and submit many jobs concurrently.
+
+    Jobs that cannot be submitted, because a dependency failed or the batch
+    system returned an error, are logged and skipped, as are any jobs that
+    depend on them.
+
+    Parameters
+    ----------
+    jobs : list of fyrd.job.Job
+        Jobs to submit, already submitted jobs are ignored.
+    workers : int, optional
+        Number of threads, defaults to the submit_workers option
+    rate : float, optional
+        Maximum submissions per second, 0 for no limit, defaults to the
+        submit_rate option. The [queue] max_submit_rate limit applies too.
+    max_jobs : int, optional
+        Override the maximum number of jobs in the queue
+    wait_on_max_queue : bool, optional
+        Block while the queue is full.
+    additional_keywords : dict, optional
+        Pass this dictionary to the batch system submission function
+
+    Returns
+    -------
+    list of fyrd.job.Job
+        The submitted jobs, in the order given.
+    """
+    jobs = list(jobs)
+    if workers is None:
+        workers = _conf.get_option('jobs', 'submit_workers', 8)
+    if rate is None:
+        rate = _conf.get_option('jobs', 'submit_rate', 20)
+    limiter   = _throttle.TokenBucket(rate, burst=1)
+    submitted = set()  # IDs of jobs submitted by this call
+    todo      = [job for job in jobs if not job.submitted]
+    _logme.log('Submitting {} jobs with {} workers'
+               .format(len(todo), workers), 'debug')
+
+    # The pool is shut down first, then the clients of its threads released
+    with _ThreadBatches() as batches, \
+            _futures.ThreadPoolExecutor(max(int(workers), 1)) as pool:
+        # Write every script first
+        for _ in pool.map(_partial(_write, batches=batches),
+                          [j for j in todo if not j.written]):
+            pass
+
+        for wave in _get_waves(todo):
+            # One snapshot of every queue used
+            queues = {id(job.queue): job.queue for job in wave}
+            for queue in queues.values():
+                queue._update()
+
+            ready = []
+            for job in wave:
+                dependencies = job._get_dependencies()
+                if dependencies is None:
+                    continue
+                depends = job._check_dependencies(dependencies, submitted)
+                if depends is not None:
+                    ready.append((job, depends))
+
+            used = 0  # Submitted since the last snapshot
+            while ready:
+                free = len(ready)
+                if wait_on_max_queue:
+                    free = _free_slots(queues, max_jobs) - used
+                    if free <= 0:
+                        for queue in queues.values():
+                            queue.wait_to_submit(max_jobs)
+                        free = _free_slots(queues, max_jobs)
+                        used = 0
+                    free = max(free, 1)
+                chunk, ready = ready[:free], ready[free:]
+                used += len(chunk)
+                futures = [
+                    pool.submit(_submit, job, depends, limiter,
+                                additional_keywords, batches)
+                    for job, depends in chunk
+                ]
+                for (job, _), future in zip(chunk, futures):
+                    try:
+                        future.result()
+                    except Exception as err:
+                        _logme.log('Submission of {} failed: {}'
+                                   .format(job.name, err), 'error')
+                        continue
+                    submitted.add(str(job.id))
+
+    return [job for job in jobs if job.submitted]
+
+
+###############################################################################
+#                              Helper Functions                               #
+###############################################################################
+
+
+def _get_waves(jobs):
+    """Split jobs into lists that only depend on jobs in earlier lists."""
+    remaining = {id(job): job for job in jobs}
+    waves = []
+    while remaining:
+        wave = [
+            job for job in remaining.values()
+            if not any(isinstance(dep, _Job) and id(dep) in remaining
+                       for dep in job.dependencies or [])
+        ]
+        if not wave:
+            raise _ClusterError('Circular dependencies in jobs')
+        for job in wave:
+            remaining.pop(id(job))
+        waves.append(wave)
+    return waves
+
+
+def _free_slots(queues, max_jobs):
+    """Return the smallest number of free slots in the queue snapshots."""
+    return min(queue._free_slots(max_jobs, update=False)
+               for queue in queues.values())
+
+
+def _write(job, batches):
+    """Generate and write the scripts for one job."""
+    batch = job.batch
+    job.batch = batches.get(batch)
+    try:
+        job.write()
+    finally:
+        job.batch = batch
+
+
+def _submit(job, depends, limiter, additional_keywords, batches):
+    """Submit one job with this thread's batch system client."""
+    limiter.acquire()
+    return job._submit(depends, additional_keywords,
+                       batch=batches.get(job.batch))
+
+
+class _ThreadBatches(object):
+
+    """Batch system clients for each thread of one submit_many call.
+
+    Pyro4 proxies cannot be shared between threads, so every thread gets its
+    own connection to the same server, local clients are shared. Every
+    connection is released on exit.
+    """
+
+    def __init__(self):
+        """No clients yet."""
+        self._local   = _threading.local()
+        self._clients = []
+        self._lock    = _threading.Lock()
+
+    def get(self, batch):
+        """Return a client like batch owned by this thread."""
+        if not batch.remote:
+            return batch
+        if not hasattr(self._local, 'batches'):
+            self._local.batches = {}
+        key = (type(batch), batch.uri)
+        if key not in self._local.batches:
+            client = type(batch)(remote=True, uri=batch.uri)
+            self._local.batches[key] = client
+            with self._lock:
+                self._clients.append(client)
+        return self._local.batches[key]
+
+    def release(self):
+        """Release the connection of every client."""
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            try:
+                client.release()
+            except Exception as err:
+                _logme.log('Could not release {}: {}'.format(client, err),
+                           'debug')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
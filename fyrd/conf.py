@@ -75,6 +75,15 @@ DEFAULTS = {
         'sleep_len':        1,
         'queue_update':     2,
         'res_time':         2700, # Time to wait if job is postponed before fail
+        'poll_backoff':     1.5,  # Multiply wait time by this every poll
+        'poll_max':         60,   # Longest wait between polls in seconds
+        'poll_jitter':      0.1,  # Randomly vary wait times by this fraction
+        'max_submit_rate':  5,    # Scheduler submissions per second
+        'max_query_rate':   2,    # Scheduler queries per second
+        'throttle_file':    False, # Share rate limits between processes
+        'shared_snapshot':  False, # Share queue queries between processes
+        'squeue_format':    'delimited', # Or 'fixed' for squeue -O
+        'keep_finished':    600,  # Seconds to remember finished jobs
         'queue_type':       'auto',
         'sbatch':           None, # Path to sbatch command
         'qsub':             None, # Path to qsub command
@@ -88,10 +97,13 @@ DEFAULTS = {
         'clean_files':     True,
         'clean_outputs':   False,
         'file_block_time': 30,
+        'file_watch':      True,
         'scriptpath':      None,
         'outpath':         None,
         'suffix':          'cluster',
         'auto_submit':     True,
+        'submit_workers':  8,
+        'submit_rate':     20,
         'generic_python':  False,
         'profile_file':    _os.path.join(
             CONFIG_PATH, 'profiles.txt'
@@ -147,6 +159,41 @@ CONF_HELP = {
             preempted or suspended. These jobs often resolve into running or
             completed again after some time so it makes sense to wait a bit,
             but not forever.  The default is 45 minutes: 2700 seconds.
+        poll_backoff : float
+            When waiting for jobs or files, multiply the time between polls by
+            this every poll, starting at sleep_len for the queue. The time is
+            reset to sleep_len whenever the state of the waited jobs changes.
+            Set to 1 to always poll every sleep_len seconds.
+        poll_max : int
+            The longest time in seconds to wait between polls. If jobs request
+            a walltime, the wait is never longer than 5% of that time.
+        poll_jitter : float
+            Randomly vary every wait by up to this fraction, so that many
+            waiting processes do not all poll the queue at the same time.
+        max_submit_rate : float
+            Maximum number of submit and kill commands sent to the scheduler
+            per second, 0 for no limit. If the scheduler reports it is busy,
+            all commands pause for a while, however this is set. This also
+            caps [jobs] submit_rate.
+        max_query_rate : float
+            Maximum number of queue query commands (e.g. squeue, sacct) per
+            second, 0 for no limit.
+        throttle_file : bool
+            Share the rate limits between all processes on this machine,
+            using lock files in the config directory. Off by default, as the
+            config directory may be on a shared filesystem.
+        shared_snapshot : bool
+            Share queue query results between all processes on this machine
+            through a file in the config directory, refreshed by a single
+            process at most every queue_update seconds.
+        squeue_format : {'delimited', 'fixed'}
+            How slurm queues are read: 'delimited' uses squeue --format with
+            a separator character, 'fixed' uses the larger fixed width
+            squeue -O output, which also has exit codes.
+        keep_finished : int
+            Seconds a Queue keeps finished jobs, unless a fyrd.Job object
+            still refers to them, so long running scripts do not keep every
+            job the cluster ever ran in memory. 0 keeps all jobs.
         queue_type : str
             the type of queue to use, one of the batch systems (e.g. 'slurm')
             or 'auto'. Default is auto to auto-detect the queue.
@@ -184,6 +231,10 @@ CONF_HELP = {
             waiting for output files to appear.  Some queues can take a long
             time to copy files under load, so it is worth setting this high, it
             won't block unless the files do not appear.
+        file_watch : bool
+            Use inotify (Linux only) to be woken up when output files are
+            written, instead of only polling for them. Polling is still done
+            at a slow rate, as shared file systems do not always send events.
         scriptpath : str
             Path to write all script files by default, must be globally cluster
             accessible. Note: this is *not* the runtime path, just where files
@@ -196,6 +247,13 @@ CONF_HELP = {
         auto_submit : bool
             If wait() or get() are called prior to submission, auto-submit the
             job. Otherwise throws an error and returns None
+        submit_workers : int
+            Number of threads used by submit_many() to write scripts and
+            submit jobs.
+        submit_rate : float
+            Maximum number of jobs per second submit_many() will submit, 0
+            means no limit. Every submission also goes through the
+            [queue] max_submit_rate limit, so a higher value has no effect.
         generic_python : bool
             Use /usr/bin/env python instead of the current executable, not
             advised, but sometimes necessary.
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+A concurrent.futures compatible Executor that runs calls as cluster jobs.
+
+Can be used anywhere a ProcessPoolExecutor is used::
+
+    with fyrd.Executor(profile='long', max_pending=500) as executor:
+        results = list(executor.map(my_function, my_args, chunksize=50))
+
+Every call to submit() creates and submits a fyrd.job.Job, the returned
+Future is completed by a single background thread that polls the queue for
+all pending jobs at once, instead of one wait() per Job. The outputs of
+finished jobs are read by a small pool of worker threads.
+
+Classes
+-------
+Executor
+    Submit function calls to the cluster and return Futures.
+"""
+import itertools as _itertools
+import threading as _threading
+from concurrent import futures as _futures
+from functools import partial as _partial
+from time import time as _time
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import conf  as _conf
+from . import queue as _queue
+from . import logme as _logme
+from . import batch_systems as _batch
+from . import ClusterError as _ClusterError
+from .job import Job as _Job
+
+__all__ = ['Executor']
+
+# Threads reading the outputs of finished jobs, so a slow output file does
+# not hold up the polling of every other job
+RESULT_WORKERS = 4
+
+# Queue updates that can fail in a row before every pending future is failed
+MAX_QUEUE_ERRORS = 5
+
+
+###############################################################################
+#                             The Executor Class                              #
+###############################################################################
+
+
+class Executor(_futures.Executor):
+
+    """Run function calls as cluster jobs, return concurrent.futures.Future.
+
+    Attributes
+    ----------
+    profile : str
+        The profile used for all jobs
+    kwds : dict
+        Any other keyword arguments passed to every Job
+    queue : fyrd.queue.Queue
+        The Queue used to submit and poll all jobs
+    max_pending : int
+        The maximum number of jobs allowed to be pending at once, submit()
+        blocks when this is reached.
+
+    Methods
+    -------
+    submit(fn, *args, **kwargs)
+        Submit a function call as a job and return a Future
+    map(fn, *iterables, timeout=None, chunksize=1)
+        Map a function over iterables, bundling chunksize calls per job
+    shutdown(wait=True, cancel_futures=False)
+        Stop accepting calls and optionally wait for pending jobs
+    """
+
+    def __init__(self, profile=None, max_pending=None, qtype=None,
+                 queue=None, **kwds):
+        """Set up the executor, no jobs are submitted until submit().
+
+        Parameters
+        ----------
+        profile : str, optional
+            The name of a profile saved in the conf
+        max_pending : int, optional
+            The maximum number of unfinished jobs at any one time, submit()
+            blocks until a job finishes if this is reached.
+        qtype : str, optional
+            Override the default queue type
+        queue : fyrd.queue.Queue, optional
+            An already initiated Queue class to use.
+        kwds
+            *All other keywords are parsed into cluster keywords by the
+            options system.* For available keywords see `fyrd.option_help()`
+        """
+        self.profile     = profile
+        self.qtype       = qtype
+        self.kwds        = kwds
+        self.queue       = (queue if queue is not None
+                            else _queue.default_queue(qtype))
+        self.max_pending = int(max_pending) if max_pending else None
+        self._slots = (
+            _threading.BoundedSemaphore(self.max_pending)
+            if self.max_pending else None
+        )
+        self._pending  = {}  # {job_string: (Job, Future)}
+        self._missing  = {}  # {job_string: time first found missing}
+        self._no_files = {}  # {job_string: time completed without outfiles}
+        self._errors   = 0   # Queue updates failed in a row
+        self._lock     = _threading.Lock()
+        self._wakeup   = _threading.Event()
+        self._thread   = None
+        self._workers  = _futures.ThreadPoolExecutor(RESULT_WORKERS)
+        self._shutdown = False
+
+    ####################
+    #  Public Methods  #
+    ####################
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit fn(*args, **kwargs) as a job.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the return value of the function, or the exception it
+            raised.
+        """
+        if self._shutdown:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        if self._slots:
+            self._slots.acquire()
+        try:
+            job = _Job(fn, args=args, kwargs=kwargs, qtype=self.qtype,
+                       profile=self.profile, queue=self.queue, **self.kwds)
+            job.submit()
+        except BaseException:
+            if self._slots:
+                self._slots.release()
+            raise
+        future = _futures.Future()
+        with self._lock:
+            self._pending[str(job.id)] = (job, future)
+            if self._thread is None:
+                self._thread = _threading.Thread(
+                    target=self._poll, name='fyrd-executor-poller'
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def map(self, fn, *iterables, **kwargs):
+        """Return an iterator equivalent to map(fn, *iterables).
+
+        Parameters
+        ----------
+        fn : callable
+        iterables
+            Iterables of arguments to pass to fn
+        timeout : int, optional
+            Maximum number of seconds to wait for each result
+        chunksize : int, optional
+            Number of calls to run in each job, large chunks greatly reduce
+            scheduler overhead for many small calls.
+
+        Returns
+        -------
+        iterator
+            Results in the same order as the inputs
+        """
+        timeout   = kwargs.pop('timeout', None)
+        chunksize = kwargs.pop('chunksize', 1)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: {}'
+                            .format(list(kwargs)))
+        if chunksize < 1:
+            raise ValueError('chunksize must be >= 1.')
+        if chunksize == 1:
+            return super(Executor, self).map(fn, *iterables, timeout=timeout)
+        results = super(Executor, self).map(
+            _partial(_run_chunk, fn), _get_chunks(iterables, chunksize),
+            timeout=timeout
+        )
+        return _itertools.chain.from_iterable(results)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop accepting new calls.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Block until all pending jobs are complete
+        cancel_futures : bool, optional
+            Cancel all futures that are not yet done and kill their jobs
+        """
+        self._shutdown = True
+        if cancel_futures:
+            with self._lock:
+                for job, future in self._pending.values():
+                    future.cancel()
+        self._wakeup.set()
+        if wait:
+            if self._thread:
+                self._thread.join()
+            self._workers.shutdown(wait=True)
+
+    ######################
+    # Internal Functions #
+    ######################
+
+    def _poll(self):
+        """Complete futures from one queue update per tick until shutdown."""
+        policy = self.queue._new_policy(track=False)
+        while True:
+            with self._lock:
+                pending = dict(self._pending)
+            if not pending:
+                if self._shutdown:
+                    # Let the workers finish what is already given to them
+                    self._workers.shutdown(wait=False)
+                    break
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            try:
+                self._tick(pending)
+            except Exception as err:
+                _logme.log('Executor poll failed: {}'.format(err), 'error')
+                # Fail every job not already handed to a worker
+                with self._lock:
+                    failed = [(k, v[1]) for k, v in pending.items()
+                              if k in self._pending]
+                for job_string, future in failed:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(err)
+                    self._release(job_string)
+            policy.observe(len(self._pending))
+            if self._wakeup.wait(policy.next()):
+                policy.reset()
+            self._wakeup.clear()
+
+    def _tick(self, pending):
+        """Check every pending job against one queue update.
+
+        Parameters
+        ----------
+        pending : dict
+            `{job_string: (Job, Future)}`, a copy of self._pending
+        """
+        file_time = float(_conf.get_option('jobs', 'file_block_time', 30))
+        # Kill jobs for cancelled futures
+        for job_string, (job, future) in list(pending.items()):
+            if future.cancelled():
+                _logme.log('Future cancelled, killing job {}'
+                           .format(job.id), 'debug')
+                try:
+                    job.kill(confirm=False)
+                except Exception as err:
+                    _logme.log('Could not kill job {}: {}'
+                               .format(job.id, err), 'warn')
+                self._release(job_string)
+                pending.pop(job_string)
+        # One update for every unfinished job
+        check_jobs = self.queue._normalize_job_ids(
+            [job for job, _ in pending.values()
+             if job.state not in _batch.DONE_STATES]
+        )
+        try:
+            for job_string, job_state in self.queue._get_job_states(
+                    check_jobs, self._missing):
+                if job_state in _batch.DONE_STATES \
+                        or job_state == 'disappeared':
+                    self.queue._finish_job(pending[job_string][0],
+                                           job_state)
+                    self._missing.pop(job_string, None)
+        except Exception as err:
+            self._errors += 1
+            if self._errors >= MAX_QUEUE_ERRORS:
+                self._errors = 0
+                raise
+            _logme.log('Queue update failed ({}/{}): {}'
+                       .format(self._errors, MAX_QUEUE_ERRORS, err), 'error')
+        else:
+            self._errors = 0
+        # Resolve finished jobs once their files are present
+        for job_string, (job, future) in pending.items():
+            if job.state not in _batch.DONE_STATES:
+                continue
+            if job.state == 'completed' and not job._check_files():
+                self._no_files.setdefault(job_string, _time())
+                if _time() - self._no_files[job_string] < file_time:
+                    continue
+            # Workers read the outputs, the job is no longer polled
+            with self._lock:
+                self._pending.pop(job_string, None)
+            self._workers.submit(self._resolve, job_string, job, future)
+
+    def _resolve(self, job_string, job, future):
+        """Get the outputs of a finished job and complete its future.
+
+        Runs in a worker thread, the job is already resolved from the queue
+        and its files checked, so the outputs are read without waiting.
+        """
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = job._get_finished(job._finished_status())
+            except Exception as err:
+                future.set_exception(err)
+            else:
+                if job.state == 'completed':
+                    future.set_result(result)
+                else:
+                    future.set_exception(_ClusterError(
+                        'Job {} failed with state {}'.format(job.id,
+                                                             job.state)
+                    ))
+        finally:
+            self._release(job_string)
+
+    def _release(self, job_string):
+        """Forget a job and free its pending slot."""
+        with self._lock:
+            self._pending.pop(job_string, None)
+        self._no_files.pop(job_string, None)
+        if self._slots:
+            self._slots.release()
+
+
+###############################################################################
+#                          Chunking Helper Functions                          #
+###############################################################################
+
+
+def _get_chunks(iterables, chunksize):
+    """Yield lists of argument tuples of length chunksize."""
+    args = zip(*iterables)
+    while True:
+        chunk = tuple(_itertools.islice(args, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_chunk(fn, chunk):
+    """Run fn on every argument tuple in chunk, runs on the cluster."""
+    return [fn(*args) for args in chunk]
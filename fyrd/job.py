@@ -7,7 +7,6 @@ This module only defines a single object: the Job class.
 import os  as _os
 import sys as _sys
 from uuid import uuid4 as _uuid
-from time import sleep as _sleep
 from datetime import datetime as _dt
 from traceback import print_tb as _tb
 
@@ -24,11 +23,18 @@ from . import run     as _run
 from . import conf    as _conf
 from . import queue   as _queue
 from . import logme   as _logme
+from . import watch   as _watch
 from . import batch_systems  as _batch
 from . import ClusterError   as _ClusterError
 from .submission_scripts import Function as _Function
 _options = _batch.options
 
+# The asyncio API uses syntax older pythons cannot parse
+if _sys.version_info >= (3, 7):
+    from .aio import JobMixin as _AsyncMixin
+else:
+    _AsyncMixin = object
+
 __all__ = ['Job']
 
 ###############################################################################
@@ -36,7 +42,7 @@ __all__ = ['Job']
 ###############################################################################
 
 
-class Job(object):
+class Job(_AsyncMixin):
 
     """Information about a single job on the cluster.
 
@@ -137,6 +143,10 @@ class Job(object):
         is a script), by default saves all outputs to self (i.e. .out, .stdout,
         .stderr) and deletes all intermediate files before returning. If `save`
         argument is `False`, does not delete the output files by default.
+    async_wait()
+        Coroutine version of wait(), python 3.7+ only
+    async_get()
+        Coroutine version of get(), python 3.7+ only
 
     Notes
     -----
@@ -199,6 +209,9 @@ class Job(object):
     # Pickled output file for functions
     poutfile      = None
 
+    # The Script class used for functions
+    _function_class = _Function
+
     # Holds queue information in torque and slurm
     queue_info    = None
 
@@ -661,7 +674,7 @@ class Job(object):
                     'jobs', 'generic_python') else self.batch.python_path
 
             self.poutfile = _os.path.split(self.outfile)[1] + '.func.pickle'
-            self.function = _Function(
+            self.function = self._function_class(
                 file_name=script_file, python=executable,
                 function=command, job=self, args=args, kwargs=kwargs,
                 imports=self.imports, syspaths=syspaths, outfile=self.poutfile
@@ -754,21 +767,9 @@ class Job(object):
         if not self.written:
             self.write()
 
-        # Check dependencies
-        dependencies = []
-        if self.dependencies:
-            for depend in self.dependencies:
-                if isinstance(depend, Job):
-                    if not depend.id:
-                        _logme.log(
-                            'Cannot submit job as dependency {} '
-                            .format(depend) + 'has not been submitted',
-                            'error'
-                        )
-                        return self
-                    dependencies.append(str(depend.id))
-                else:
-                    dependencies.append(str(depend))
+        dependencies = self._get_dependencies()
+        if dependencies is None:
+            return self
 
         # Wait on the queue if necessary
         if wait_on_max_queue:
@@ -778,71 +779,11 @@ class Job(object):
 
         # Only include queued or running dependencies
         self.queue._update()  # Force update
-        depends = []
-        for depend in dependencies:
-            dep_check = self.queue.check_dependencies(depend)
-            if dep_check == 'absent':
-                _logme.log(
-                    'Cannot submit job as dependency {} '
-                    .format(depend) + 'is not in the queue',
-                    'error'
-                )
-                return self
-            elif dep_check == 'good':
-                _logme.log(
-                    'Dependency {} is complete, skipping'
-                    .format(depend), 'debug'
-                )
-            elif dep_check == 'bad':
-                _logme.log(
-                    'Cannot submit job as dependency {} '
-                    .format(depend) + 'has failed',
-                    'error'
-                )
-                return self
-            elif dep_check == 'active':
-                if self.queue.jobs[depend].state == 'completeing':
-                    continue
-                _logme.log('Dependency {} is {}, adding to deps'
-                           .format(depend, self.queue.jobs[depend].state),
-                           'debug')
-                depends.append(depend)
-            else:
-                # This shouldn't happen ever
-                raise _ClusterError('fyrd.queue.Queue.check_dependencies() ' +
-                                    'returned an unrecognized value {0}'
-                                    .format(dep_check))
-
-        results = self.batch.submit(
-            self.submission,
-            dependencies=depends,
-            job=self, args=self.submit_args,
-            kwds=additional_keywords
-        )
-
-        if results['error']:
-            stdout, stderr = (results['stdout'], results['stderr'])
-            err_str = ('Error executing the job in the batch system...\n'
-                       'stdout: {0}\n'
-                       'stderr: {1}').format(stdout, stderr)
-            _logme.log(err_str,
-                       'error')
-            raise _batch.BatchSystemError(
-                'Error executing the job in the batch system',
-                stdout=stdout, stderr=stderr
-            )
-
-        self.id = results['result']
-
-        self.submitted = True
-        self.submit_time = _dt.now()
-        self.state = 'submitted'
-
-        if not self.submitted:
-            raise _ClusterError('Submission appears to have failed, this '
-                                "shouldn't happen")
+        depends = self._check_dependencies(dependencies)
+        if depends is None:
+            return self
 
-        return self
+        return self._submit(depends, additional_keywords)
 
     def resubmit(self, wait_on_max_queue=True, cancel_running=None):
         """Attempt to auto resubmit, deletes prior files.
@@ -1096,52 +1037,11 @@ class Job(object):
                     'delete_outfiles={}').format(
                         cleanup, self.clean_files, delete_outfiles
                     ), 'debug')
-        # Wait for queue
-        status = self.wait()
-        if status is not True:
-            if status == 'disappeared':
-                msg = 'Job disappeared from queue'
-                _logme.log(msg + ', attempting to get '
-                           'outputs', 'debug')
-            else:
-                msg = 'Wait failed'
-                _logme.log(msg + ', attempting to get outputs anyway',
-                           'debug')
-            try:
-                self.fetch_outputs(save=save, delete_files=False,
-                                   get_stats=False)
-            except IOError:
-                _logme.log(msg + ' and files could not be found, job must '
-                           'have failed', 'error')
-                if raise_on_error:
-                    raise
-                return
-            if status != 'disappeared':
-                return
-        else:
-            # Get output
-            _logme.log('Wait complete, fetching outputs', 'debug')
-            self.fetch_outputs(save=save, delete_files=False)
-        out = self.out if save else self.get_output(save=save, update=False)
-        if isinstance(out, tuple) and issubclass(out[0], Exception):
-            if raise_on_error:
-                _reraise(*out)
-            else:
-                _logme.log('Job failed with exception {}'.format(out))
-                print(_tb(out[2]))
-                return out
-        # Cleanup
-        if cleanup is None:
-            cleanup = self.clean_files
-        else:
-            assert isinstance(cleanup, bool)
-        if delete_outfiles is None:
-            delete_outfiles = self.clean_outputs
-        if save is False:
-            delete_outfiles = del_no_save if del_no_save is not None else False
-        if cleanup:
-            self.clean(delete_outputs=delete_outfiles)
-        return out
+        return self._get_finished(
+            self.wait(), save=save, cleanup=cleanup,
+            delete_outfiles=delete_outfiles, del_no_save=del_no_save,
+            raise_on_error=raise_on_error
+        )
 
     def get_output(self, save=True, delete_file=None, update=True,
                    raise_on_error=True):
@@ -1598,6 +1498,128 @@ class Job(object):
     #  Internals  #
     ###############
 
+    def _get_dependencies(self):
+        """Return the IDs of all dependencies, None if any not submitted."""
+        dependencies = []
+        if self.dependencies:
+            for depend in self.dependencies:
+                if isinstance(depend, Job):
+                    if not depend.id:
+                        _logme.log(
+                            'Cannot submit job as dependency {} '
+                            .format(depend) + 'has not been submitted',
+                            'error'
+                        )
+                        return None
+                    dependencies.append(str(depend.id))
+                else:
+                    dependencies.append(str(depend))
+        return dependencies
+
+    def _check_dependencies(self, dependencies, submitted=None):
+        """Return the dependencies still active in the current queue info.
+
+        Parameters
+        ----------
+        dependencies : list of str
+            Output of _get_dependencies()
+        submitted : set, optional
+            IDs of jobs known to be just submitted, these are always kept
+            as they may not be in the queue info yet.
+
+        Returns
+        -------
+        list or None
+            None if any dependency is missing or failed.
+        """
+        depends = []
+        for depend in dependencies:
+            if submitted and depend in submitted:
+                depends.append(depend)
+                continue
+            dep_check = self.queue.check_dependencies(depend)
+            if dep_check == 'absent':
+                _logme.log(
+                    'Cannot submit job as dependency {} '
+                    .format(depend) + 'is not in the queue',
+                    'error'
+                )
+                return None
+            elif dep_check == 'good':
+                _logme.log(
+                    'Dependency {} is complete, skipping'
+                    .format(depend), 'debug'
+                )
+            elif dep_check == 'bad':
+                _logme.log(
+                    'Cannot submit job as dependency {} '
+                    .format(depend) + 'has failed',
+                    'error'
+                )
+                return None
+            elif dep_check == 'active':
+                if self.queue.jobs[depend].state == 'completeing':
+                    continue
+                _logme.log('Dependency {} is {}, adding to deps'
+                           .format(depend, self.queue.jobs[depend].state),
+                           'debug')
+                depends.append(depend)
+            else:
+                # This shouldn't happen ever
+                raise _ClusterError('fyrd.queue.Queue.check_dependencies() ' +
+                                    'returned an unrecognized value {0}'
+                                    .format(dep_check))
+        return depends
+
+    def _submit(self, depends, additional_keywords=None, batch=None):
+        """Submit the written job to the batch system, no checks.
+
+        Parameters
+        ----------
+        depends : list of str
+            Job IDs to depend on
+        additional_keywords : dict, optional
+            Pass this dictionary to the batch system submission function
+        batch : fyrd.batch_systems.base.BatchSystemClient, optional
+            Use this client instead of self.batch, for use in threads.
+
+        Returns
+        -------
+        self : Job
+        """
+        batch = batch if batch is not None else self.batch
+        results = batch.submit(
+            self.submission,
+            dependencies=depends,
+            job=self, args=self.submit_args,
+            kwds=additional_keywords
+        )
+
+        if results['error']:
+            stdout, stderr = (results['stdout'], results['stderr'])
+            err_str = ('Error executing the job in the batch system...\n'
+                       'stdout: {0}\n'
+                       'stderr: {1}').format(stdout, stderr)
+            _logme.log(err_str,
+                       'error')
+            raise _batch.BatchSystemError(
+                'Error executing the job in the batch system',
+                stdout=stdout, stderr=stderr
+            )
+
+        self.id = results['result']
+        self.queue._track(self)
+
+        self.submitted = True
+        self.submit_time = _dt.now()
+        self.state = 'submitted'
+
+        if not self.submitted:
+            raise _ClusterError('Submission appears to have failed, this '
+                                "shouldn't happen")
+
+        return self
+
     def _update(self, fetch_info=True):
         """Update status from the queue.
 
@@ -1611,6 +1633,7 @@ class Job(object):
         if self.done or not self.submitted:
             self._updating = False
             return
+        self.queue._track(self)
         self.queue.update(job_id=self.id)
         if self.submitted and self.id:
             queue_info = self.queue[self.id]
@@ -1662,6 +1685,128 @@ class Job(object):
                     self.get_times(update=False)
         self._updating = False
 
+    def _update_from_queue(self, queue_info, state):
+        """Set state from an already fetched queue snapshot.
+
+        Used by the Queue to update many jobs from a single query without
+        each job querying the queue again.
+
+        Parameters
+        ----------
+        queue_info : fyrd.queue.QueueJob or None
+            The entry for this job in the snapshot, if any.
+        state : str
+            The state of this job in the snapshot, 'disappeared' if the job
+            could not be found.
+        """
+        if queue_info:
+            self.found = True
+            self.queue_info = queue_info
+        if state == 'disappeared':
+            # Only trust a disappeared job if its outputs are there
+            self.disappeared = True
+            state = 'completed' if self._check_files() else 'failed'
+        self.state = state
+
+    def _finished_status(self):
+        """Return what wait() returns, for a job already known to be done.
+
+        Does not query the queue or block, used once the job has been
+        resolved from a queue snapshot and its files checked.
+
+        Returns
+        -------
+        success : bool or str
+        """
+        if self.disappeared:
+            if self._check_files():
+                _logme.log('Job files found for disappered job, assuming '
+                           'success', 'info')
+                return 'disappeared'
+            _logme.log('Disappeared job has no output files, assuming '
+                       'failure', 'error')
+            return False
+        if self.state not in _batch.GOOD_STATES:
+            return False
+        if self.get_exitcode(update=False) != 0:
+            _logme.log('Job failed with exitcode {}'
+                       .format(self.exitcode), 'debug')
+            return False
+        return self._check_files()
+
+    def _get_finished(self, status, save=True, cleanup=None,
+                      delete_outfiles=None, del_no_save=None,
+                      raise_on_error=True):
+        """Return the output of a finished job, the second half of get().
+
+        Parameters
+        ----------
+        status : bool or str
+            The return value of wait()
+
+        See get() for the other arguments.
+        """
+        if status is not True:
+            if status == 'disappeared':
+                msg = 'Job disappeared from queue'
+                _logme.log(msg + ', attempting to get '
+                           'outputs', 'debug')
+            else:
+                msg = 'Wait failed'
+                _logme.log(msg + ', attempting to get outputs anyway',
+                           'debug')
+            try:
+                self.fetch_outputs(save=save, delete_files=False,
+                                   get_stats=False)
+            except IOError:
+                _logme.log(msg + ' and files could not be found, job must '
+                           'have failed', 'error')
+                if raise_on_error:
+                    raise
+                return
+            if status != 'disappeared':
+                return
+        else:
+            # Get output
+            _logme.log('Wait complete, fetching outputs', 'debug')
+            self.fetch_outputs(save=save, delete_files=False)
+        out = self.get_output(save=save, update=False,
+                              raise_on_error=False)
+        if isinstance(out, tuple) and issubclass(out[0], Exception):
+            if raise_on_error:
+                _reraise(*out)
+            else:
+                _logme.log('Job failed with exception {}'.format(out))
+                print(_tb(out[2]))
+                return out
+        # Cleanup
+        if cleanup is None:
+            cleanup = self.clean_files
+        else:
+            assert isinstance(cleanup, bool)
+        if delete_outfiles is None:
+            delete_outfiles = self.clean_outputs
+        if save is False:
+            delete_outfiles = del_no_save if del_no_save is not None else False
+        if cleanup:
+            self.clean(delete_outputs=delete_outfiles)
+        return out
+
+    def _check_files(self):
+        """Return True if all outfiles exist, do not block.
+
+        Returns
+        -------
+        bool
+        """
+        if self._found_files:
+            return True
+        for outfile in self.incomplete_outfiles:
+            if not _os.path.isfile(outfile):
+                return False
+        self._found_files = True
+        return True
+
     def _wait_for_files(self, btme=None, caution_message=False):
         """Block until files appear up to 'file_block_time' in config file.
 
@@ -1683,17 +1828,31 @@ class Job(object):
         if self._found_files:
             _logme.log('Already found files, not waiting again', 'debug')
             return True
-        wait_time = 0.1  # seconds
         if btme:
             lvl = 'debug'
         else:
             lvl = 'warn'
             btme = _conf.get_option('jobs', 'file_block_time', 30)
-        start = _dt.now()
-        dsp   = False
+        start  = _dt.now()
+        dsp    = False
+        # Sets how long to block for between checks of the job
+        policy = self.queue._new_policy(self, track=False)
         _logme.log('Checking for output files', 'debug')
         while True:
             runtime = (_dt.now() - start).seconds
+            outfiles = self.incomplete_outfiles
+            if not outfiles:
+                _logme.log('No incomplete outfiles, assuming all found in ' +
+                           '{} seconds'.format(runtime), 'debug')
+                break
+            # Woken by inotify when files are written, or by slow polling
+            timeout = min(policy.next(), max(btme - runtime, 0))
+            if _watch.wait_for_files(outfiles, timeout,
+                                     self.queue.poll_policy):
+                _logme.log('All output files found in {} seconds'
+                           .format((_dt.now() - start).seconds), 'debug')
+                break
+            runtime = (_dt.now() - start).seconds
             if caution_message and runtime > 1:
                 _logme.log('Job complete.', 'info')
                 _logme.log('Waiting for output files to appear.', 'info')
@@ -1702,26 +1861,11 @@ class Job(object):
                 _logme.log('Still waiting for output files to appear',
                            'info')
                 dsp = True
-            count = 0
-            outfiles = self.incomplete_outfiles
-            tlen = len(outfiles)
-            if not outfiles:
-                _logme.log('No incomplete outfiles, assuming all found in ' +
-                           '{} seconds'.format(runtime), 'debug')
-                break
-            for i in outfiles:
-                if _os.path.isfile(i):
-                    count += 1
-            if count == tlen:
-                _logme.log('All output files found in {} seconds'
-                           .format(runtime), 'debug')
-                break
-            _sleep(wait_time)
-            if runtime > btme:
+            if runtime >= btme:
                 _logme.log('Job files have not appeared for ' +
                            '>{} seconds'.format(btme), lvl)
                 return False
-            if not self._updating:
+            if not self._updating and not self.done:
                 self.update()
             if runtime > 2 and self.get_exitcode(update=False) != 0:
                 _logme.log('Job failed with exit code {}.'
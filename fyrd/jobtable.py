@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage for the jobs of a Queue.
+
+A busy cluster reports tens of thousands of jobs on every queue update, and a
+long running driver sees every one of them over its lifetime. Instead of one
+object (with its own __dict__) per job and per array child, a JobTable keeps
+one column per field: the states, owners and partitions as small integer
+codes into a table of interned strings, the counts in typed arrays, and the
+flags in a bytearray. The QueueJob and QueueChild classes in fyrd.queue are
+small __slots__ views of one row.
+
+The table also keeps indexes of job rows by state and by owner, so filtering
+the queue does not scan every job, and a free list, so evicted rows are
+reused instead of growing the columns.
+
+Classes
+-------
+JobTable
+    Columns of job data with indexes by state and owner.
+"""
+import sys as _sys
+from array import array as _array
+from time import time as _time
+
+###############################################################################
+#                       Try Import Non-Required Modules                       #
+###############################################################################
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+try:
+    import pandas as _pd
+except ImportError:
+    _pd = None
+
+try:
+    import pyarrow as _pa
+except ImportError:
+    _pa = None
+
+__all__ = ['JobTable']
+
+# Stored for None in the integer columns
+NULL = -2**31
+
+# Bits of the flags column
+DISAPPEARED = 1
+ARRAY_JOB   = 2
+FREE        = 4
+
+# Columns of to_frame() and to_arrow()
+EXPORT_COLUMNS = ['job_id', 'array_id', 'name', 'owner', 'queue', 'state',
+                  'nodes', 'threads', 'cpus', 'exitcode', 'disappeared']
+
+# {field: (column, kind)}, kind is one of 'object', 'code', 'int' or a flag
+FIELDS = {
+    'id':          ('ids',       'object'),
+    'name':        ('names',     'object'),
+    'nodes':       ('nodes',     'object'),
+    'owner':       ('owners',    'code'),
+    'queue':       ('queues',    'code'),
+    'state':       ('states',    'code'),
+    'threads':     ('threads',   'int'),
+    'cpus':        ('cpus',      'int'),
+    'exitcode':    ('exitcodes', 'int'),
+    'disappeared': ('flags',     DISAPPEARED),
+    'array_job':   ('flags',     ARRAY_JOB),
+}
+
+
+###############################################################################
+#                              The JobTable Class                             #
+###############################################################################
+
+
+class JobTable(object):
+
+    """Columns of job data with indexes by state and owner.
+
+    Every job, and every child of an array job, is one row. Parent jobs are
+    found by job ID with row(), children only through their parent with
+    children().
+
+    Attributes
+    ----------
+    by_state : dict
+        {state: set of rows} of parent jobs
+    by_owner : dict
+        {owner: set of rows} of parent jobs
+    done_at : array
+        The time each row was first seen in a finished state, 0 if active
+
+    Methods
+    -------
+    row(job_id)
+        Return the row of a parent job, or None.
+    add(job_id, parent=None)
+        Add a row for a job or a child of the parent row, return the row.
+    get(row, field)
+        Return the value of one field.
+    set(row, field, value)
+        Set the value of one field, updating the indexes.
+    children(row)
+        Return the {array_id: row} of the children of a parent row.
+    find(field, values)
+        Return the set of parent rows where field is any of values.
+    values(field)
+        Return the set of values of an indexed field in parent rows.
+    remove(row)
+        Remove a parent row and its children, the rows are reused.
+    job_ids()
+        Return a list of all parent job IDs.
+    evictable(before, keep=())
+        Return the parent rows that finished before a time.
+    to_frame()
+        Return a pandas DataFrame of every job and array child.
+    to_arrow()
+        Return a pyarrow Table of every job and array child.
+    """
+
+    __slots__ = ['ids', 'names', 'nodes', 'owners', 'queues', 'states',
+                 'threads', 'cpus', 'exitcodes', 'flags', 'done_at',
+                 'parents', 'by_state', 'by_owner', 'done_codes',
+                 '_children', '_index', '_free', '_strings', '_codes']
+
+    def __init__(self, done_states=()):
+        """Create an empty table.
+
+        Parameters
+        ----------
+        done_states : list of str, optional
+            Rows in these states get a done_at time, see evictable().
+        """
+        self.ids       = []
+        self.names     = []
+        self.nodes     = []
+        self.owners    = _array('i')
+        self.queues    = _array('i')
+        self.states    = _array('i')
+        self.threads   = _array('i')
+        self.cpus      = _array('i')
+        self.exitcodes = _array('i')
+        self.flags     = bytearray()
+        self.done_at   = _array('d')
+        self.parents   = _array('i')  # Parent row of children, -1 if none
+        self.by_state  = {}
+        self.by_owner  = {}
+        self._children = {}  # {row: {array_id: row}} of array jobs
+        self._index    = {}  # {job_id: row} of parent jobs
+        self._free     = []
+        # Interned strings, code 0 is None
+        self._strings  = [None]
+        self._codes    = {None: 0}
+        self.done_codes = set(self.code(i) for i in done_states)
+
+    ####################
+    #  Public Methods  #
+    ####################
+
+    def row(self, job_id):
+        """Return the row of a parent job, or None."""
+        return self._index.get(job_id)
+
+    def add(self, job_id, parent=None):
+        """Add a row for a job or a child of the parent row.
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID, or the array ID for children
+        parent : int, optional
+            The row of the parent job
+
+        Returns
+        -------
+        row : int
+        """
+        job_id = _sys.intern(str(job_id))
+        if self._free:
+            row = self._free.pop()
+            self.ids[row]       = job_id
+            self.names[row]     = None
+            self.nodes[row]     = None
+            self.owners[row]    = 0
+            self.queues[row]    = 0
+            self.states[row]    = 0
+            self.threads[row]   = NULL
+            self.cpus[row]      = NULL
+            self.exitcodes[row] = NULL
+            self.flags[row]     = 0
+            self.done_at[row]   = 0
+        else:
+            row = len(self.ids)
+            self.ids.append(job_id)
+            self.names.append(None)
+            self.nodes.append(None)
+            self.owners.append(0)
+            self.queues.append(0)
+            self.states.append(0)
+            self.threads.append(NULL)
+            self.cpus.append(NULL)
+            self.exitcodes.append(NULL)
+            self.flags.append(0)
+            self.done_at.append(0)
+            self.parents.append(-1)
+        if parent is None:
+            self.parents[row] = -1
+            self._index[job_id] = row
+            self.by_owner.setdefault(0, set()).add(row)
+            self.by_state.setdefault(0, set()).add(row)
+        else:
+            self.parents[row] = parent
+            self._children.setdefault(parent, {})[job_id] = row
+        return row
+
+    def get(self, row, field):
+        """Return the value of one field of a row."""
+        column, kind = FIELDS[field]
+        value = getattr(self, column)[row]
+        if kind == 'object':
+            return value
+        if kind == 'code':
+            return self._strings[value]
+        if kind == 'int':
+            return None if value == NULL else value
+        return bool(value & kind)
+
+    def set(self, row, field, value):
+        """Set the value of one field of a row, updating the indexes."""
+        column, kind = FIELDS[field]
+        if kind == 'object':
+            if field == 'id':
+                raise ValueError('Job IDs cannot be changed')
+            getattr(self, column)[row] = value
+        elif kind == 'code':
+            code = self.code(value)
+            values = getattr(self, column)
+            if values[row] == code:
+                return
+            if self.parents[row] == -1:
+                index = self.by_state if field == 'state' else \
+                    self.by_owner if field == 'owner' else None
+                if index is not None:
+                    index[values[row]].discard(row)
+                    index.setdefault(code, set()).add(row)
+            values[row] = code
+            if field == 'state':
+                if code not in self.done_codes:
+                    self.done_at[row] = 0
+                elif not self.done_at[row]:
+                    self.done_at[row] = _time()
+        elif kind == 'int':
+            getattr(self, column)[row] = NULL if value is None else value
+        elif value:
+            self.flags[row] |= kind
+        else:
+            self.flags[row] &= ~kind
+
+    def children(self, row):
+        """Return the {array_id: row} of the children of a parent row."""
+        return self._children.get(row, {})
+
+    def remove(self, row):
+        """Remove a parent row and its children, the rows are reused."""
+        self._index.pop(self.ids[row], None)
+        self.by_state[self.states[row]].discard(row)
+        self.by_owner[self.owners[row]].discard(row)
+        for child in self._children.pop(row, {}).values():
+            self._clear(child)
+        self._clear(row)
+
+    def find(self, field, values):
+        """Return the set of parent rows where field is any of values.
+
+        Parameters
+        ----------
+        field : {'state', 'owner'}
+            One of the indexed fields
+        values : list of str
+
+        Returns
+        -------
+        set of int
+        """
+        index = self.by_state if field == 'state' else self.by_owner
+        rows  = set()
+        for value in values:
+            code = self._codes.get(value)
+            if code is not None and code in index:
+                rows.update(index[code])
+        return rows
+
+    def values(self, field):
+        """Return the set of values of an indexed field in parent rows."""
+        index = self.by_state if field == 'state' else self.by_owner
+        return set(self._strings[code] for code, rows in index.items()
+                   if rows and code)
+
+    def job_ids(self):
+        """Return a list of all parent job IDs."""
+        return list(self._index)
+
+    def code(self, value):
+        """Return the integer code of a string, interning new strings."""
+        code = self._codes.get(value)
+        if code is None:
+            if isinstance(value, str):
+                value = _sys.intern(value)
+            code = len(self._strings)
+            self._strings.append(value)
+            self._codes[value] = code
+        return code
+
+    def string(self, code):
+        """Return the string of an integer code."""
+        return self._strings[code]
+
+    def to_frame(self):
+        """Return a pandas DataFrame of every job and array child.
+
+        States, owners and queues are categorical, counts are nullable
+        integers. No QueueJob objects are created.
+
+        Returns
+        -------
+        pandas.DataFrame
+            With the columns in EXPORT_COLUMNS
+        """
+        if _pd is None:
+            raise ImportError('pandas is required for to_frame()')
+        columns, categories = self._export()
+        categories = _pd.Index(categories, dtype=object)
+        data = {}
+        for name in EXPORT_COLUMNS:
+            values = columns[name]
+            if name in ('owner', 'queue', 'state'):
+                values = _pd.Categorical.from_codes(
+                    values - 1, categories
+                ).remove_unused_categories()
+            elif name in ('nodes', 'threads', 'cpus', 'exitcode'):
+                values = _pd.arrays.IntegerArray(values, values == NULL)
+            data[name] = values
+        return _pd.DataFrame(data, columns=EXPORT_COLUMNS)
+
+    def to_arrow(self):
+        """Return a pyarrow Table of every job and array child.
+
+        States, owners and queues are dictionary encoded, missing counts are
+        nulls. No QueueJob objects are created.
+
+        Returns
+        -------
+        pyarrow.Table
+            With the columns in EXPORT_COLUMNS
+        """
+        if _pa is None:
+            raise ImportError('pyarrow is required for to_arrow()')
+        columns, categories = self._export()
+        dictionary = _pa.array(categories, type=_pa.string())
+        arrays = []
+        for name in EXPORT_COLUMNS:
+            values = columns[name]
+            if name in ('owner', 'queue', 'state'):
+                values = _pa.DictionaryArray.from_arrays(
+                    _pa.array(values - 1, mask=values == 0), dictionary
+                )
+            elif name in ('nodes', 'threads', 'cpus', 'exitcode'):
+                values = _pa.array(values, mask=values == NULL)
+            else:
+                values = _pa.array(values)
+            arrays.append(values)
+        return _pa.Table.from_arrays(arrays, names=EXPORT_COLUMNS)
+
+    def evictable(self, before, keep=()):
+        """Return the parent rows that finished before a time.
+
+        Parameters
+        ----------
+        before : float
+            Rows with a done_at time earlier than this are returned
+        keep : container of str, optional
+            Job IDs never to return
+
+        Returns
+        -------
+        list of int
+        """
+        rows = []
+        for code in self.done_codes:
+            for row in self.by_state.get(code, ()):
+                if self.done_at[row] < before and self.ids[row] not in keep:
+                    rows.append(row)
+        return rows
+
+    ######################
+    # Internal Functions #
+    ######################
+
+    def _clear(self, row):
+        """Free one row, dropping its objects."""
+        self.ids[row]   = None
+        self.names[row] = None
+        self.nodes[row] = None
+        self.flags[row] = FREE
+        self._free.append(row)
+
+    def _export(self):
+        """Return numpy columns of every job and array child.
+
+        Array jobs are exported as one row per child, like the output of the
+        queue_parser, their summary rows are skipped.
+
+        Returns
+        -------
+        columns : dict
+            {column: numpy array}, the integer columns are int32 with NULL
+            for missing values, owner, queue and state are codes
+        categories : list
+            The strings of the codes, minus one
+        """
+        if _np is None:
+            raise ImportError('numpy is required to export the queue')
+        flags   = _np.frombuffer(self.flags, dtype=_np.uint8)
+        parents = _np.frombuffer(self.parents, dtype=_np.int32)
+        child   = parents >= 0
+        keep    = ((flags & FREE) == 0) & (child | ((flags & ARRAY_JOB) == 0))
+        rows    = _np.flatnonzero(keep)
+        ids     = _np.array(self.ids, dtype=object)
+        child   = child[rows]
+        columns = {
+            'job_id':   ids[_np.where(child, parents[rows], rows)],
+            'array_id': _np.where(child, ids[rows], None),
+            'name':     _np.array(self.names, dtype=object)[rows],
+            'nodes':    _np.array(
+                [len(self.nodes[i]) if self.nodes[i] is not None else NULL
+                 for i in rows], dtype=_np.int32
+            ),
+            'disappeared': (flags[rows] & DISAPPEARED) > 0,
+        }
+        for name, column in [('owner', self.owners), ('queue', self.queues),
+                             ('state', self.states),
+                             ('threads', self.threads), ('cpus', self.cpus),
+                             ('exitcode', self.exitcodes)]:
+            columns[name] = _np.frombuffer(column, dtype=_np.int32)[rows]
+        return columns, self._strings[1:]
+
+    ###############
+    #  Internals  #
+    ###############
+
+    def __contains__(self, job_id):
+        """Check for a parent job ID."""
+        return job_id in self._index
+
+    def __len__(self):
+        """The number of parent jobs."""
+        return len(self._index)
+
+    def __repr__(self):
+        """Display job and row counts."""
+        return 'JobTable<jobs:{};rows:{};free:{}>'.format(
+            len(self._index), len(self.ids), len(self._free)
+        )
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Polling policies used by all of the waiting loops.
+
+A policy decides how long to sleep between polls of the queue or of the file
+system. The default PollPolicy starts at a short interval and backs off
+exponentially up to a cap, with some random jitter so many waiting processes
+do not poll in lockstep. The interval is reset whenever the polled state
+changes, and the cap can be scaled to the requested walltime of the job, so
+that second-long jobs are noticed quickly but multi-hour jobs do not poll the
+scheduler every second.
+
+All options are set in the [queue] section of the config:
+
+    poll_backoff : float
+        Multiply the interval by this after every poll, 1 disables backoff
+    poll_max : float
+        The longest interval between polls in seconds
+    poll_jitter : float
+        Randomly vary every interval by up to this fraction
+
+To use a different policy, pass any class with the same interface as the
+`poll_policy` argument of fyrd.queue.Queue.
+
+Classes
+-------
+PollPolicy
+    Exponential backoff with a cap, jitter and reset on state change.
+
+Functions
+---------
+time_to_seconds
+    Convert a walltime string (D-HH:MM:SS) into seconds.
+"""
+import random as _random
+from time import sleep as _sleep
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import conf as _conf
+
+__all__ = ['PollPolicy', 'time_to_seconds']
+
+# An interval will never be more than this fraction of the expected runtime
+HINT_FRACTION = 0.05
+
+
+###############################################################################
+#                             The Polling Policy                              #
+###############################################################################
+
+
+class PollPolicy(object):
+
+    """Decide how long to sleep between polls.
+
+    Attributes
+    ----------
+    initial : float
+        The first (and reset) interval in seconds
+    maximum : float
+        The longest interval in seconds, scaled down by hint
+    backoff : float
+        Interval multiplier applied after every poll
+    jitter : float
+        Fraction to randomly vary each interval by
+    interval : float
+        The current interval before jitter
+    polls : int
+        The number of times next() or sleep() was called
+    resets : int
+        The number of times the interval was reset
+    slept : float
+        The total number of seconds slept by sleep()
+    queries : int
+        The number of queue queries made while this policy was used, set by
+        the Queue.
+
+    Methods
+    -------
+    next()
+        Return the next interval to sleep for.
+    sleep()
+        Sleep for the next interval.
+    observe(state)
+        Reset the interval if state differs from the last observed state.
+    reset()
+        Return to the initial interval.
+    stats()
+        Return a dictionary of counters.
+    """
+
+    def __init__(self, initial=None, maximum=None, backoff=None,
+                 jitter=None, hint=None):
+        """Set the policy, defaults are taken from the [queue] config.
+
+        Parameters
+        ----------
+        initial : float, optional
+            The first interval, defaults to the sleep_len option
+        maximum : float, optional
+            The longest interval, defaults to the poll_max option
+        backoff : float, optional
+            Interval multiplier, defaults to the poll_backoff option
+        jitter : float, optional
+            Fraction of jitter, defaults to the poll_jitter option
+        hint : float or str, optional
+            The expected runtime in seconds or as a walltime string, the
+            maximum interval will not be larger than 5% of this.
+        """
+        if initial is None:
+            initial = _conf.get_option('queue', 'sleep_len', 1)
+        if maximum is None:
+            maximum = _conf.get_option('queue', 'poll_max', 60)
+        if backoff is None:
+            backoff = _conf.get_option('queue', 'poll_backoff', 1.5)
+        if jitter is None:
+            jitter = _conf.get_option('queue', 'poll_jitter', 0.1)
+        self.initial = float(initial)
+        self.maximum = max(float(maximum), self.initial)
+        self.backoff = max(float(backoff), 1.0)
+        self.jitter  = min(max(float(jitter), 0.0), 1.0)
+        if hint:
+            hint = time_to_seconds(hint)
+            if hint:
+                self.maximum = max(
+                    min(self.maximum, hint * HINT_FRACTION), self.initial
+                )
+        self.interval = self.initial
+        self.polls    = 0
+        self.resets   = 0
+        self.slept    = 0.0
+        self.queries  = 0
+        self._state   = None
+
+    def next(self):
+        """Return the next interval to sleep for and back off.
+
+        Returns
+        -------
+        float
+        """
+        self.polls += 1
+        interval = self.interval
+        if self.jitter:
+            interval *= 1 + _random.uniform(-self.jitter, self.jitter)
+        self.interval = min(self.interval * self.backoff, self.maximum)
+        return interval
+
+    def sleep(self):
+        """Sleep for the next interval."""
+        interval = self.next()
+        self.slept += interval
+        _sleep(interval)
+
+    def observe(self, state):
+        """Reset the interval if state differs from the last observed one.
+
+        Parameters
+        ----------
+        state : object
+            Any comparable summary of the polled state.
+        """
+        if state != self._state:
+            if self._state is not None:
+                self.reset()
+            self._state = state
+
+    def reset(self):
+        """Return to the initial interval."""
+        self.interval = self.initial
+        self.resets  += 1
+
+    def stats(self):
+        """Return a dictionary of counters.
+
+        Returns
+        -------
+        dict
+            {'polls': int, 'resets': int, 'slept': float, 'queries': int}
+        """
+        return {'polls': self.polls, 'resets': self.resets,
+                'slept': self.slept, 'queries': self.queries}
+
+    def __repr__(self):
+        """Display the current interval and counters."""
+        return ('PollPolicy<interval:{:.2f};max:{:.2f};polls:{};queries:{}>'
+                .format(self.interval, self.maximum, self.polls,
+                        self.queries))
+
+
+###############################################################################
+#                              Helper Functions                               #
+###############################################################################
+
+
+def time_to_seconds(walltime):
+    """Convert a walltime string (D-HH:MM:SS or fragment) into seconds.
+
+    Parameters
+    ----------
+    walltime : str or int or float
+        Numbers are assumed to already be in seconds.
+
+    Returns
+    -------
+    int or None
+        None if the string cannot be parsed.
+    """
+    if isinstance(walltime, (int, float)):
+        return walltime
+    try:
+        walltime = str(walltime)
+        days = 0
+        if '-' in walltime:
+            days, walltime = walltime.split('-')
+        seconds = 0
+        for part in walltime.split(':'):
+            seconds = seconds*60 + int(part)
+        return int(days)*86400 + seconds
+    except ValueError:
+        return None
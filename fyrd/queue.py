@@ -19,19 +19,32 @@ All of the above commands return a dictionary of:
 Queue.QueueJob classes include information on job state, owner, queue, nodes,
 threads, exitcode, etc.
 
+The jobs are stored in a fyrd.jobtable.JobTable, the QueueJob objects are views
+of its rows. Finished jobs are evicted after `keep_finished` seconds (set in
+the [queue] section of the config) unless a fyrd.Job object still refers to
+them.
+
 Queue also defines a wait() method that takes a list of job numbers, job.Job()
 objects, or JobQueue.Job objects and blocks until those jobs to complete
 
 The default cluster environment is also defined in this file as MODE, it can be
 set directly or with the get_cluster_environment() function definied here.
 """
+import re as _re            # Used to parse job IDs
 import sys as _sys          # Used to get TB info
-import pwd as _pwd          # Used to get usernames for queue
 import getpass as _getpass  # Used to get usernames for queue
 import traceback as _tb     # Used to mail TB info
 from datetime import datetime as _dt
 from time import time as _time
 from time import sleep as _sleep
+from collections import deque as _deque
+from collections import namedtuple as _namedtuple
+from collections import OrderedDict as _OrderedDict
+from weakref import WeakValueDictionary as _WeakValueDictionary
+try:
+    from collections.abc import Mapping as _Mapping
+except ImportError:
+    from collections import Mapping as _Mapping
 
 from six import reraise as _reraise
 from six import text_type as _txt
@@ -48,6 +61,16 @@ from . import conf as _conf
 from . import ClusterError as _ClusterError
 from . import batch_systems as _batch
 from . import notify as _notify
+from . import poll as _poll
+from . import snapshot as _snapshot
+from .batch_systems.nodeset import NodeSet as _NodeSet
+from .jobtable import JobTable as _JobTable
+
+# The asyncio API uses syntax older pythons cannot parse
+if _sys.version_info >= (3, 7):
+    from .aio import QueueMixin as _AsyncMixin
+else:
+    _AsyncMixin = object
 
 # Funtions to import if requested
 __all__ = ['Queue']
@@ -64,8 +87,14 @@ DONE_STATES      = _batch.DONE_STATES
 #                               The Queue Class                               #
 ###############################################################################
 
+# One event found by diffing a queue update against the previous one, event is
+# one of 'new', 'changed' or 'disappeared', array_id is None for parent jobs
+QueueChange = _namedtuple(
+    'QueueChange', ['event', 'job_id', 'array_id', 'old_state', 'new_state']
+)
 
-class Queue(object):
+
+class Queue(_AsyncMixin):
 
     """A wrapper for all defined batch systems.
 
@@ -96,6 +125,16 @@ class Queue(object):
         A set of all users with active jobs
     job_states : set
         A set of all current job states
+    query_count : int
+        The total number of times the batch system was queried
+    last_poll : fyrd.poll.PollPolicy
+        The polling policy of the last wait, its stats() method shows how
+        many polls and queries the wait took
+    keep_finished : float
+        Seconds finished jobs are kept after they finish, unless a fyrd.Job
+        still refers to them, 0 to keep them forever
+    last_changes : list of QueueChange
+        The differences found by the last update
 
     Methods
     -------
@@ -103,10 +142,26 @@ class Queue(object):
         Block until all jobs in jobs are complete.
     get(jobs)
         Get all results from a bunch of Job objects.
+    as_completed(jobs, timeout=None)
+        Yield Job objects as they complete.
+    async_wait(jobs, return_disp=False)
+        Coroutine version of wait(), python 3.7+ only.
+    async_as_completed(jobs, timeout=None)
+        Asynchronous generator version of as_completed(), python 3.7+ only.
     wait_to_submit(max_jobs=None)
         Block until fewer running/pending jobs in queue than max_jobs.
     update()
         Refresh the list of jobs from the server.
+    on_change(callback)
+        Call callback with every QueueChange found by an update.
+    remove_callback(callback)
+        Stop calling a callback added by on_change.
+    changes(timeout=None)
+        Poll the queue and yield QueueChange events as they happen.
+    to_frame(update=True)
+        Return the queue as a pandas DataFrame.
+    to_arrow(update=True)
+        Return the queue as a pyarrow Table.
     get_jobs(key)
         Return a dict of jobs where state matches key.
     get_user_jobs(users)
@@ -114,7 +169,7 @@ class Queue(object):
     """
 
     def __init__(self, user=None, partition=None,
-                 qtype=None, remote=True, uri=None):
+                 qtype=None, remote=True, uri=None, poll_policy=None):
         """Can filter by user, queue type or partition on initialization.
 
         Parameters
@@ -126,13 +181,16 @@ class Queue(object):
             Optional partition to filter the queue with.
         qtype : str
             one of the defined batch queues (e.g. 'slurm')
+        poll_policy : class, optional
+            A class used to decide how long to sleep between polls, must have
+            the same interface as fyrd.poll.PollPolicy, which is the default.
         """
         # Get user ID as an int UID
         if user:
             if user == 'self' or user == 'current':
                 self.user = _getpass.getuser()
                 """The username if defined."""
-                self.uid  = _pwd.getpwnam(self.user).pw_uid
+                self.uid  = _run.name_to_uid(self.user)
             elif user == 'ALL':
                 self.user = None
             else:
@@ -140,10 +198,10 @@ class Queue(object):
                         or (isinstance(user, (_str, _txt)) and user.isdigit()):
                     self.uid  = int(user)
                 else:
-                    self.uid = _pwd.getpwnam(str(user)).pw_uid
+                    self.uid = _run.name_to_uid(user)
         else:
             self.uid = None
-        self.user = _pwd.getpwuid(self.uid).pw_name if self.uid else None
+        self.user = _run.uid_to_name(self.uid) if self.uid else None
         self.partition = partition
         self.max_jobs = int(_conf.get_option('queue', 'max_jobs'))
         # Don't allow max jobs to be less than 5, otherwise basic split jobs
@@ -161,6 +219,11 @@ class Queue(object):
         )
         self.sleep_len = float(_conf.get_option('queue', 'sleep_len', 0.5))
 
+        # Polling, count queries to allow checking the cost of a wait
+        self.poll_policy = poll_policy if poll_policy else _poll.PollPolicy
+        self.query_count = 0
+        self.last_poll   = None
+
         # Set type
         if qtype:
             _batch.check_queue(qtype, remote=remote, uri=uri)
@@ -176,11 +239,41 @@ class Queue(object):
                                                     remote=remote,
                                                     uri=uri)
 
+        # Share queue queries with other processes if requested
+        self.snapshot = None
+        if _conf.get_option('queue', 'shared_snapshot', False):
+            self.snapshot = _snapshot.SnapshotCache(
+                self.qtype, user=self.user, partition=self.partition,
+                max_age=self.queue_update_time
+            )
+
         # Allow tracking of updates to prevent too many updates
         self._updating = False
 
-        # Will contain a dict of QueueJob objects indexed by ID
-        self.jobs = {}
+        # Batch systems with a queue_changes() function only send the jobs
+        # changed since the token of the last update of this Queue
+        self._changes_token = None
+
+        # A single background poller for all asyncio waits
+        self._poller = None
+
+        # Job data is stored in columns, self.jobs is a dict like view of it
+        # with QueueJob objects indexed by ID
+        self._table = _JobTable(DONE_STATES)
+        self.jobs   = _Jobs(self._table)
+
+        # Finished jobs are evicted after this many seconds unless a live
+        # fyrd.Job refers to them, evicted IDs are not added again while the
+        # batch system still reports them
+        self.keep_finished = float(
+            _conf.get_option('queue', 'keep_finished', 600)
+        )
+        self._live    = _WeakValueDictionary()  # {job_id: fyrd.Job}
+        self._evicted = set()
+
+        # Differences between updates, and the callbacks that get them
+        self.last_changes = []
+        self._callbacks   = []
 
         self.last_update = None
 
@@ -252,108 +345,75 @@ class Queue(object):
             notify_addr = notify
             notify_time = 0
         start_time  = _dt.now()
-        self.update()
         _logme.log('Queue waiting.', 'debug')
 
         # Sanitize arguments
         jobs = _run.listify(jobs)
-        for job in jobs:
-            if not isinstance(job, (_str, _txt, _int, QueueJob, self._Job)):
-                raise _ClusterError('job must be int, string, or Job, ' +
-                                    'is {}'.format(type(job)))
-
-        check_jobs = []
-        for job in jobs:
-            if isinstance(job, (self._Job, QueueJob)):
-                job_id = job.id
-            else:
-                job_id = str(job)
-            check_jobs.append(job_id)
+        check_jobs = self._normalize_job_ids(jobs)
 
         pbar = _run.get_pbar(jobs, name="Waiting for job completion",
                              unit='jobs')
-        dispo = 'Unknown'
+        res_time = float(_conf.get_option('queue', 'res_time'))
+        policy = self._new_policy(jobs)
+        dispo = True if check_jobs else 'Unknown'
         msg = None
+        # Per-job bookkeeping, only for jobs that need it
+        missing   = {}  # {job_id: time first found missing from the queue}
+        uncertain = {}  # {job_id: time first seen in an uncertain state}
+        unknown   = {}  # {job_id: number of ticks in an unknown state}
         try:
             while check_jobs:
-                self.update()
-                for job in check_jobs:
-                    if isinstance(job, (self._Job, QueueJob)):
-                        job_id = job.id
-                    else:
-                        job_id = str(job)
-                    job_id, array_id = self.batch_system.normalize_job_id(
-                        job_id
-                    )
-                    _logme.log('Checking {}'.format(job_id), 'debug')
-                    lgd = False
-                    # Allow 12 seconds to elapse before job is found in queue,
-                    # if it is not in the queue by then, assume failure.
-                    if not self.test_job_in_queue(job_id):
-                        if return_disp:
-                            dispo = 'disappeared'
-                            break
-                        else:
-                            dispo = False
-                            break
-                    # Actually look for job in running/queued queues
-                    lgd      = False
-                    lgd2     = False
-                    start    = _dt.now()
-                    res_time = float(_conf.get_option('queue', 'res_time'))
-                    count    = 0
-                    # Get job state
-                    job_state = self.jobs[job_id].state
-                    # Check the state
+                # One scheduler query per tick, resolve every job from it
+                states = list(self._get_job_states(check_jobs, missing))
+                policy.observe(states)
+                for job_id, job_state in states:
                     if job_state in GOOD_STATES:
                         _logme.log('Queue wait for {} complete'
                                    .format(job_id), 'debug')
-                        check_jobs.pop(check_jobs.index(job))
+                        check_jobs.pop(job_id)
                         pbar.update()
-                        dispo = True
-                        break
                     elif job_state in ACTIVE_STATES:
-                        if lgd:
-                            _logme.log('{} not complete yet, waiting'
-                                       .format(job_id), 'debug')
-                            lgd = True
-                        else:
-                            _logme.log('{} still not complete, waiting'
-                                       .format(job_id), 'verbose')
+                        _logme.log('{} not complete yet, waiting'
+                                   .format(job_id), 'verbose')
+                    elif job_state == 'disappeared':
+                        dispo = 'disappeared' if return_disp else False
+                        break
                     elif job_state in BAD_STATES:
-                        msg = 'Job {} failed with state {}'.format(job,
+                        msg = 'Job {} failed with state {}'.format(job_id,
                                                                    job_state)
                         _logme.log(msg, 'error')
                         dispo = False
                         break
                     elif job_state in UNCERTAIN_STATES:
-                        if not lgd2:
+                        if job_id not in uncertain:
                             _logme.log('Job {} in state {}, waiting {} '
-                                       .format(job, job_state, res_time) +
+                                       .format(job_id, job_state, res_time) +
                                        'seconds for resolution', 'warn')
-                            lgd2 = True
-                        if (_dt.now() - start).seconds > res_time:
+                            uncertain[job_id] = _time()
+                        if _time() - uncertain[job_id] > res_time:
                             msg = (
                                 'Job {} still in state {} after {}s wait, '
-                                'aborting'.format(job, job_state, res_time)
+                                'aborting'.format(job_id, job_state, res_time)
                             )
                             _logme.log(msg, 'error')
                             dispo = False
                             break
                     else:
-                        if count == 5:
+                        unknown[job_id] = unknown.get(job_id, 0) + 1
+                        if unknown[job_id] == 5:
                             _logme.log('Job {} in unknown state {} '
-                                       .format(job, job_state) +
+                                       .format(job_id, job_state) +
                                        'cannot continue', 'critical')
                             raise QueueError('Unknown job state {}'
                                              .format(job_state))
                         _logme.log('Job {} in unknown state {} '
-                                   .format(job, job_state) +
+                                   .format(job_id, job_state) +
                                    'trying to resolve', 'debug')
-                        count += 1
                 if dispo in [False, 'disappeared']:
                     break
-                _sleep(self.sleep_len)
+                if check_jobs:
+                    policy.sleep()
+            pbar.close()
             # Update jobs
             for job in jobs:
                 if isinstance(job, self._Job):
@@ -393,54 +453,117 @@ class Queue(object):
 
         Returns
         -------
-        job_results : dict
-            `{job_id: Job}`
+        job_results : list
+            Outputs in the same order as jobs
 
         Raises
         ------
         fyrd.ClusterError
             If any job fails or goes missing.
         """
-        self.update()
         _logme.log('Queue waiting.', 'debug')
         singular = True if isinstance(jobs, self._Job) else False
+        jobs = _run.listify(jobs)
 
-        # Force into enumerated list to preserve order
-        jobs = dict(enumerate(_run.listify(jobs)))
+        # Collect outputs as jobs finish, keyed by object to preserve order
         done = {}
-
-        # Check that all jobs are valid
-        for job in jobs.values():
-            if not isinstance(job, self._Job):
-                raise _ClusterError('This only works with cluster job '
-                                    'objects')
-
-        # Loop through all jobs continuously trying to get outputs
         pbar = _run.get_pbar(jobs, name="Getting Job Results", unit='jobs')
-        while jobs:
-            for i in list(jobs):
-                job = jobs[i]
-                job.update()
-                if not self.test_job_in_queue(job.id):
-                    raise _ClusterError('Job {} not queued'.format(job.id))
-                if job.state == 'completed':
-                    done[i] = jobs.pop(i).get()
-                    pbar.update()
-                elif job.state in BAD_STATES:
-                    pbar.close()
-                    raise _ClusterError('Job {} failed, cannot get output'
-                                        .format(job.id))
-            # Block between attempts
-            _sleep(self.sleep_len)
+        for job in self.as_completed(jobs):
+            if job.state != 'completed':
+                pbar.close()
+                raise _ClusterError('Job {} failed, cannot get output'
+                                    .format(job.id))
+            done[id(job)] = job.get()
+            pbar.update()
         pbar.write('Done\n')
         pbar.close()
 
         # Correct the order, make it the same as the input list
-        results = []
-        for i in sorted(done.keys()):
-            results.append(done[i])
+        results = [done[id(job)] for job in jobs]
         return results[0] if singular else results
 
+    def as_completed(self, jobs, timeout=None):
+        """Yield jobs as they finish, in order of completion.
+
+        All jobs are checked against a single queue update per tick. A job is
+        yielded as soon as it is completed and its output files exist, or as
+        soon as it fails, so check `job.state` before getting outputs.
+
+        Parameters
+        ----------
+        jobs : list
+            List of fyrd.Job objects
+        timeout : int, optional
+            Maximum number of seconds to wait for all jobs
+
+        Yields
+        ------
+        fyrd.Job
+
+        Raises
+        ------
+        fyrd.queue.QueueError
+            If timeout is exceeded before all jobs finish.
+        """
+        jobs = _run.listify(jobs)
+        for job in jobs:
+            if not isinstance(job, self._Job):
+                raise _ClusterError('This only works with cluster job '
+                                    'objects')
+            if not job.submitted:
+                if _conf.get_option('jobs', 'auto_submit'):
+                    _logme.log('Auto-submitting as not submitted yet',
+                               'debug')
+                    job.submit()
+                else:
+                    raise _ClusterError('Job {} has not been submitted'
+                                        .format(job.name))
+
+        # Jobs already known to be done are not looked for in the queue
+        waiting  = _OrderedDict()
+        finished = _OrderedDict()
+        for job in jobs:
+            job_id = str(job.id)
+            if job.state in DONE_STATES:
+                finished[job_id] = job
+            else:
+                waiting[job_id] = job
+        check_jobs = self._normalize_job_ids(list(waiting))
+        file_time  = float(_conf.get_option('jobs', 'file_block_time', 30))
+        start      = _time()
+        policy     = self._new_policy(jobs)
+        missing    = {}  # {job_id: time first found missing from the queue}
+        no_files   = {}  # {job_id: time completed without output files}
+        while waiting or finished:
+            if check_jobs:
+                for job_id, job_state in self._get_job_states(
+                        check_jobs, missing):
+                    if job_state in DONE_STATES or job_state == 'disappeared':
+                        queue_job, array_id = check_jobs.pop(job_id)
+                        job = waiting.pop(job_id)
+                        job._update_from_queue(self.jobs.get(queue_job),
+                                               job_state)
+                        finished[job_id] = job
+            for job_id, job in list(finished.items()):
+                if job.state != 'completed' or job._check_files():
+                    yield finished.pop(job_id)
+                    continue
+                # Give completed jobs some time for their files to appear
+                no_files.setdefault(job_id, _time())
+                if _time() - no_files[job_id] > file_time:
+                    _logme.log('Job {} complete, but output files have not '
+                               'appeared for >{} seconds'
+                               .format(job_id, file_time), 'warn')
+                    yield finished.pop(job_id)
+            if not waiting and not finished:
+                break
+            if timeout and _time() - start > timeout:
+                raise QueueError('{} jobs not complete after {} seconds'
+                                 .format(len(waiting) + len(finished),
+                                         timeout))
+            policy.observe((len(waiting), len(finished)))
+            policy.sleep()
+
     def test_job_in_queue(self, job_id, array_id=None):
         """Check to make sure job is in self.
 
@@ -503,13 +626,15 @@ class Queue(object):
         """
         count   = 50
         written = False
+        policy  = self._new_policy()
         while True:
             if self._can_submit(max_jobs):
                 return
+            policy.observe((len(self.running), len(self.queued)))
             if not written:
                 _logme.log(('The queue is full, there are {} jobs running and '
                             '{} jobs queued. Will wait to submit, retrying '
-                            'every {} seconds.')
+                            'every {} seconds or more.')
                            .format(len(self.running), len(self.queued),
                                    self.sleep_len),
                            'info')
@@ -518,7 +643,7 @@ class Queue(object):
                 _logme.log('Still waiting to submit.', 'info')
                 count = 50
             count -= 1
-            _sleep(self.sleep_len)
+            policy.sleep()
 
     def update(self, job_id=None):
         """Refresh the list of jobs from the server, limit queries."""
@@ -533,14 +658,106 @@ class Queue(object):
             ), 'debug')
         return self
 
+    def on_change(self, callback):
+        """Call callback with every QueueChange found by an update.
+
+        Callbacks are called in the thread running the update, once per
+        change, exceptions are logged and ignored.
+
+        Parameters
+        ----------
+        callback : callable
+            Called with a single QueueChange
+
+        Returns
+        -------
+        callback : callable
+            The same callback, to allow use as a decorator
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def remove_callback(self, callback):
+        """Stop calling a callback added by on_change."""
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def changes(self, timeout=None):
+        """Poll the queue and yield QueueChange events as they happen.
+
+        Polling backs off while the queue does not change, like wait().
+
+        Parameters
+        ----------
+        timeout : int, optional
+            Stop after this many seconds, default is to never stop
+
+        Yields
+        ------
+        QueueChange
+        """
+        events = _deque()
+        self.on_change(events.append)
+        policy = self._new_policy(track=False)
+        start  = _time()
+        try:
+            while True:
+                self.update()
+                if events:
+                    policy.reset()
+                while events:
+                    yield events.popleft()
+                if timeout and _time() - start > timeout:
+                    return
+                policy.sleep()
+        finally:
+            self.remove_callback(events.append)
+
+    def to_frame(self, update=True):
+        """Return the queue as a pandas DataFrame, one row per job or child.
+
+        Built directly from the job table without creating QueueJob objects,
+        states, owners and queues are categorical and counts are nullable
+        integers. Requires pandas.
+
+        Parameters
+        ----------
+        update : bool, optional
+            Update the queue first
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns: job_id, array_id, name, owner, queue, state, nodes,
+            threads, cpus, exitcode, disappeared
+        """
+        if update:
+            self.update()
+        return self._table.to_frame()
+
+    def to_arrow(self, update=True):
+        """Return the queue as a pyarrow Table, one row per job or child.
+
+        The same columns as to_frame(), states, owners and queues are
+        dictionary encoded. Requires pyarrow.
+
+        Parameters
+        ----------
+        update : bool, optional
+            Update the queue first
+
+        Returns
+        -------
+        pyarrow.Table
+        """
+        if update:
+            self.update()
+        return self._table.to_arrow()
+
     def get_jobs(self, key):
         """Return a dict of jobs where state matches key."""
-        retjobs = {}
         keys = [k.lower() for k in _run.listify(key)]
-        for jobid, job in self.jobs.items():
-            if job.get_state() in keys:
-                retjobs[jobid] = job
-        return retjobs
+        return self._select('state', keys)
 
     def get_user_jobs(self, users):
         """Filter jobs by user.
@@ -556,37 +773,36 @@ class Queue(object):
             A filtered job dictionary of `{job_id: QueueJob}` for all jobs
             owned by the queried users.
         """
-        users = _run.listify(users)
-        return {k: v for k, v in self.jobs.items() if v.owner in users}
+        return self._select('owner', _run.listify(users))
 
     @property
     def users(self):
         """Return a set of users with jobs running."""
-        return set([job.owner for job in self.jobs.values()])
+        return self._table.values('owner')
 
     @property
     def job_states(self):
         """Return a list of job states for all jobs in the queue."""
-        return [job.state for job in self.jobs]
+        return list(self._table.values('state'))
 
     @property
     def finished(self):
         """Return a list of jobs that are neither queued nor running."""
-        return {i: j for i, j in self.jobs.items()
-                if j.state not in ACTIVE_STATES}
+        return self._select('state', [
+            i for i in self._table.values('state') if i not in ACTIVE_STATES
+        ])
 
     @property
     def bad(self):
         """Return a list of jobs that have bad or uncertain states."""
-        return {i: j for i, j in self.jobs.items()
-                if j.state in BAD_STATES or j.state in UNCERTAIN_STATES}
+        return self._select('state', BAD_STATES + UNCERTAIN_STATES)
 
     @property
     def active_job_count(self):
         """Return a count of all queued or running jobs, inc. array jobs."""
         self.update()
         jobcount = 0
-        for j in self.get_jobs(ACTIVE_STATES):
+        for j in self.get_jobs(ACTIVE_STATES).values():
             jobcount += j.jobcount()
         return int(jobcount)
 
@@ -597,7 +813,12 @@ class Queue(object):
 
     def _can_submit(self, max_jobs=None):
         """"Return True if R/Q jobs are less than max_jobs."""
-        self.update()
+        return self._free_slots(max_jobs) > 0
+
+    def _free_slots(self, max_jobs=None, update=True):
+        """Return max_jobs minus the number of R/Q jobs."""
+        if update:
+            self.update()
         # Get max jobs
         max_jobs = int(max_jobs) if max_jobs else self.max_jobs
         if max_jobs < 4:
@@ -610,7 +831,7 @@ class Queue(object):
         jobcount = 0
         for j in self.get_jobs(ACTIVE_STATES).values():
             jobcount += j.jobcount()
-        return jobcount < max_jobs
+        return max_jobs - jobcount
 
     ######################
     # Internal Functions #
@@ -623,75 +844,346 @@ class Queue(object):
 
         Parameters
         ----------
-            job_id: str, optional
-                Job ID to be updated
+            job_id: str or list, optional
+                Job ID or IDs to be updated, only these are queried and only
+                these can be marked as disappeared.
         """
         if self._updating:
             return
         _logme.log('Queue updating', 'debug')
         # Set the update time I don't care about microseconds
         self.last_update = int(_time())
-
-        jobs = []  # list of jobs created this session
+        self.query_count += 1
+        if self.last_poll:
+            self.last_poll.queries += 1
+
+        # Only the parent IDs can be queried
+        queried = None
+        if job_id:
+            queried = [_re.split(r'[_\[.]', j.strip())[0]
+                       for i in _run.listify(job_id)
+                       for j in str(i).split(',')]
+
+        deleted = None  # Job IDs removed, only set if just changes were sent
+        if self.snapshot is not None and not job_id:
+            queue_info = self.snapshot.get(
+                lambda: self.batch_system.queue_parser(
+                    user=self.user, partition=self.partition
+                )
+            )
+        elif not job_id and hasattr(self.batch_system, 'queue_changes'):
+            self._changes_token, full, queue_info, deleted = (
+                self.batch_system.queue_changes(
+                    self._changes_token, user=self.user,
+                    partition=self.partition
+                )
+            )
+            if full:
+                deleted = None
+        else:
+            queue_info = self.batch_system.queue_parser(
+                user=self.user, partition=self.partition, job_id=job_id
+            )
+
+        table = self._table
+        if queried:
+            # Jobs asked for by ID are wanted again
+            self._evicted.difference_update(queried)
+        seen    = _OrderedDict()  # IDs reported this update, in order
+        changes = []
+        # The previous snapshot, to diff against
+        known      = set(table.job_ids())
+        old_states = table.states[:]
+        array_rows = {}  # {parent row: set of array_ids reported}
         for [job_id, array_id, job_name, job_user, job_partition,
              job_state, job_nodelist, job_nodecount,
-             job_cpus, job_exitcode] in self.batch_system.queue_parser(
-                 user=self.user, partition=self.partition, job_id=job_id):
+             job_cpus, job_exitcode] in queue_info:
             job_id = str(job_id)
             job_state = job_state.lower()
+            seen[job_id] = None
+            if job_id in self._evicted:
+                if job_state in DONE_STATES:
+                    continue
+                self._evicted.discard(job_id)
+            if not isinstance(job_nodelist, _NodeSet):
+                job_nodelist = _NodeSet(job_nodelist)
             if job_nodecount and job_cpus:
                 job_threads = int(job_nodecount) * int(job_cpus)
             else:
                 job_threads = None
-            if job_state == 'completed' or job_state == 'failed':
-                job_exitcode = job_exitcode
-            else:
+            # Exit codes are only set by finished jobs, and a missing one
+            # does not replace the one already known
+            if job_state != 'completed' and job_state != 'failed':
                 job_exitcode = None
 
-            # Get/Create the QueueJob object
-            if job_id not in self.jobs:
-                job = QueueJob()
-            else:
-                job = self.jobs[job_id]
+            # Get/Create the table row
+            row = table.row(job_id)
+            if row is None:
+                row = table.add(job_id)
 
-            job.id    = job_id
-            job.name  = job_name
-            job.owner = job_user
-            job.queue = job_partition
-            job.state = job_state.lower()
+            table.set(row, 'name', job_name)
+            table.set(row, 'owner', job_user)
+            table.set(row, 'queue', job_partition)
 
             if array_id is not None:
-                job.array_job = True
-                cjob = QueueChild(job)
-                cjob.id      = array_id
-                cjob.name    = job_name
-                cjob.owner   = job_user
-                cjob.queue   = job_partition
-                cjob.state   = job_state.lower()
-                cjob.nodes   = job_nodelist
-                cjob.threads = job_threads
-                cjob.exitcode = job_exitcode
-                job.children[array_id] = cjob
-                job.state    = job.get_state()
-                job.nodes    = job.get_nodelist()
-                job.threads  = job.get_threads()
-                job.exitcode  = job.get_exitcode()
+                array_id = str(array_id)
+                table.set(row, 'array_job', True)
+                crow = table.children(row).get(array_id)
+                if crow is None:
+                    crow = table.add(array_id, parent=row)
+                    changes.append(
+                        QueueChange('new', job_id, array_id, None, job_state)
+                    )
+                elif table.get(crow, 'state') != job_state:
+                    changes.append(QueueChange(
+                        'changed', job_id, array_id,
+                        table.get(crow, 'state'), job_state
+                    ))
+                table.set(crow, 'name', job_name)
+                table.set(crow, 'owner', job_user)
+                table.set(crow, 'queue', job_partition)
+                table.set(crow, 'state', job_state)
+                table.set(crow, 'nodes', job_nodelist)
+                table.set(crow, 'threads', job_threads)
+                if job_exitcode is not None:
+                    table.set(crow, 'exitcode', job_exitcode)
+                array_rows.setdefault(row, set()).add(array_id)
             else:
-                job.nodes   = job_nodelist
-                job.cpus    = job_cpus
-                job.threads = job_threads
-                job.exitcode = job_exitcode
-
-            # Assign the job to self.
-            self.jobs[job_id] = job
-            jobs.append(str(job_id))
+                table.set(row, 'state', job_state)
+                table.set(row, 'nodes', job_nodelist)
+                table.set(row, 'cpus', job_cpus)
+                table.set(row, 'threads', job_threads)
+                if job_exitcode is not None:
+                    table.set(row, 'exitcode', job_exitcode)
+
+        # Children missing from a reported array job are assumed completed,
+        # unless only the changed children were sent. Finished children keep
+        # their state, some batch systems only resend them if they change.
+        if deleted is None:
+            for row, array_ids in array_rows.items():
+                for array_id, crow in table.children(row).items():
+                    if array_id in array_ids \
+                            or table.get(crow, 'disappeared') \
+                            or table.get(crow, 'state') in DONE_STATES:
+                        continue
+                    changes.append(QueueChange(
+                        'disappeared', table.ids[row], array_id,
+                        table.get(crow, 'state'), 'completed'
+                    ))
+                    table.set(crow, 'state', 'completed')
+                    table.set(crow, 'disappeared', True)
+
+        # Array jobs summarize their children, once all children are read
+        for row in array_rows:
+            job = QueueJob._view(table, row)
+            job.state    = job.get_state()
+            job.nodes    = job.get_nodelist()
+            job.threads  = job.get_threads()
+            job.exitcode = job.get_exitcode()
+
+        # Diff against the previous snapshot
+        for job_id in seen:
+            row = table.row(job_id)
+            if row is None:
+                continue  # Evicted
+            if job_id not in known:
+                changes.append(QueueChange(
+                    'new', job_id, None, None, table.get(row, 'state')
+                ))
+            elif old_states[row] != table.states[row]:
+                changes.append(QueueChange(
+                    'changed', job_id, None, table.string(old_states[row]),
+                    table.get(row, 'state')
+                ))
 
         # We assume that if a job just disappeared it completed
-        if self.jobs:
-            for qjob in self.jobs.values():
-                if str(qjob.id) not in jobs:
-                    qjob.state = 'completed'
-                    qjob.disappeared = True
+        if deleted is not None:
+            gone = known.intersection(deleted)
+        elif queried:
+            gone = known.intersection(queried)
+        else:
+            gone = known
+        for job_id in gone.difference(seen):
+            row = table.row(job_id)
+            if table.get(row, 'disappeared') \
+                    or table.get(row, 'state') in DONE_STATES:
+                continue
+            changes.append(QueueChange(
+                'disappeared', job_id, None, table.get(row, 'state'),
+                'completed'
+            ))
+            table.set(row, 'state', 'completed')
+            table.set(row, 'disappeared', True)
+
+        # Forget old finished jobs, only full updates show which are gone
+        if deleted is not None:
+            self._evicted.difference_update(deleted)
+            self._evict()
+        elif not queried:
+            self._evicted.intersection_update(seen)
+            self._evict()
+
+        self.last_changes = changes
+        self._dispatch(changes)
+
+    def _dispatch(self, changes):
+        """Pass changes to every callback added by on_change."""
+        for callback in list(self._callbacks):
+            for change in changes:
+                try:
+                    callback(change)
+                except Exception as err:
+                    _logme.log('Queue callback {} failed on {}: {}'
+                               .format(callback, change, err), 'error')
+
+    def _select(self, field, values):
+        """Return a dict of jobs where field is any of values, from an index.
+
+        Parameters
+        ----------
+        field : {'state', 'owner'}
+        values : list of str
+
+        Returns
+        -------
+        dict
+            `{job_id: QueueJob}`
+        """
+        table = self._table
+        return {table.ids[row]: QueueJob._view(table, row)
+                for row in table.find(field, values)}
+
+    def _track(self, job):
+        """Keep the queue entry of a fyrd.Job while the Job exists."""
+        if job.id:
+            job_id = str(job.id)
+            self._live[job_id] = job
+            self._evicted.discard(job_id)
+
+    def _evict(self):
+        """Remove jobs finished for keep_finished seconds, unless tracked."""
+        if not self.keep_finished:
+            return
+        table = self._table
+        rows  = table.evictable(_time() - self.keep_finished, self._live)
+        for row in rows:
+            self._evicted.add(table.ids[row])
+            table.remove(row)
+        if rows:
+            _logme.log('Evicted {} finished jobs from the queue'
+                       .format(len(rows)), 'debug')
+
+    def _new_policy(self, jobs=None, track=True):
+        """Return a new polling policy for a wait on jobs.
+
+        Parameters
+        ----------
+        jobs : list, optional
+            If any are fyrd.Job objects with a requested time, it is used as
+            a hint for the longest interval.
+        track : bool, optional
+            Store as self.last_poll and count queries against it.
+
+        Returns
+        -------
+        fyrd.poll.PollPolicy
+        """
+        hint = None
+        for job in _run.listify(jobs) if jobs else []:
+            if isinstance(job, self._Job) and job.kwds:
+                seconds = _poll.time_to_seconds(job.kwds.get('time', 0))
+                if seconds and (not hint or seconds > hint):
+                    hint = seconds
+        policy = self.poll_policy(initial=self.sleep_len, hint=hint)
+        if track:
+            self.last_poll = policy
+        return policy
+
+    def _finish_job(self, job, job_state):
+        """Update a fyrd.Job with its final state from the queue."""
+        queue_job, _ = self.batch_system.normalize_job_id(str(job.id))
+        job._update_from_queue(self.jobs.get(str(queue_job)), job_state)
+
+    def _normalize_job_ids(self, jobs):
+        """Validate jobs and return their normalized IDs.
+
+        Parameters
+        ----------
+        jobs : list
+            List of either fyrd.job.Job, fyrd.queue.QueueJob, job_id
+
+        Returns
+        -------
+        OrderedDict
+            `{job_string: (job_id, array_id)}` in the same order as jobs
+        """
+        check_jobs = _OrderedDict()
+        for job in jobs:
+            if not isinstance(job, (_str, _txt, _int, QueueJob, self._Job)):
+                raise _ClusterError('job must be int, string, or Job, ' +
+                                    'is {}'.format(type(job)))
+            if isinstance(job, (self._Job, QueueJob)):
+                job_string = str(job.id)
+            else:
+                job_string = str(job)
+            job_id, array_id = self.batch_system.normalize_job_id(job_string)
+            self._evicted.discard(str(job_id))
+            check_jobs[job_string] = (
+                str(job_id), str(array_id) if array_id is not None else None
+            )
+        return check_jobs
+
+    def _get_job_states(self, check_jobs, missing):
+        """Resolve the state of every job in check_jobs from one update.
+
+        Jobs that are not in the queue are given a grace period of 12 tries
+        to appear, after which they are reported as 'disappeared'.
+
+        Parameters
+        ----------
+        check_jobs : dict
+            `{job_string: (job_id, array_id)}` from _normalize_job_ids
+        missing : dict
+            `{job_string: time}` of jobs not yet found in the queue, updated
+            in place
+
+        Yields
+        ------
+        job_string : str
+        state : str
+        """
+        self.update()
+        for job_string, job_state in self._resolve_job_states(check_jobs,
+                                                              missing):
+            yield job_string, job_state
+
+    def _resolve_job_states(self, check_jobs, missing):
+        """Resolve the state of every job in check_jobs without updating.
+
+        See _get_job_states for arguments.
+        """
+        grace = 12 * max(self.sleep_len, 1)
+        for job_string, (job_id, array_id) in list(check_jobs.items()):
+            _logme.log('Checking {}'.format(job_string), 'debug')
+            job = self.jobs.get(job_id)
+            if job is not None and array_id is not None:
+                job = job.children.get(array_id)
+            if job is None:
+                if job_string not in missing:
+                    _logme.log('{} not in queue, waiting up to {}s '
+                               .format(job_string, grace) +
+                               'for it to appear', 'info')
+                    missing[job_string] = _time()
+                elif _time() - missing[job_string] > grace:
+                    _logme.log(
+                        '{} not in queue after {}s'.format(job_string, grace)
+                        + '. Job likely completed, stats will be '
+                        'unavailable.', 'warn'
+                    )
+                    yield job_string, 'disappeared'
+                continue
+            missing.pop(job_string, None)
+            yield job_string, job.state
 
     def __getattr__(self, key):
         """Make running and queued attributes dynamic."""
@@ -755,10 +1247,61 @@ class Queue(object):
 ##############################################
 
 
+class _Jobs(_Mapping):
+
+    """A read only dictionary of `{job_id: QueueJob}` backed by a JobTable.
+
+    QueueJob objects are created on access, they are views of a table row.
+    """
+
+    __slots__ = ['table']
+
+    def __init__(self, table):
+        """Wrap a JobTable."""
+        self.table = table
+
+    def __getitem__(self, job_id):
+        """Return a QueueJob view of a job."""
+        row = self.table.row(str(job_id))
+        if row is None:
+            raise KeyError(job_id)
+        return QueueJob._view(self.table, row)
+
+    def __contains__(self, job_id):
+        """Check for a job ID without creating a view."""
+        return str(job_id) in self.table
+
+    def __iter__(self):
+        """Iterate over a copy of the job IDs."""
+        return iter(self.table.job_ids())
+
+    def __len__(self):
+        """The number of jobs."""
+        return len(self.table)
+
+    def __repr__(self):
+        """Display like a dictionary."""
+        return repr(dict(self.items()))
+
+
+def _field(name, doc):
+    """Return a property reading and writing a field of the table row."""
+    def fget(self):
+        return self._table.get(self._check(), name)
+
+    def fset(self, value):
+        self._table.set(self._check(), name, value)
+
+    return property(fget, fset, doc=doc)
+
+
 class _QueueJob(object):
 
     """A very simple class to store info about jobs in the queue.
 
+    The data is stored in a fyrd.jobtable.JobTable, this object is only a
+    view of one row and reads the current values from the table.
+
     Attributes
     ----------
     id : int
@@ -775,29 +1318,48 @@ class _QueueJob(object):
         The queue/partition the job is running in
     state : str
         Current state of the job, normalized to slurm states
-    nodes : list
-        List of nodes job is running on
+    nodes : NodeSet
+        Nodes the job is running on
     exitcode : int
         Exit code of completed job
     disappeared : bool
         Job cannot be found in the queue anymore
     """
 
-    id          = None
-    name        = None
-    owner       = None
-    threads     = None
-    queue       = None
-    state       = None
-    nodes       = None
-    exitcode    = None
-    disappeared = False
-    array_job   = False
-    children    = {}
-    parent      = None
+    __slots__ = ['_table', '_row', '_id', 'parent']
+
     _child_job  = False
     _cname      = None
 
+    id          = property(lambda self: self._id, doc='Job ID')
+    name        = _field('name', 'Job name')
+    owner       = _field('owner', 'User who owns the job')
+    threads     = _field('threads', 'Number of cores used by the job')
+    cpus        = _field('cpus', 'Number of cores per node')
+    queue       = _field('queue', 'The queue/partition of the job')
+    state       = _field('state', 'Current state of the job')
+    nodes       = _field('nodes', 'Nodes the job is running on')
+    exitcode    = _field('exitcode', 'Exit code of completed job')
+    disappeared = _field('disappeared', 'Job cannot be found in the queue')
+    array_job   = _field('array_job', 'This job is an array job')
+
+    @classmethod
+    def _view(cls, table, row, parent=None):
+        """Return a view of an existing row."""
+        view = cls.__new__(cls)
+        view._table = table
+        view._row   = row
+        view._id    = table.ids[row]
+        view.parent = parent
+        return view
+
+    @property
+    def children(self):
+        """A dictionary of `{array_id: QueueChild}`."""
+        row = self._check()
+        return {array_id: QueueChild._view(self._table, crow, self)
+                for array_id, crow in self._table.children(row).items()}
+
     def get_state(self):
         """return the current state of the job."""
         if self.array_job:
@@ -823,10 +1385,10 @@ class _QueueJob(object):
     def get_nodelist(self):
         """return the current state of the job."""
         if self.array_job:
-            nodelist = []
+            nodelist = _NodeSet()
             for job_info in self.children.values():
                 if job_info.nodes:
-                    nodelist = nodelist + job_info.nodes
+                    nodelist.update(job_info.nodes)
             return nodelist if nodelist else None
         return self.nodes
 
@@ -869,6 +1431,28 @@ class _QueueJob(object):
             return 1 if self.state in states else 0
         return 1
 
+    def _check(self):
+        """Return the row of this job, find it again if the row was reused.
+
+        Raises
+        ------
+        QueueError
+            If the job was evicted from the queue.
+        """
+        table, row = self._table, self._row
+        if self.parent is None:
+            if table.ids[row] != self._id or table.parents[row] != -1:
+                row = table.row(self._id)
+        else:
+            prow = self.parent._check()
+            if table.ids[row] != self._id or table.parents[row] != prow:
+                row = table.children(prow).get(self._id)
+        if row is None:
+            raise QueueError('Job {} is no longer in the queue'
+                             .format(self._id))
+        self._row = row
+        return row
+
     def __repr__(self):
         """Show all info."""
         if not self._child_job:
@@ -919,8 +1503,8 @@ class QueueJob(_QueueJob):
         The queue/partition the job is running in
     state : str
         Current state of the job, normalized to slurm states
-    nodes : list
-        List of nodes job is running on
+    nodes : NodeSet
+        Nodes the job is running on
     exitcode : int
         Exit code of completed job
     disappeared : bool
@@ -931,10 +1515,22 @@ class QueueJob(_QueueJob):
         If array job, list of child job numbers
     """
 
-    def __init__(self):
-        """Initialize."""
-        self._cname   = 'QueueJob'
-        self.children = {}
+    __slots__ = []
+
+    _cname = 'QueueJob'
+
+    def __init__(self, job_id=None, table=None):
+        """Add a job to table, or to a new table of its own.
+
+        Parameters
+        ----------
+        job_id : str, optional
+        table : fyrd.jobtable.JobTable, optional
+        """
+        self._table = table if table is not None else _JobTable(DONE_STATES)
+        self._row   = self._table.add(job_id)
+        self._id    = self._table.ids[self._row]
+        self.parent = None
 
     def __getitem__(self, key):
         """Allow direct accessing of child jobs by job id."""
@@ -965,8 +1561,8 @@ class QueueChild(_QueueJob):
         The queue/partition the job is running in
     state : str
         Current state of the job, normalized to slurm states
-    nodes : list
-        List of nodes job is running on
+    nodes : NodeSet
+        Nodes the job is running on
     exitcode : int
         Exit code of completed job
     disappeared : bool
@@ -975,9 +1571,23 @@ class QueueChild(_QueueJob):
         Backref to parent job
     """
 
-    def __init__(self, parent):
-        """Initialize with a parent."""
-        self._cname   = 'QueueChild'
+    __slots__ = []
+
+    _child_job = True
+    _cname     = 'QueueChild'
+
+    def __init__(self, parent, array_id=None):
+        """Add a child to the table of parent.
+
+        Parameters
+        ----------
+        parent : QueueJob
+        array_id : str, optional
+        """
+        parent.array_job = True
+        self._table = parent._table
+        self._row   = self._table.add(array_id, parent=parent._check())
+        self._id    = self._table.ids[self._row]
         self.parent = parent
 
 
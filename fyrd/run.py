@@ -13,15 +13,20 @@ from __future__ import with_statement
 import os as _os
 import re as _re
 import sys as _sys
+import pwd as _pwd
+import threading as _threading
 import inspect as _inspect
 import argparse as _argparse
 from collections import OrderedDict as _OD
 
 import bz2
 import gzip
+import tempfile as _tempfile
 from subprocess import Popen
 from subprocess import PIPE
+from subprocess import CalledProcessError as _CalledProcessError
 from time import sleep
+from time import time as _time
 from glob import glob as _glob
 
 from six import text_type as _txt
@@ -662,6 +667,51 @@ def cmd(command, args=None, stdout=None, stderr=None, tries=1):
     return code, out.rstrip(), err.rstrip()
 
 
+def cmd_lines(command):
+    """Run command and yield lines of STDOUT as they are written.
+
+    Unlike cmd(), the output is never held in memory as a single string, so
+    this is suited to very long outputs like the queue of a large cluster.
+
+    Parameters
+    ----------
+    command : list
+        The executable and its arguments, not run in a shell.
+
+    Yields
+    ------
+    line : str
+        Without the trailing newline.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        After all output is read if the exit code is not 0, STDERR is in
+        the stderr attribute.
+    """
+    command = [str(i) for i in listify(command)]
+    _logme.log('Streaming {}'.format(' '.join(command)), 'verbose')
+    # A file for STDERR cannot fill up and block while we read STDOUT
+    with _tempfile.TemporaryFile(mode='w+') as err:
+        try:
+            pp = Popen(command, universal_newlines=True, stdout=PIPE,
+                       stderr=err)
+        except FileNotFoundError:
+            _logme.log('{} does not exist'.format(command[0]), 'critical')
+            raise
+        try:
+            for line in pp.stdout:
+                yield line.rstrip('\n')
+        finally:
+            pp.stdout.close()
+            code = pp.wait()
+        _logme.log('{} completed with code {}'.format(command[0], code),
+                   'debug')
+        if code != 0:
+            err.seek(0)
+            raise _CalledProcessError(code, command, stderr=err.read())
+
+
 def export_run(function, args, kwargs):
     """Execute a function after first exporting all imports."""
     kwargs['imports'] = export_imports(function, kwargs)
@@ -709,6 +759,119 @@ def check_pid(pid):
         return True
 
 
+###############################################################################
+#                                User Lookups                                 #
+###############################################################################
+
+
+# Most entries kept in each user cache, and seconds before they expire
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL  = 3600
+
+
+class _UserCache(object):
+
+    """A thread safe LRU cache with expiry, for pwd lookups."""
+
+    def __init__(self, lookup, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.lookup = lookup
+        self.size   = size
+        self.ttl    = ttl
+        self.hits   = 0
+        self.misses = 0
+        self._cache = _OD()  # {key: (value, time added)}
+        self._lock  = _threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, looking it up if needed."""
+        now = _time()
+        with self._lock:
+            if key in self._cache:
+                value, added = self._cache[key]
+                if now - added < self.ttl:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return value
+        value = self.lookup(key)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = (value, now)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return value
+
+    def clear(self):
+        """Empty the cache and reset the counters."""
+        with self._lock:
+            self._cache.clear()
+            self.hits   = 0
+            self.misses = 0
+
+
+def _get_name(uid):
+    """Return the user name for uid, or the uid as a string if unknown."""
+    try:
+        return _pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+_uid_names = _UserCache(_get_name)
+_name_uids = _UserCache(lambda name: _pwd.getpwnam(name).pw_uid)
+
+
+def uid_to_name(uid):
+    """Return the user name of uid, cached.
+
+    Parameters
+    ----------
+    uid : int or str
+
+    Returns
+    -------
+    name : str
+        The uid as a string if there is no such user.
+    """
+    return _uid_names.get(int(uid))
+
+
+def name_to_uid(name):
+    """Return the UID of user name, cached.
+
+    Parameters
+    ----------
+    name : str
+
+    Returns
+    -------
+    uid : int
+
+    Raises
+    ------
+    KeyError
+        If there is no such user.
+    """
+    return _name_uids.get(str(name))
+
+
+def user_cache_stats():
+    """Return the hits and misses of the user lookup caches.
+
+    Returns
+    -------
+    dict
+        {'uid_to_name': {'hits': int, 'misses': int, 'size': int},
+         'name_to_uid': {...}}
+    """
+    return {
+        name: {'hits': cache.hits, 'misses': cache.misses,
+               'size': len(cache._cache)}
+        for name, cache in [('uid_to_name', _uid_names),
+                            ('name_to_uid', _name_uids)]
+    }
+
+
 ###############################################################################
 #                       Option and Argument Management                        #
 ###############################################################################
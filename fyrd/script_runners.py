@@ -170,3 +170,79 @@ if __name__ == "__main__":
         if issubclass(out[0], BaseException):
             six.reraise(*out)
 """
+
+ARRAY_FUNC_RUNNER = r"""\
+'''
+Run one task of a function array job and pickle the result.
+
+The function and shared keyword arguments are in one pickle file, the
+arguments of every task are in a single indexed file, the task to run is
+taken from the batch system environment.
+'''
+import os
+import sys
+import socket
+import struct
+import six
+from tblib import pickling_support
+pickling_support.install()
+import cloudpickle as pickle
+
+out = None
+try:
+{imports}
+{modimpstr}
+except Exception:
+    out = sys.exc_info()
+
+TASK_VARIABLES = ['FYRD_ARRAY_TASK_ID', 'SLURM_ARRAY_TASK_ID', 'PBS_ARRAYID',
+                  'PBS_ARRAY_INDEX', 'LSB_JOBINDEX']
+
+
+def get_task_id():
+    '''Return the task number of this job from the environment.'''
+    for variable in TASK_VARIABLES:
+        if os.environ.get(variable):
+            return int(os.environ[variable])
+    raise Exception('Cannot find array task id in the environment, tried '
+                    '{{}}'.format(TASK_VARIABLES))
+
+
+def get_task_args(args_file, task_id):
+    '''Read the arguments for one task (numbered from 1) from args_file.
+
+    The file is a series of pickles followed by the offset of each pickle,
+    the end offset and the number of pickles, all as 8 byte integers.
+    '''
+    with open(args_file, 'rb') as fin:
+        fin.seek(-8, 2)
+        count = struct.unpack('<Q', fin.read(8))[0]
+        if not 1 <= task_id <= count:
+            raise Exception('Task {{}} is not in array of {{}} tasks'
+                            .format(task_id, count))
+        fin.seek(-8*(count+2), 2)
+        offsets = struct.unpack('<{{}}Q'.format(count+1),
+                                fin.read(8*(count+1)))
+        fin.seek(offsets[task_id-1])
+        return pickle.loads(fin.read(offsets[task_id]-offsets[task_id-1]))
+
+
+if __name__ == "__main__":
+    task_id = get_task_id()
+    if not out:
+        try:
+            with open('{pickle_file}', 'rb') as fin:
+                function_call, _, kwargs = pickle.load(fin)
+            args = get_task_args('{args_file}', task_id)
+            out = function_call(*args, **(kwargs or {{}}))
+        except Exception:
+            out = sys.exc_info()
+            sys.stderr.write('Failed on {{}}\n'.format(socket.gethostname()))
+
+    with open('{out_file}.{{}}'.format(task_id), 'wb') as fout:
+        pickle.dump(out, fout)
+
+    if isinstance(out, tuple) and len(out) == 3:
+        if isinstance(out[0], type) and issubclass(out[0], BaseException):
+            six.reraise(*out)
+"""
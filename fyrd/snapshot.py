@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Share queue snapshots between processes.
+
+Every Queue runs its own queue query (e.g. squeue and sacct) on update, so 50
+pipeline workers on one login node polling every 2 seconds cost the scheduler
+50 times as much as one. With `shared_snapshot` set to True in the [queue]
+section of the config, the parsed output of the batch system queue_parser is
+written to a file in the config directory, and every Queue on the machine
+reads that file if it is younger than `queue_update` seconds.
+
+When the file is too old, one process is elected to refresh it by taking an
+exclusive fcntl lock, the others wait for the new file instead of querying
+the scheduler themselves. The file is replaced atomically, so readers never
+see a partial snapshot.
+
+Queries for a single job ID always go to the scheduler directly.
+
+Classes
+-------
+SnapshotCache
+    A queue snapshot file shared by all processes of a user.
+"""
+import os as _os
+import hashlib as _hashlib
+import pickle as _pickle
+import tempfile as _tempfile
+from time import time as _time
+from time import sleep as _sleep
+
+try:
+    import fcntl as _fcntl
+except ImportError:  # Windows
+    _fcntl = None
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import conf  as _conf
+from . import logme as _logme
+
+__all__ = ['SnapshotCache']
+
+# Longest time to wait for another process to refresh the snapshot
+REFRESH_TIMEOUT = 60
+
+# Interval to check if the refresh is done
+REFRESH_SLEEP = 0.1
+
+
+###############################################################################
+#                             The Snapshot Cache                              #
+###############################################################################
+
+
+class SnapshotCache(object):
+
+    """A queue snapshot file shared by all processes of a user.
+
+    Attributes
+    ----------
+    path : str
+        The snapshot file
+    lock_file : str
+        The file locked by the process refreshing the snapshot
+    max_age : float
+        Snapshots older than this many seconds are refreshed
+    hits : int
+        Number of times a snapshot was read from the file
+    refreshes : int
+        Number of times this process refreshed the snapshot
+
+    Methods
+    -------
+    get(fetch)
+        Return the snapshot, refreshing it with fetch() if it is too old.
+    """
+
+    def __init__(self, qtype, user=None, partition=None, max_age=None,
+                 directory=None):
+        """Set the snapshot file for this queue type and filter.
+
+        Parameters
+        ----------
+        qtype : str
+            The batch system
+        user : str, optional
+            The user the queue is filtered with
+        partition : str, optional
+            The partition the queue is filtered with
+        max_age : float, optional
+            Defaults to the queue_update option
+        directory : str, optional
+            Where to write the snapshot, defaults to the config directory
+        """
+        if max_age is None:
+            max_age = _conf.get_option('queue', 'queue_update', 2)
+        self.max_age = float(max_age)
+        directory = directory if directory else _conf.CONFIG_PATH
+        key = _hashlib.md5('{}:{}:{}'.format(qtype, user, partition)
+                           .encode()).hexdigest()[:10]
+        self.path = _os.path.join(
+            directory, 'queue_snapshot.{}.{}.pickle'.format(qtype, key)
+        )
+        self.lock_file = self.path + '.lock'
+        self.hits      = 0
+        self.refreshes = 0
+
+    ####################
+    #  Public Methods  #
+    ####################
+
+    def get(self, fetch):
+        """Return the snapshot, refreshing it with fetch() if it is too old.
+
+        Parameters
+        ----------
+        fetch : callable
+            Called with no arguments to get a new snapshot, must return a
+            picklable list.
+
+        Returns
+        -------
+        list
+        """
+        rows = self._read()
+        if rows is not None:
+            return rows
+        if not _fcntl:
+            return self._refresh(fetch)
+        with open(self.lock_file, 'a') as lock:
+            start = _time()
+            while True:
+                try:
+                    _fcntl.flock(lock, _fcntl.LOCK_EX | _fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    # Another process is refreshing, wait for its snapshot
+                    if _time() - start > REFRESH_TIMEOUT:
+                        _logme.log('Timed out waiting for the shared queue '
+                                   'snapshot, querying directly', 'warn')
+                        return fetch()
+                    _sleep(REFRESH_SLEEP)
+                    rows = self._read()
+                    if rows is not None:
+                        return rows
+                    continue
+                try:
+                    # The snapshot may have been refreshed while we waited
+                    rows = self._read()
+                    if rows is not None:
+                        return rows
+                    return self._refresh(fetch)
+                finally:
+                    _fcntl.flock(lock, _fcntl.LOCK_UN)
+
+    ######################
+    # Internal Functions #
+    ######################
+
+    def _read(self):
+        """Return the snapshot if it is young enough, else None."""
+        try:
+            if _time() - _os.path.getmtime(self.path) > self.max_age:
+                return None
+            with open(self.path, 'rb') as fin:
+                rows = _pickle.load(fin)
+        except (IOError, OSError, EOFError, _pickle.UnpicklingError):
+            return None
+        self.hits += 1
+        _logme.log('Using shared queue snapshot {}'.format(self.path),
+                   'debug')
+        return rows
+
+    def _refresh(self, fetch):
+        """Get a new snapshot and replace the file atomically."""
+        rows = list(fetch())
+        self.refreshes += 1
+        fd, tmp = _tempfile.mkstemp(dir=_os.path.dirname(self.path),
+                                    prefix='.queue_snapshot.')
+        try:
+            with _os.fdopen(fd, 'wb') as fout:
+                _pickle.dump(rows, fout)
+            _os.replace(tmp, self.path)
+        except (IOError, OSError) as err:
+            _logme.log('Could not write queue snapshot: {}'.format(err),
+                       'warn')
+            if _os.path.exists(tmp):
+                _os.remove(tmp)
+        return rows
+
+    def __repr__(self):
+        """Display path and counters."""
+        return 'SnapshotCache<{};hits:{};refreshes:{}>'.format(
+            self.path, self.hits, self.refreshes
+        )
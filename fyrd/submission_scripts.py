@@ -4,6 +4,7 @@ Classes to build submission scripts.
 """
 import os  as _os
 import sys as _sys
+import struct as _struct
 import inspect as _inspect
 import cloudpickle as _pickle
 
@@ -393,3 +394,103 @@ class Function(Script):
                     _logme.log('Function: {} already gone'
                                .format(self.outfile), 'debug')
         super(Function, self).clean(None)
+
+
+class ArrayFunction(Function):
+
+    """A Function that runs one task of a job array per array task.
+
+    The function and keyword arguments are pickled once, the arguments of all
+    tasks are written to a single indexed file, see write_task_args().
+    """
+
+    # _________________________________________________________________________
+    @property
+    def args_file(self):
+        args_file = _os.path.join(self.job_object.scriptpath,
+                                  self._args_file)
+        return args_file
+
+    def __init__(self, file_name, python, function, job, args=None,
+                 kwargs=None, imports=None, syspaths=None, pickle_file=None,
+                 outfile=None):
+        """Create a function array wrapper.
+
+        Parameters are the same as for Function, except that the arguments
+        of every task are taken from job.arglist, args is ignored.
+        """
+        # Function inspects the module of every argument, so that the task
+        # arguments can be unpickled remotely. Instances are only inspected
+        # once per class, as there may be very many tasks.
+        inspect_args = []
+        classes      = set()
+        for task_args in job.arglist:
+            for arg in task_args:
+                if not (_inspect.isclass(arg) or _inspect.isfunction(arg)
+                        or _inspect.ismethod(arg)):
+                    if type(arg) in classes:
+                        continue
+                    classes.add(type(arg))
+                inspect_args.append(arg)
+        super(ArrayFunction, self).__init__(
+            file_name, python, function, job, args=inspect_args,
+            kwargs=kwargs, imports=imports, syspaths=syspaths,
+            pickle_file=pickle_file, outfile=outfile
+        )
+        self.args       = None
+        self.arglist    = job.arglist
+        self._args_file = self._pickle_file + '.args'
+
+        # Replace the single function runner with the array runner
+        impts = _run.indent("None")
+        self.script = '#!{}\n'.format(python)
+        self.script += _scrpts.ARRAY_FUNC_RUNNER.format(
+            imports=impts, modimpstr='', pickle_file=self.pickle_file,
+            args_file=self.args_file, out_file=self.outfile
+        )
+
+    # _________________________________________________________________________
+    def write(self, overwrite=True):
+        """Write the task arguments and call the parent write function."""
+        _logme.log('Writing array arguments file {}'.format(self.args_file),
+                   'debug')
+        write_task_args(self.args_file, self.arglist)
+        super(ArrayFunction, self).write(overwrite)
+
+    # _________________________________________________________________________
+    def clean(self, delete_output=False):
+        """Delete the arguments file and call the parent clean function.
+
+        Parameters
+        ----------
+        delete_output : bool, optional
+            Delete the output pickle files too.
+        """
+        if self.written and _os.path.isfile(self.args_file):
+            _logme.log('ArrayFunction: Deleting {}'.format(self.args_file),
+                       'debug')
+            _os.remove(self.args_file)
+        super(ArrayFunction, self).clean(delete_output)
+
+
+def write_task_args(file_name, arglist):
+    """Write the arguments of every array task into one indexed file.
+
+    The file contains one pickle per task, followed by the start offset of
+    every pickle, the end offset of the last and the number of tasks, all as
+    little endian 8 byte integers. This allows any task to read only its own
+    arguments.
+
+    Parameters
+    ----------
+    file_name : str
+    arglist : list of tuple
+        The arguments for each task
+    """
+    offsets = [0]
+    with open(file_name, 'wb') as fout:
+        for args in arglist:
+            fout.write(_pickle.dumps(tuple(args)))
+            offsets.append(fout.tell())
+        fout.write(_struct.pack('<{}Q'.format(len(offsets)), *offsets))
+        fout.write(_struct.pack('<Q', len(arglist)))
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+Limit the rate of scheduler commands.
+
+Every command fyrd sends to the batch system (sbatch, squeue, qstat, bsub...)
+is an RPC to the scheduler controller. To avoid tripping the controller's
+rate limits, commands are passed through token buckets: one for submissions
+(and kills) and one for queries. A bucket is shared by all threads of a
+process. If throttle_file is set, it is also shared by all processes of the
+same user on the same machine, through a small state file locked with fcntl
+in the config directory.
+
+If the scheduler reports that it is busy (e.g. "Socket timed out on
+send/recv operation"), the bucket stops all commands for a while, doubling
+the pause every time it happens again, until a command succeeds.
+
+All options are set in the [queue] section of the config:
+
+    max_submit_rate : float
+        Maximum submit and kill commands per second, 0 for no limit
+    max_query_rate : float
+        Maximum queue query commands per second, 0 for no limit
+    throttle_file : bool
+        Share the limits between processes with a lock file, off by default
+
+Classes
+-------
+TokenBucket
+    A rate limiter with backoff, optionally shared between processes.
+
+Functions
+---------
+get_throttle
+    Return the TokenBucket for submissions or queries.
+cmd
+    Run a scheduler command through a TokenBucket.
+cmd_lines
+    Stream the output of a scheduler command run through a TokenBucket.
+stats
+    Return the metrics of all buckets in this process.
+"""
+import os as _os
+import re as _re
+import threading as _threading
+from contextlib import contextmanager as _contextmanager
+from time import time as _time
+from time import sleep as _sleep
+from subprocess import CalledProcessError as _CalledProcessError
+
+try:
+    import fcntl as _fcntl
+except ImportError:  # Windows
+    _fcntl = None
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import run   as _run
+from . import conf  as _conf
+from . import logme as _logme
+
+__all__ = ['TokenBucket', 'get_throttle', 'cmd', 'cmd_lines', 'stats']
+
+# Pause after the first busy error, doubled on every following one
+BUSY_START = 1.0
+BUSY_MAX   = 60.0
+
+# Busy errors are retried this many times, even if tries is lower
+BUSY_TRIES = 8
+
+# Errors that mean the scheduler is overloaded and the command can be retried
+BUSY_ERRORS = _re.compile(
+    r'socket timed out|timed out on send|slurm_receive_msg|'
+    r'temporarily unavailable|try again|too many (requests|rpcs)|'
+    r'server is busy|resources? busy',
+    _re.IGNORECASE
+)
+
+# Config options for each kind of command
+KINDS = {'submit': 'max_submit_rate', 'query': 'max_query_rate'}
+
+
+###############################################################################
+#                               The Token Bucket                              #
+###############################################################################
+
+
+class TokenBucket(object):
+
+    """Allow rate commands per second, with bursts, and back off when busy.
+
+    Attributes
+    ----------
+    rate : float
+        Tokens added per second, 0 means no limit (backoff still works)
+    burst : float
+        Maximum number of tokens that can be saved up
+    lock_file : str or None
+        If set, the state is stored in this file and shared by processes.
+    acquired : int
+        The number of tokens taken in this process
+    throttled : int
+        The number of times a caller had to wait
+    waited : float
+        The total number of seconds callers waited
+    backoffs : int
+        The number of busy errors reported
+
+    Methods
+    -------
+    acquire()
+        Block until a token is available, return seconds waited.
+    backoff()
+        Stop all commands for a while after a busy error.
+    ok()
+        Reset the backoff after a successful command.
+    stats()
+        Return a dictionary of metrics.
+    """
+
+    def __init__(self, rate, burst=None, lock_file=None):
+        """Create the bucket full.
+
+        Parameters
+        ----------
+        rate : float
+            Tokens per second, 0 or None for no limit
+        burst : float, optional
+            Bucket size, defaults to the larger of rate and 1
+        lock_file : str, optional
+            Path to a file to share the bucket between processes
+        """
+        self.rate      = float(rate) if rate else 0.0
+        self.burst     = float(burst) if burst else max(self.rate, 1.0)
+        self.lock_file = lock_file if _fcntl else None
+        self.acquired  = 0
+        self.throttled = 0
+        self.waited    = 0.0
+        self.backoffs  = 0
+        self._lock     = _threading.Lock()
+        # [tokens, last refill time, blocked until, current backoff]
+        self._state    = [self.burst, _time(), 0.0, 0.0]
+
+    ####################
+    #  Public Methods  #
+    ####################
+
+    def acquire(self):
+        """Block until a token is available.
+
+        Returns
+        -------
+        float
+            Seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._locked() as state:
+                wait = self._take(state, _time())
+            if wait <= 0:
+                break
+            _sleep(wait)
+            waited += wait
+        self.acquired += 1
+        if waited:
+            self.throttled += 1
+            self.waited    += waited
+            _logme.log('Throttled scheduler command for {:.2f} seconds'
+                       .format(waited), 'debug')
+        return waited
+
+    def backoff(self):
+        """Stop all commands for a while after a busy error.
+
+        Returns
+        -------
+        float
+            Seconds all commands are paused for
+        """
+        with self._locked() as state:
+            state[3] = min(max(state[3]*2, BUSY_START), BUSY_MAX)
+            state[2] = _time() + state[3]
+            delay = state[3]
+        self.backoffs += 1
+        return delay
+
+    def ok(self):
+        """Reset the backoff after a successful command."""
+        if not self.lock_file and not self._state[3]:
+            return
+        with self._locked() as state:
+            state[3] = 0.0
+
+    def stats(self):
+        """Return a dictionary of metrics.
+
+        Returns
+        -------
+        dict
+            {'rate': float, 'acquired': int, 'throttled': int,
+             'waited': float, 'backoffs': int}
+        """
+        return {'rate': self.rate, 'acquired': self.acquired,
+                'throttled': self.throttled, 'waited': self.waited,
+                'backoffs': self.backoffs}
+
+    ######################
+    # Internal Functions #
+    ######################
+
+    def _take(self, state, now):
+        """Take a token from state, return seconds to wait if none."""
+        if state[2] > now:
+            return state[2] - now
+        if not self.rate:
+            return 0
+        state[0] = min(self.burst, state[0] + (now - state[1])*self.rate)
+        state[1] = now
+        if state[0] >= 1:
+            state[0] -= 1
+            return 0
+        return (1 - state[0])/self.rate
+
+    @_contextmanager
+    def _locked(self):
+        """Yield the state, locked for this thread and process."""
+        with self._lock:
+            if not self.lock_file:
+                yield self._state
+                return
+            with open(self.lock_file, 'a+') as fout:
+                _fcntl.flock(fout, _fcntl.LOCK_EX)
+                try:
+                    fout.seek(0)
+                    try:
+                        state = [float(i) for i in fout.read().split()]
+                        assert len(state) == 4
+                    except (ValueError, AssertionError):
+                        state = list(self._state)
+                    yield state
+                    self._state = state
+                    fout.seek(0)
+                    fout.truncate()
+                    fout.write(' '.join(repr(i) for i in state))
+                    fout.flush()
+                finally:
+                    _fcntl.flock(fout, _fcntl.LOCK_UN)
+
+    def __repr__(self):
+        """Display rate and metrics."""
+        return 'TokenBucket<rate:{};acquired:{};waited:{:.2f}>'.format(
+            self.rate, self.acquired, self.waited
+        )
+
+
+###############################################################################
+#                              Module Functions                               #
+###############################################################################
+
+
+_buckets      = {}
+_buckets_lock = _threading.Lock()
+
+
+def get_throttle(kind):
+    """Return the TokenBucket for one kind of command, create if needed.
+
+    Parameters
+    ----------
+    kind : {'submit', 'query'}
+
+    Returns
+    -------
+    TokenBucket
+    """
+    if kind not in KINDS:
+        raise ValueError('kind must be one of {}'.format(list(KINDS)))
+    with _buckets_lock:
+        if kind not in _buckets:
+            rate = _conf.get_option('queue', KINDS[kind])
+            lock_file = None
+            if _conf.get_option('queue', 'throttle_file', False):
+                lock_file = _os.path.join(
+                    _conf.CONFIG_PATH, 'throttle_{}.lock'.format(kind)
+                )
+            _buckets[kind] = TokenBucket(rate, lock_file=lock_file)
+    return _buckets[kind]
+
+
+def is_busy(*outputs):
+    """Return True if any output looks like a scheduler busy error."""
+    for output in outputs:
+        if isinstance(output, bytes):
+            output = output.decode(errors='replace')
+        if output and BUSY_ERRORS.search(output):
+            return True
+    return False
+
+
+def cmd(kind, command, tries=1):
+    """Run a scheduler command through the bucket for kind.
+
+    Busy errors pause all commands of this kind and are retried, other errors
+    are retried up to tries times.
+
+    Parameters
+    ----------
+    kind : {'submit', 'query'}
+    command : str or list
+        Command to run, see fyrd.run.cmd
+    tries : int, optional
+        Number of times to try commands that fail with other errors
+
+    Returns
+    -------
+    exit_code : int
+    STDOUT : str
+    STDERR : str
+    """
+    bucket = get_throttle(kind)
+    count  = 0
+    busy   = 0
+    while True:
+        count += 1
+        bucket.acquire()
+        code, stdout, stderr = _run.cmd(command)
+        if code == 0:
+            bucket.ok()
+            break
+        if is_busy(stdout, stderr) and busy < BUSY_TRIES:
+            busy += 1
+            delay = bucket.backoff()
+            _logme.log('Scheduler busy running {}, pausing {} commands for '
+                       '{} seconds'.format(command, kind, delay), 'warn')
+            continue
+        if count >= tries:
+            break
+        _logme.log('Command {} failed with code {}, retrying.'
+                   .format(command, code), 'warn')
+        _sleep(1)
+    return code, stdout, stderr
+
+
+def cmd_lines(kind, command):
+    """Run a scheduler command through the bucket for kind, yield its lines.
+
+    Busy errors are retried if no output was read yet, other errors are
+    logged and end the output, like the empty output of a failed cmd().
+
+    Parameters
+    ----------
+    kind : {'submit', 'query'}
+    command : list
+        Command to run, see fyrd.run.cmd_lines
+
+    Yields
+    ------
+    line : str
+    """
+    bucket = get_throttle(kind)
+    busy   = 0
+    while True:
+        bucket.acquire()
+        count = 0
+        try:
+            for line in _run.cmd_lines(command):
+                count += 1
+                yield line
+        except _CalledProcessError as err:
+            if not count and is_busy(err.stderr) and busy < BUSY_TRIES:
+                busy += 1
+                delay = bucket.backoff()
+                _logme.log('Scheduler busy running {}, pausing {} commands '
+                           'for {} seconds'.format(command[0], kind, delay),
+                           'warn')
+                continue
+            _logme.log('{} failed with code {}: {}'.format(
+                command[0], err.returncode, err.stderr.strip()
+            ), 'debug')
+            return
+        bucket.ok()
+        return
+
+
+def stats():
+    """Return the metrics of all buckets in this process.
+
+    Returns
+    -------
+    dict
+        {kind: TokenBucket.stats()}
+    """
+    return {kind: bucket.stats() for kind, bucket in _buckets.items()}
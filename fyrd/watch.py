@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Wait for output files to appear without polling the file system.
+
+On Linux a single inotify instance (used through ctypes, no extra modules
+needed) watches every output directory that is waited on, once for the whole
+process, and wakes up waiters when their files are closed after writing or
+moved into place. A directory is no longer watched once nobody waits on it.
+
+Many shared file systems (e.g. NFS) do not send events for files written on
+other nodes, so waiters also poll the files they are waiting on, but with an
+interval that backs off, so the file system is not hit with a stat storm
+when thousands of jobs finish at once. If inotify is not available, polling
+is all that is used.
+
+Set `file_watch` to False in the [jobs] section of the config to always
+poll.
+
+Functions
+---------
+get_watcher
+    Return the FileWatcher for this process.
+wait_for_files
+    Block until all files exist or a timeout is reached.
+"""
+import os as _os
+import sys as _sys
+import errno as _errno
+import select as _select
+import struct as _struct
+import threading as _threading
+from time import time as _time
+
+import ctypes as _ctypes
+import ctypes.util as _ctypes_util
+
+###############################################################################
+#                               Import Ourself                                #
+###############################################################################
+
+from . import conf as _conf
+from . import logme as _logme
+from . import poll as _poll
+
+__all__ = ['FileWatcher', 'get_watcher', 'wait_for_files']
+
+# inotify constants from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+WATCH_MASK     = IN_CLOSE_WRITE | IN_MOVED_TO
+
+_EVENT = _struct.Struct('iIII')
+
+# Polling intervals used as a fallback, the first is used without inotify
+POLL_START    = 0.1
+INOTIFY_START = 1.0
+
+
+###############################################################################
+#                             The Watcher Class                               #
+###############################################################################
+
+
+class FileWatcher(object):
+
+    """Watch directories for files being written, one per process.
+
+    Attributes
+    ----------
+    active : bool
+        True if inotify is in use, otherwise only polling is done.
+    directories : dict
+        {directory: watch descriptor} for every watched directory
+
+    Methods
+    -------
+    wait(paths, timeout, poll_policy=None)
+        Block until all paths exist or timeout seconds have passed.
+    """
+
+    def __init__(self, use_inotify=True):
+        """Start the inotify reader thread if possible."""
+        self.active      = False
+        self.directories = {}
+        self._wds        = {}  # {watch descriptor: directory}
+        self._waiting    = {}  # {path: number of waiters}
+        self._dirs       = {}  # {directory: number of waited on paths}
+        self._seen       = set()
+        self._generation = 0   # Incremented when events may have been lost
+        self._cond       = _threading.Condition()
+        self._fd         = None
+        self._libc       = None
+        if use_inotify and _sys.platform.startswith('linux'):
+            try:
+                self._start()
+            except (OSError, AttributeError) as err:
+                _logme.log('inotify unavailable, polling for files: {}'
+                           .format(err), 'debug')
+                self.active = False
+
+    ####################
+    #  Public Methods  #
+    ####################
+
+    def wait(self, paths, timeout, poll_policy=None):
+        """Block until all paths exist or timeout seconds have passed.
+
+        Parameters
+        ----------
+        paths : list
+            Absolute paths to files
+        timeout : float
+            Maximum number of seconds to block for
+        poll_policy : class, optional
+            The polling policy class of the queue, to pick the file system
+            polling intervals, defaults to fyrd.poll.PollPolicy
+
+        Returns
+        -------
+        bool
+            True if all files exist
+        """
+        paths = set(_os.path.abspath(p) for p in paths)
+        self._register(paths)
+        try:
+            missing = set(p for p in paths if not _os.path.isfile(p))
+            end     = _time() + timeout
+            policy  = (poll_policy or _poll.PollPolicy)(
+                initial=INOTIFY_START if self.active else POLL_START,
+                maximum=max(timeout/10, POLL_START)
+            )
+            next_poll  = _time() + policy.next()
+            generation = self._generation
+            while missing:
+                with self._cond:
+                    missing -= self._seen
+                    if not missing:
+                        break
+                    now = _time()
+                    if now >= end:
+                        break
+                    if now < next_poll and generation == self._generation:
+                        self._cond.wait(min(end, next_poll) - now)
+                        continue
+                generation = self._generation
+                missing    = set(p for p in missing if not _os.path.isfile(p))
+                next_poll  = _time() + policy.next()
+            return not missing
+        finally:
+            self._unregister(paths)
+
+    ######################
+    # Internal Functions #
+    ######################
+
+    def _start(self):
+        """Create the inotify instance and the reader thread."""
+        libc = _ctypes.CDLL(_ctypes_util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+        libc.inotify_add_watch.argtypes = [
+            _ctypes.c_int, _ctypes.c_char_p, _ctypes.c_uint32
+        ]
+        libc.inotify_rm_watch.argtypes = [_ctypes.c_int, _ctypes.c_int]
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = _ctypes.get_errno()
+            raise OSError(err, _os.strerror(err))
+        self._libc = libc
+        self._fd   = fd
+        thread = _threading.Thread(target=self._read_events,
+                                   name='fyrd-file-watcher')
+        thread.daemon = True
+        thread.start()
+        self.active = True
+
+    def _register(self, paths):
+        """Watch the directories of paths and mark paths as waited on."""
+        with self._cond:
+            for path in paths:
+                self._waiting[path] = self._waiting.get(path, 0) + 1
+                directory = _os.path.dirname(path)
+                self._dirs[directory] = self._dirs.get(directory, 0) + 1
+            if not self.active:
+                return
+            for directory in set(_os.path.dirname(p) for p in paths):
+                if directory in self.directories:
+                    continue
+                wd = self._libc.inotify_add_watch(
+                    self._fd, directory.encode(), WATCH_MASK
+                )
+                if wd < 0:
+                    err = _ctypes.get_errno()
+                    _logme.log('Cannot watch {}: {}'.format(
+                        directory, _os.strerror(err)), 'debug')
+                    continue
+                self.directories[directory] = wd
+                self._wds[wd] = directory
+
+    def _unregister(self, paths):
+        """Stop tracking paths and directories nobody is waiting on anymore.
+
+        Watches are removed, so a long running process does not run into
+        the max_user_watches limit.
+        """
+        with self._cond:
+            for path in paths:
+                self._waiting[path] -= 1
+                if not self._waiting[path]:
+                    self._waiting.pop(path)
+                    self._seen.discard(path)
+                directory = _os.path.dirname(path)
+                self._dirs[directory] -= 1
+                if self._dirs[directory]:
+                    continue
+                self._dirs.pop(directory)
+                wd = self.directories.pop(directory, None)
+                if wd is None:
+                    continue
+                self._wds.pop(wd, None)
+                if self.active \
+                        and self._libc.inotify_rm_watch(self._fd, wd) < 0:
+                    err = _ctypes.get_errno()
+                    _logme.log('Cannot stop watching {}: {}'.format(
+                        directory, _os.strerror(err)), 'debug')
+
+    def _read_events(self):
+        """Read inotify events forever and wake up waiters."""
+        while True:
+            try:
+                _select.select([self._fd], [], [])
+                data = _os.read(self._fd, 65536)
+            except (OSError, IOError) as err:
+                if err.errno in (_errno.EINTR, _errno.EAGAIN):
+                    continue
+                _logme.log('inotify reader failed, polling for files: {}'
+                           .format(err), 'warn')
+                with self._cond:
+                    self.active = False
+                    self._generation += 1
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                    offset += _EVENT.size
+                    name = data[offset:offset+length].rstrip(b'\0')
+                    offset += length
+                    if mask & IN_Q_OVERFLOW:
+                        self._generation += 1
+                    elif mask & IN_IGNORED:
+                        # Removed by us or the directory is gone
+                        directory = self._wds.pop(wd, None)
+                        if self.directories.get(directory) == wd:
+                            self.directories.pop(directory)
+                    elif wd in self._wds and name:
+                        path = _os.path.join(self._wds[wd],
+                                             name.decode(errors='replace'))
+                        if path in self._waiting:
+                            self._seen.add(path)
+                self._cond.notify_all()
+
+
+###############################################################################
+#                              Module Functions                               #
+###############################################################################
+
+
+_watcher      = None
+_watcher_lock = _threading.Lock()
+
+
+def get_watcher():
+    """Return the FileWatcher for this process, create if needed.
+
+    Returns
+    -------
+    FileWatcher
+    """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = FileWatcher(
+                use_inotify=_conf.get_option('jobs', 'file_watch', True)
+            )
+    return _watcher
+
+
+def wait_for_files(paths, timeout, poll_policy=None):
+    """Block until all files exist or timeout seconds have passed.
+
+    Parameters
+    ----------
+    paths : list
+        Paths to files
+    timeout : float
+        Maximum number of seconds to block for
+    poll_policy : class, optional
+        The polling policy class to use, see FileWatcher.wait
+
+    Returns
+    -------
+    bool
+        True if all files exist
+    """
+    return get_watcher().wait(paths, timeout, poll_policy)
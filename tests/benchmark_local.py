@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time the local queue database with a large job history.
+
+Fills a temporary database with 1,000,000 finished jobs, one per second back
+in time (or the number given as the first argument), then times submitting
+jobs, getting single jobs and cleaning jobs older than 10 days, once with the
+tuned SQLite settings in local.DB_PRAGMAS and once with the SQLite defaults.
+No job runner or server is started.
+
+Run from the root of the repository::
+
+    python tests/benchmark_local.py [rows]
+"""
+import os
+import sys
+import shutil
+import tempfile
+from time import time
+from datetime import datetime, timedelta
+sys.path.append(os.path.abspath('.'))
+from fyrd.batch_systems import local
+import local_helpers
+
+SUBMITS = 1000
+GETS    = 1000
+
+DEFAULT_PRAGMAS = [('journal_mode', 'DELETE'), ('synchronous', 'FULL')]
+
+
+def make_manager(db_file, rows):
+    """Return a QueueManager without a runner with rows old jobs."""
+    manager = local_helpers.make_manager(db_file)
+    now = datetime.now()
+    local_helpers.add_jobs(manager, (
+        {'name': 'job_{}'.format(i), 'exitcode': 0,
+         'submit_time': now - timedelta(seconds=i)} for i in range(rows)
+    ))
+    return manager
+
+
+def run(db_file, rows):
+    """Return seconds taken for submits, gets and a clean."""
+    manager = make_manager(db_file, rows)
+    start = time()
+    jobnos = [manager.submit('true', 'bench') for _ in range(SUBMITS)]
+    submit_time = time() - start
+    start = time()
+    for jobno in jobnos[:GETS]:
+        assert len(manager.get(jobno, preclean=False)) == 1
+    get_time = time() - start
+    start = time()
+    manager.clean(days=10)
+    clean_time = time() - start
+    manager.db.engine.dispose()
+    return submit_time, get_time, clean_time
+
+
+def main(rows=1000000):
+    """Time the tuned and the default settings."""
+    tuned = local.DB_PRAGMAS
+    results = []
+    for name, pragmas in [('tuned', tuned), ('default', DEFAULT_PRAGMAS)]:
+        local.DB_PRAGMAS = pragmas
+        tmpdir = tempfile.mkdtemp()
+        try:
+            results.append(
+                (name, run(os.path.join(tmpdir, 'jobs.db'), rows))
+            )
+        finally:
+            shutil.rmtree(tmpdir)
+    local.DB_PRAGMAS = tuned
+
+    print('{} historical rows'.format(rows))
+    for name, (submit_time, get_time, clean_time) in results:
+        print('{:<8} submit {:8.1f}/s  get {:8.1f}/s  clean {:6.3f} s'
+              .format(name, SUBMITS/submit_time, GETS/get_time, clean_time))
+
+
+if __name__ == '__main__' and '__file__' in globals():
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
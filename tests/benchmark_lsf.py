@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time the LSF queue parser on a large fake queue.
+
+Generates a queue of 50,000 jobs (or the number given as the first argument)
+and parses it with both the bjobs -json and the delimited output, printing
+the cost per row. No LSF installation is needed, the bjobs output is faked.
+
+Run from the root of the repository::
+
+    python tests/benchmark_lsf.py [rows]
+"""
+import os
+import sys
+import json
+from time import time
+sys.path.append(os.path.abspath('.'))
+from fyrd.batch_systems import lsf
+
+STATES = ['RUN', 'PEND', 'DONE', 'EXIT']
+
+
+def make_records(rows):
+    """Return a list of bjobs -json records."""
+    records = []
+    for i in range(rows):
+        running = i % 4 == 0
+        records.append({
+            'JOBID': str(100000 + i) if i % 10 else '{}[{}]'.format(
+                100000 + i, i % 100 + 1),
+            'JOB_NAME': 'job_{}'.format(i),
+            'USER': 'bob',
+            'QUEUE': 'normal',
+            'STAT': STATES[i % 4],
+            'EXEC_HOST': '16*node{0}:16*node{1}'.format(i % 500, i % 499)
+                         if running else '-',
+            'NEXEC_HOST': '2' if running else '-',
+            'SLOTS': '32',
+            'EXIT_CODE': '1' if i % 4 == 3 else '',
+        })
+    return records
+
+
+def run(server, rows):
+    """Parse the whole queue, return seconds taken."""
+    start = time()
+    count = sum(1 for _ in server.queue_parser(user='bob'))
+    assert count == rows, count
+    return time() - start
+
+
+def main(rows=50000):
+    """Time both parsers."""
+    records = make_records(rows)
+    output = json.dumps({'COMMAND': 'bjobs', 'JOBS': rows,
+                         'RECORDS': records})
+    lines = [lsf.BJOBS_DELIM.join(r[k] for k in lsf.BJOBS_KEYS)
+             for r in records]
+    lsf._throttle.cmd = lambda kind, qargs, tries=1: (0, output, '')
+    lsf._throttle.cmd_lines = lambda kind, qargs: iter(lines)
+
+    server = lsf.LSFServer()
+    json_time = run(server, rows)
+    server._bjobs_json = False
+    delim_time = run(server, rows)
+
+    print('{} rows'.format(rows))
+    for name, took in [('json', json_time), ('delimited', delim_time)]:
+        print('{:<10} {:7.3f} s  {:6.2f} us/row'
+              .format(name, took, took/rows*1e6))
+
+
+if __name__ == '__main__' and '__file__' in globals():
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
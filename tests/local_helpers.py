@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Build a local QueueManager on a temporary database, without a job runner.
+
+Used by the local queue tests and by benchmark_local.py.
+"""
+import os
+import sys
+from datetime import datetime
+sys.path.append(os.path.abspath('.'))
+from fyrd.batch_systems import local
+
+# Columns of rows added by add_jobs, unless given
+JOB_DEFAULTS = {'name': 'job', 'command': 'true', 'threads': 1,
+                'state': 'completed'}
+
+
+class FakeInqueue(object):
+
+    """Stands in for the job runner queue, keeps what is put."""
+
+    def __init__(self):
+        """Nothing sent yet."""
+        self.items = []
+
+    def put(self, item):
+        """Keep the message."""
+        self.items.append(item)
+
+
+def make_manager(db_file):
+    """Return a QueueManager using db_file, no server or runner is started.
+
+    Messages for the job runner are kept in manager.inqueue.items.
+    """
+    manager = object.__new__(local.QueueManager)
+    manager.db = local.LocalQueue(db_file)
+    manager.jobs = {}
+    manager.all_jobs = []
+    manager.inqueue = FakeInqueue()
+    manager.check_runner = lambda: None
+    manager._start_changes()
+    return manager
+
+
+def add_jobs(manager, rows, chunk=100000):
+    """Insert job rows straight into the database.
+
+    Parameters
+    ----------
+    manager : QueueManager
+    rows : iterable of dict
+        Job columns, JOB_DEFAULTS and the current time as submit_time are
+        used for any that are missing.
+    chunk : int, optional
+        Rows per INSERT
+    """
+    now = datetime.now()
+    table = local.Job.__table__
+    rows = iter(rows)
+    with manager.db.engine.begin() as conn:
+        while True:
+            batch = []
+            for row in rows:
+                job = dict(JOB_DEFAULTS, submit_time=now)
+                job.update(row)
+                batch.append(job)
+                if len(batch) == chunk:
+                    break
+            if not batch:
+                return
+            conn.execute(table.insert(), batch)
@@ -0,0 +1,100 @@
+"""Test the job array argument file."""
+import os
+import sys
+sys.path.append(os.path.abspath('.'))
+import fyrd
+
+
+def _get_task_args():
+    """Return get_task_args from the array runner script."""
+    script = fyrd.script_runners.ARRAY_FUNC_RUNNER.format(
+        imports='    pass', modimpstr='', pickle_file='', args_file='',
+        out_file=''
+    )
+    namespace = {'__name__': 'runner'}
+    exec(script, namespace)
+    return namespace['get_task_args']
+
+
+def test_task_args(tmpdir):
+    """Every task reads back only its own arguments."""
+    arglist = [(1,), ('a', 'b'), ({'c': [1, 2]},), ()]
+    args_file = str(tmpdir.join('array.args'))
+    fyrd.submission_scripts.write_task_args(args_file, arglist)
+    get_task_args = _get_task_args()
+    for task, args in enumerate(arglist, 1):
+        assert get_task_args(args_file, task) == args
+
+
+def test_parse_array():
+    """Local queue task id parsing."""
+    from fyrd.batch_systems import local
+    assert local.parse_array('1-3,5') == [1, 2, 3, 5]
+    assert local.parse_array(4) == [4]
+
+
+def _count(*args):
+    """Count the arguments, run by the array tasks."""
+    return len(args)
+
+
+class _FakeBatch(object):
+
+    """Nothing is installed on the server."""
+
+    def is_module_installed(self, module):
+        return False
+
+
+class _FakeJob(object):
+
+    """The job attributes used by ArrayFunction."""
+
+    def __init__(self, arglist, scriptpath):
+        self.arglist    = arglist
+        self.scriptpath = scriptpath
+        self.batch      = _FakeBatch()
+
+
+def test_array_function_modules(tmpdir):
+    """Task arguments of user packages are pickled by value."""
+    from fyrd.batch_systems.nodeset import NodeSet
+    job  = _FakeJob([(NodeSet(['n1']),), (NodeSet(['n2']), 2)], str(tmpdir))
+    func = fyrd.submission_scripts.ArrayFunction(
+        'array', sys.executable, _count, job
+    )
+    try:
+        assert NodeSet in func.pickle_modules
+        assert NodeSet.__module__ == '__main__'
+        assert func.args is None
+    finally:
+        func.restore_modules()
+    assert NodeSet.__module__ == 'fyrd.batch_systems.nodeset'
+
+
+def test_local_array(tmpdir):
+    """The local queue runs one job per task and kills them together."""
+    import local_helpers
+    manager = local_helpers.make_manager(str(tmpdir.join('queue.db')))
+    try:
+        first = manager.submit_array('true', 'array', [1, 2, 3],
+                                     stdout='out', stderr='err')
+        queued = [i[1] for i in manager.inqueue.items if i[0] == 'queue']
+        assert [(i[1], i[4], i[5]) for i in queued] == [
+            ('FYRD_ARRAY_TASK_ID={} true'.format(i), 'out-{}'.format(i),
+             'err-{}'.format(i)) for i in (1, 2, 3)
+        ]
+        assert queued[0][0] == first
+        _, _, jobs, _ = manager.get_changes()
+        assert [(j[0], j[9], j[10]) for j in jobs] == [
+            (first + i, first, i + 1) for i in range(3)
+        ]
+        manager.inqueue.items = []
+        assert manager.kill([first, first + 10]) is False
+        assert manager.inqueue.items == []
+        manager.kill(first)
+        assert manager.inqueue.items == [
+            ('kill', first + i) for i in range(3)
+        ]
+    finally:
+        manager.db.engine.dispose()
@@ -0,0 +1,57 @@
+"""Test the bulk submission helpers."""
+import os
+import sys
+sys.path.append(os.path.abspath('.'))
+import fyrd
+from fyrd import bulk
+
+
+def _job(*dependencies):
+    """Return a bare Job with dependencies."""
+    job = object.__new__(fyrd.Job)
+    job.dependencies = list(dependencies)
+    return job
+
+
+def test_waves():
+    """Jobs come after their dependencies in the batch."""
+    first = _job()
+    second = _job(first, '1234')
+    third = _job(second, first)
+    other = _job('5678')
+    waves = bulk._get_waves([third, second, first, other])
+    assert waves == [[first, other], [second], [third]]
+
+
+class _FakeClient(object):
+
+    """A remote client that counts its releases."""
+
+    remote = True
+    uri    = 'PYRO:fake@localhost:1'
+
+    def __init__(self, remote=True, uri=None):
+        self.released = 0
+
+    def release(self):
+        self.released += 1
+
+
+def test_thread_batches():
+    """Each thread gets its own client, all are released on exit."""
+    import threading
+    batch   = _FakeClient()
+    clients = []
+    with bulk._ThreadBatches() as batches:
+        def get():
+            clients.append(batches.get(batch))
+            clients.append(batches.get(batch))
+        threads = [threading.Thread(target=get) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert clients[0] is clients[1] and clients[2] is clients[3]
+        assert clients[0] is not clients[2] and batch not in clients
+    assert [c.released for c in clients] == [1, 1, 1, 1]
+    assert batch.released == 0
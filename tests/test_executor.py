@@ -0,0 +1,190 @@
+"""Test the Executor against a fake queue, no batch system is needed."""
+import os
+import sys
+import itertools
+import threading
+from collections import OrderedDict
+import pytest
+sys.path.append(os.path.abspath('.'))
+import fyrd
+
+
+class _FakeQueue(object):
+
+    """Run every job in the poller thread when the queue is checked.
+
+    Jobs with an ID in hold stay running, states are reported from the
+    states dictionary, so tests can fail jobs.
+    """
+
+    def __init__(self):
+        """Nothing is held or failed."""
+        self.hold   = set()
+        self.states = {}
+        self.checks = 0
+
+    def _new_policy(self, jobs=None, track=True):
+        return fyrd.poll.PollPolicy(initial=0.01, maximum=0.01, jitter=0)
+
+    def _normalize_job_ids(self, jobs):
+        return OrderedDict((str(job.id), (str(job.id), None)) for job in jobs)
+
+    def _get_job_states(self, check_jobs, missing):
+        self.checks += 1
+        for job_string in check_jobs:
+            if job_string in self.hold:
+                yield job_string, 'running'
+            else:
+                yield job_string, self.states.get(job_string, 'completed')
+
+    def _finish_job(self, job, job_state):
+        job.state = job_state
+
+
+class _FakeJob(object):
+
+    """Run the function locally once the fake queue completes the job."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, fn, args=None, kwargs=None, queue=None, **kwds):
+        self.fn     = fn
+        self.args   = args or ()
+        self.kwargs = kwargs or {}
+        self.kwds   = kwds
+        self.id     = None
+        self.state  = 'Not_Submitted'
+        self.killed = False
+
+    def submit(self):
+        self.id    = str(next(self.ids))
+        self.state = 'pending'
+
+    def kill(self, confirm=True):
+        self.killed = True
+
+    def _check_files(self):
+        return True
+
+    def _finished_status(self):
+        return self.state == 'completed'
+
+    def _get_finished(self, status, **kwds):
+        return self.fn(*self.args, **self.kwargs)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    """Return an Executor on a _FakeQueue, shut down after the test."""
+    monkeypatch.setattr(fyrd.executor, '_Job', _FakeJob)
+    monkeypatch.setattr(_FakeJob, 'ids', itertools.count(1))
+    executor = fyrd.Executor(queue=_FakeQueue(), max_pending=3)
+    yield executor
+    executor.shutdown(cancel_futures=True)
+
+
+def _add(a, b=0):
+    """Add, run by the fake jobs."""
+    return a + b
+
+
+def test_submit(executor):
+    """Futures resolve to the function output or the job failure."""
+    future = executor.submit(_add, 1, b=2)
+    assert future.result(timeout=5) == 3
+    executor.queue.states['2'] = 'failed'
+    failed = executor.submit(_add, 1)
+    with pytest.raises(fyrd.ClusterError):
+        failed.result(timeout=5)
+
+
+def test_map_chunksize(executor, monkeypatch):
+    """map keeps the input order and bundles calls into chunks."""
+    jobs = []
+
+    def make_job(*args, **kwds):
+        jobs.append(_FakeJob(*args, **kwds))
+        return jobs[-1]
+    monkeypatch.setattr(fyrd.executor, '_Job', make_job)
+    result = list(executor.map(_add, range(10), range(10), chunksize=4,
+                               timeout=5))
+    assert result == [i * 2 for i in range(10)]
+    assert len(jobs) == 3
+    with pytest.raises(ValueError):
+        executor.map(_add, range(3), chunksize=0)
+
+
+def test_cancel(executor):
+    """Cancelled futures kill their job and free their slot."""
+    executor.queue.hold.update(str(i) for i in range(1, 100))
+    futures = [executor.submit(_add, i) for i in range(3)]
+    assert futures[0].cancel()
+    # The slot is freed once the job is killed, so this does not block
+    fourth = executor.submit(_add, 3)
+    executor.queue.hold.clear()
+    assert fourth.result(timeout=5) == 3
+    assert futures[0].cancelled()
+    assert [f.result(timeout=5) for f in futures[1:]] == [1, 2]
+
+
+def test_shutdown(executor):
+    """shutdown waits for running jobs, then refuses new ones."""
+    futures = [executor.submit(_add, i) for i in range(3)]
+    executor.shutdown(wait=True)
+    assert all(f.done() for f in futures)
+    assert not executor._thread.is_alive()
+    with pytest.raises(RuntimeError):
+        executor.submit(_add, 1)
+
+
+def test_shutdown_cancel(executor):
+    """shutdown with cancel_futures cancels and kills unfinished jobs."""
+    executor.queue.hold.update(str(i) for i in range(1, 100))
+    future = executor.submit(_add, 1)
+    executor.shutdown(wait=True, cancel_futures=True)
+    assert future.cancelled()
+
+
+def test_poll_error(executor):
+    """An error in the poller fails the pending futures instead of hanging."""
+    def broken(jobs):
+        raise ValueError('broken')
+    executor.queue._normalize_job_ids = broken
+    future = executor.submit(_add, 1)
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+
+
+def test_slow_output(executor):
+    """Reading one slow output does not stop other futures resolving."""
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return 'slow'
+    slow_future = executor.submit(slow)
+    fast_future = executor.submit(_add, 2)
+    assert fast_future.result(timeout=2) == 2
+    assert not slow_future.done()
+    release.set()
+    assert slow_future.result(timeout=5) == 'slow'
+
+
+def test_queue_errors(executor):
+    """Failing queue updates fail the futures once they keep failing."""
+    get_job_states = executor.queue._get_job_states
+    errors = [ValueError('busy')] * (fyrd.executor.MAX_QUEUE_ERRORS - 1)
+
+    def flaky(check_jobs, missing):
+        if errors:
+            raise errors.pop()
+        return get_job_states(check_jobs, missing)
+    executor.queue._get_job_states = flaky
+    assert executor.submit(_add, 1).result(timeout=5) == 1
+
+    def broken(check_jobs, missing):
+        raise ValueError('down')
+    executor.queue._get_job_states = broken
+    future = executor.submit(_add, 1)
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
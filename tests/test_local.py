@@ -1,12 +1,17 @@
 """Test remote queues, we can't test local queues in py.test."""
 import os
 import sys
+import time
+import threading
+import multiprocessing as mp
 from datetime import datetime as dt
 from datetime import timedelta as td
 import pytest
 
 sys.path.append(os.path.abspath('.'))
 import fyrd
+from fyrd.batch_systems import local
+import local_helpers
 env = 'local'
 fyrd.batch_systems.MODE = 'local'
 
@@ -449,3 +454,145 @@ def test_splitfile_indirect():
 def test_dir_clean():
     """Clean all job files in this dir."""
     fyrd.basic.clean_dir(delete_outputs=True)
+
+
+def test_dependency_graph():
+    """Finished jobs release their dependents, failures cancel them."""
+    from fyrd.batch_systems.local import _DependencyGraph
+    graph = _DependencyGraph()
+    for jobno, depends in [(1, None), (2, [1]), (3, [2]), (4, [1]),
+                           (5, None)]:
+        assert graph.add(jobno, {'threads': 1}, depends) == []
+    graph.jobs[5]['threads'] = 3
+    assert [i for i, _ in graph.pop(2)] == [1]
+    assert graph.finish(1) == []
+    assert [i for i, _ in graph.pop(4)] == [2, 4]
+    assert sorted(graph.finish(2, False)) == [3]
+    assert graph.add(6, {'threads': 1}, [3]) == [6]
+    assert [i for i, _ in graph.pop(4)] == [5]
+    assert len(graph) == 0
+
+
+class _FakeQServer(object):
+
+    """Record the job updates sent by job_runner."""
+
+    def __init__(self):
+        """No updates yet."""
+        self.updates = []
+
+    def update_jobs(self, updates):
+        """Keep the updates."""
+        self.updates += updates
+
+    def states(self, jobno):
+        """Return every state sent for jobno."""
+        return [u[1] for u in self.updates if u[0] == jobno]
+
+
+def test_job_runner_kill(tmpdir, monkeypatch):
+    """A killed job is reaped and its cores are given back."""
+    qserver = _FakeQServer()
+    monkeypatch.setattr(local, '_WE_ARE_A_SERVER', True)
+    monkeypatch.setattr(local, 'get_server', lambda **kwds: qserver)
+    inbox    = local._RunnerInbox()
+    outqueue = mp.Queue()
+    runner   = threading.Thread(target=local.job_runner,
+                                args=(inbox.reader, outqueue, 4))
+    runner.start()
+
+    def cores():
+        inbox.put('available_cores')
+        return outqueue.get(timeout=10)
+
+    def wait_for(check):
+        start = time.time()
+        while not check():
+            assert time.time() - start < 10
+            time.sleep(0.05)
+
+    try:
+        max_cores = cores()
+        inbox.put(('queue', (1, 'sleep 30', 2, None,
+                             str(tmpdir.join('out')), str(tmpdir.join('err')),
+                             None)))
+        wait_for(lambda: 'running' in qserver.states(1))
+        assert cores() == max_cores - 2
+        inbox.put(('kill', 1))
+        wait_for(lambda: cores() == max_cores)
+        assert qserver.states(1) == ['pending', 'running', 'killed']
+    finally:
+        inbox.put('stop')
+        runner.join(10)
+    assert outqueue.get(timeout=10) is True
+    assert not runner.is_alive()
+
+
+@pytest.fixture
+def manager(tmpdir):
+    """Return a QueueManager on an empty database and the add_jobs helper.
+
+    No server or job runner is started, see local_helpers.
+    """
+    manager = local_helpers.make_manager(str(tmpdir.join('queue.db')))
+    yield manager, lambda rows: local_helpers.add_jobs(manager, rows)
+    manager.db.engine.dispose()
+
+
+def test_update_jobs(manager):
+    """Batched updates change only the given columns, last update wins."""
+    manager, add_jobs = manager
+    add_jobs([{'state': 'pending'}] * 3)
+    manager.update_jobs([(1, 'running', None, 100), (2, 'killed', None, None),
+                         (1, 'completed', 0, None), (3, None, None, None)])
+    jobs = {j.jobno: (j.state, j.exitcode, j.pid)
+            for j in manager.db.query().all()}
+    assert jobs == {1: ('completed', 0, 100), 2: ('killed', None, None),
+                    3: ('pending', None, None)}
+
+
+def test_clean(manager):
+    """Clean deletes old jobs in one statement and indexes submit_time."""
+    manager, add_jobs = manager
+    add_jobs({'submit_time': dt.now() - td(days=days)}
+             for days in [0, 2, 10, 20])
+    manager.clean(days=7)
+    assert [j.jobno for j in manager.db.query().all()] == [1, 2]
+    with manager.db.engine.connect() as conn:
+        indexes = [i[1] for i in conn.exec_driver_sql(
+            'PRAGMA index_list(jobs)')]
+        mode = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+    assert 'ix_jobs_submit_time' in indexes
+    assert mode == 'wal'
+    manager.db.compact()
+
+
+def test_get_changes(manager):
+    """Only jobs changed or deleted since the token are sent."""
+    manager, add_jobs = manager
+    add_jobs({'state': 'pending', 'seq': 1,
+              'submit_time': dt.now() - td(days=days)}
+             for days in [20, 0, 0])
+    manager._last_clean = time.time()
+    token, full, jobs, deleted = manager.get_changes()
+    assert full and [j[0] for j in jobs] == [1, 2, 3] and deleted == []
+    assert manager.get_changes(token) == (token, False, [], [])
+    manager.update_jobs([(2, 'running', None, 10), (3, 'running', None, 11)])
+    manager.update_job(3, 'completed', 0)
+    token, full, jobs, deleted = manager.get_changes(token)
+    assert not full
+    assert [(j[0], j[3]) for j in jobs] == [(2, 'running'), (3, 'completed')]
+    manager.clean(days=7)
+    new_token, full, jobs, deleted = manager.get_changes(token)
+    assert not full and jobs == [] and deleted == [1]
+    assert new_token[1] > token[1]
+    # Tokens from another server, or older than the deletion log, get all
+    assert manager.get_changes(['old', token[1]])[1]
+    for _ in range(local.DELETED_LOG + 1):
+        add_jobs([{'submit_time': dt.now() - td(days=20)}])
+        manager.clean(days=7)
+    token, full, jobs, deleted = manager.get_changes(new_token)
+    assert full and [j[0] for j in jobs] == [2, 3] and deleted == []
+    # A new server, e.g. on a recreated database, starts a new epoch
+    manager._start_changes()
+    assert manager.get_changes(token)[1]
@@ -0,0 +1,48 @@
+"""Test LSF output parsing without a cluster."""
+import os
+import sys
+import json
+sys.path.append(os.path.abspath('.'))
+from fyrd.batch_systems import lsf
+
+RECORDS = [
+    {'JOBID': '10', 'JOB_NAME': 'a', 'USER': 'bob', 'QUEUE': 'normal',
+     'STAT': 'RUN', 'EXEC_HOST': '16*n1:16*n2', 'NEXEC_HOST': '2',
+     'SLOTS': '32', 'EXIT_CODE': ''},
+    {'JOBID': '11[2]', 'JOB_NAME': 'b[2]', 'USER': 'bob', 'QUEUE': 'normal',
+     'STAT': 'EXIT', 'EXEC_HOST': 'n3', 'NEXEC_HOST': '1', 'SLOTS': '1',
+     'EXIT_CODE': '3'},
+    {'ERROR': 'Job <12> is not found'},
+]
+EXPECTED = [
+    ('10', None, 'a', 'running', ['n1', 'n2'], 32, None),
+    ('11', '2', 'b[2]', 'failed', ['n3'], 1, 3),
+]
+
+
+def _summary(jobs):
+    """Return the fields checked by the tests."""
+    return [(j[0], j[1], j[2], j[5], j[6], j[8], j[9]) for j in jobs]
+
+
+def test_bjobs_json(monkeypatch):
+    """bjobs -json records are parsed, error records skipped."""
+    output = json.dumps({'COMMAND': 'bjobs', 'JOBS': 2, 'RECORDS': RECORDS})
+    monkeypatch.setattr(lsf._throttle, 'cmd',
+                        lambda kind, qargs, tries=1: (0, output, ''))
+    server = lsf.LSFServer()
+    assert _summary(server.queue_parser(user='bob')) == EXPECTED
+
+
+def test_bjobs_delimited(monkeypatch):
+    """Old LSF versions fall back to delimited output."""
+    lines = [lsf.BJOBS_DELIM.join(r.get(k, '') for k in lsf.BJOBS_KEYS)
+             for r in RECORDS[:2]]
+    monkeypatch.setattr(lsf._throttle, 'cmd', lambda kind, qargs, tries=1: (
+        255, '', 'bjobs: illegal option -- json\nUsage: bjobs ...'
+    ))
+    monkeypatch.setattr(lsf._throttle, 'cmd_lines',
+                        lambda kind, qargs: iter(lines))
+    server = lsf.LSFServer()
+    assert _summary(server.queue_parser(user='bob')) == EXPECTED
+    assert not server._bjobs_json
@@ -0,0 +1,39 @@
+"""Test compact node lists."""
+import os
+import sys
+import pickle
+sys.path.append(os.path.abspath('.'))
+from fyrd.batch_systems import NodeSet
+
+
+def test_slurm():
+    """Slurm ranges are kept compact and include the last node."""
+    nodes = NodeSet.from_slurm('node[001-512],gpu[8-10]-ib,login1')
+    assert len(nodes) == 516
+    assert list(nodes)[:2] == ['node001', 'node002']
+    assert 'node512' in nodes
+    assert 'node513' not in nodes
+    assert 'node1' not in nodes
+    assert 'gpu10-ib' in nodes
+    assert 'login1' in nodes
+    assert len(nodes._ranges) == 2
+    assert NodeSet('n[1-3,5]') == ['n1', 'n2', 'n3', 'n5']
+
+
+def test_torque_lsf():
+    """Torque cores and LSF slots become counts."""
+    nodes = NodeSet.from_torque('n1/0-3,5+n2/0+n1/6')
+    assert nodes.counts() == {'n1': 6, 'n2': 1}
+    assert nodes.total == 7
+    nodes = NodeSet.from_lsf('16*a1:16*a2:b1')
+    assert list(nodes) == ['a1', 'a2', 'b1']
+    assert nodes.counts()['a2'] == 16
+    assert not NodeSet.from_lsf('-')
+
+
+def test_round_trip():
+    """The string form and pickles keep ranges and counts."""
+    nodes = NodeSet.from_lsf('16*a1') + NodeSet('n[08-10]')
+    assert str(nodes) == 'n[08-10],16*a1'
+    assert NodeSet(str(nodes)) == nodes
+    assert pickle.loads(pickle.dumps(nodes)) == nodes
@@ -0,0 +1,51 @@
+"""Test the polling policy."""
+import os
+import sys
+sys.path.append(os.path.abspath('.'))
+import fyrd
+
+
+def test_backoff():
+    """Intervals grow by the backoff up to the maximum."""
+    policy = fyrd.poll.PollPolicy(initial=1, maximum=4, backoff=2, jitter=0)
+    assert [policy.next() for _ in range(4)] == [1, 2, 4, 4]
+    assert policy.polls == 4
+
+
+def test_reset_on_change():
+    """Intervals return to initial when the observed state changes."""
+    policy = fyrd.poll.PollPolicy(initial=1, maximum=8, backoff=2, jitter=0)
+    policy.observe('running')
+    policy.next()
+    policy.next()
+    policy.observe('running')
+    assert policy.next() == 4
+    policy.observe('completed')
+    assert policy.next() == 1
+    assert policy.resets == 1
+
+
+def test_jitter():
+    """Jitter stays within the fraction given."""
+    policy = fyrd.poll.PollPolicy(initial=10, maximum=10, backoff=1,
+                                  jitter=0.1)
+    for _ in range(50):
+        assert 9 <= policy.next() <= 11
+
+
+def test_hint():
+    """A walltime hint caps the interval."""
+    policy = fyrd.poll.PollPolicy(initial=1, maximum=60, backoff=2,
+                                  jitter=0, hint='00:01:00')
+    assert policy.maximum == 3
+    policy = fyrd.poll.PollPolicy(initial=1, maximum=60, backoff=2,
+                                  jitter=0, hint='1-00:00:00')
+    assert policy.maximum == 60
+
+
+def test_time_to_seconds():
+    """Parse walltime strings."""
+    assert fyrd.poll.time_to_seconds('1-01:01:01') == 90061
+    assert fyrd.poll.time_to_seconds('10:00') == 600
+    assert fyrd.poll.time_to_seconds(30) == 30
+    assert fyrd.poll.time_to_seconds('bob') is None
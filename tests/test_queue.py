@@ -1,7 +1,13 @@
 """Test remote queues, we can't test local queues in py.test."""
 import os
 import sys
+import asyncio
+import itertools
 import pytest
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
 sys.path.append(os.path.abspath('.'))
 import fyrd
 env = fyrd.batch_systems.get_cluster_environment()
@@ -39,3 +45,478 @@ def test_queue_creation():
     queue = fyrd.Queue()
     assert queue.qtype == env
     len(queue)
+
+
+def test_job_id_filter():
+    """Job IDs passed to queue_parser are normalized and batched."""
+    server = fyrd.batch_systems.base.BatchSystemServer
+    assert server._filter_ids(None) is None
+    assert server._filter_ids('bob') is None
+    assert server._filter_ids(12) == ['12']
+    assert server._filter_ids('12_3,13[1-4], 14.host,12') == ['12', '13', '14']
+    ids = [str(i) for i in range(server.ID_BATCH + 5)]
+    assert list(server._id_batches(None)) == [None]
+    batches = list(server._id_batches(ids))
+    assert [len(b) for b in batches] == [server.ID_BATCH, 5]
+
+
+def test_job_table():
+    """Jobs are stored in columns, indexed, and evicted rows are reused."""
+    from fyrd.jobtable import JobTable
+    table = JobTable(fyrd.queue.DONE_STATES)
+    job = fyrd.queue.QueueJob('10', table)
+    job.owner = 'bob'
+    job.state = 'running'
+    child = fyrd.queue.QueueChild(job, '1')
+    child.state = 'completed'
+    child.exitcode = 2
+    assert job.array_job and list(job.children) == ['1']
+    assert job.children['1'].exitcode == 2
+    assert job.get_exitcode() == 2
+    assert table.find('state', ['running']) == {job._row}
+    assert table.values('owner') == {'bob'}
+    done = fyrd.queue.QueueJob('11', table)
+    done.state = 'failed'
+    assert done.threads is None and not done.disappeared
+    assert table.evictable(0) == []
+    assert table.evictable(table.done_at[done._row] + 1, keep=['11']) == []
+    assert table.evictable(table.done_at[done._row] + 1) == [done._row]
+    table.remove(done._row)
+    assert '11' not in table and len(table) == 1
+    with pytest.raises(fyrd.queue.QueueError):
+        done.state
+    # The freed row is reused
+    new = fyrd.queue.QueueJob('12', table)
+    assert new._row == done._row and new.state is None
+    assert fyrd.queue._Jobs(table)['10'].owner == 'bob'
+
+
+class _FakeBatch(object):
+
+    """Return queue_parser rows set by the test.
+
+    Either set rows, or set snapshots to a list of row lists, every query
+    then returns the next one, the last one is repeated.
+    """
+
+    def __init__(self):
+        """Start with an empty queue."""
+        self.rows      = []
+        self.snapshots = []
+        self.queries   = 0
+
+    def queue_parser(self, user=None, partition=None, job_id=None):
+        """Yield the rows."""
+        self.queries += 1
+        if self.snapshots:
+            self.rows = self.snapshots.pop(0) if len(self.snapshots) > 1 \
+                else self.snapshots[0]
+        for row in self.rows:
+            yield row
+
+    def normalize_job_id(self, job_id):
+        """Split slurm style array IDs."""
+        if '_' in job_id:
+            job_id, array_id = job_id.split('_')
+            return job_id, array_id
+        return job_id, None
+
+    def normalize_state(self, state):
+        """States are already normalized."""
+        return state
+
+
+class _NoSleep(fyrd.poll.PollPolicy):
+
+    """Never sleep between polls."""
+
+    def __init__(self, **kwds):
+        """Ignore the queue settings."""
+        super(_NoSleep, self).__init__(initial=0, maximum=0, jitter=0)
+
+
+class _FakeJob(object):
+
+    """The parts of fyrd.Job used by the queue waits."""
+
+    kwds = None
+
+    def __init__(self, job_id, files=True):
+        """A submitted job, files is the result of _check_files."""
+        self.id        = job_id
+        self.name      = 'job{}'.format(job_id)
+        self.state     = 'pending'
+        self.submitted = True
+        self.files     = files
+
+    def _update_from_queue(self, queue_info, state):
+        if state == 'disappeared':
+            state = 'completed' if self.files else 'failed'
+        self.state = state
+
+    def _check_files(self):
+        return self.files
+
+
+@pytest.fixture
+def fake_queue(monkeypatch):
+    """Return a real Queue reading from a _FakeBatch that never sleeps.
+
+    Time is faked too, every call is a second after the last, so grace
+    periods pass within a few polls.
+    """
+    batch = _FakeBatch()
+    monkeypatch.setattr(fyrd.batch_systems, 'check_queue',
+                        lambda *args, **kwds: True)
+    monkeypatch.setattr(fyrd.batch_systems, 'get_batch_system',
+                        lambda *args, **kwds: batch)
+    clock = itertools.count(1000)
+    monkeypatch.setattr(fyrd.queue, '_time', lambda: next(clock))
+    if hasattr(fyrd, 'aio'):
+        monkeypatch.setattr(fyrd.aio, '_time', lambda: next(clock))
+    queue = fyrd.queue.Queue(qtype='slurm', poll_policy=_NoSleep)
+    queue._Job = _FakeJob
+    return queue
+
+
+def _row(job_id, state, array_id=None):
+    """Return a queue_parser row."""
+    return (job_id, array_id, 'job', 'bob', 'p', state, None, 1, 1, 0)
+
+
+def test_wait(fake_queue):
+    """Every waited job is resolved from one query per tick."""
+    fake_queue.batch_system.snapshots = [
+        [_row('1', 'pending'), _row('2', 'running')],
+        [_row('1', 'running'), _row('2', 'completed')],
+        [_row('1', 'completed'), _row('2', 'completed')],
+    ]
+    assert fake_queue.wait(['1', 2], notify=False) is True
+    assert fake_queue.batch_system.queries == 3
+    assert fake_queue.last_poll.queries == 3
+
+
+def test_wait_failed(fake_queue):
+    """A failed job ends the wait."""
+    fake_queue.batch_system.rows = [_row('1', 'running'),
+                                    _row('2', 'failed')]
+    assert fake_queue.wait(['1', '2'], notify=False) is False
+
+
+def test_wait_disappeared(fake_queue):
+    """Jobs never found in the queue disappear after the grace period."""
+    fake_queue.batch_system.rows = [_row('1', 'completed')]
+    assert fake_queue.wait(['1', '2'], notify=False) is False
+    assert fake_queue.wait(['1', '2'], return_disp=True,
+                           notify=False) == 'disappeared'
+    # Polled until the 12 try grace period was over
+    assert fake_queue.batch_system.queries > 2
+
+
+def test_wait_missing_then_found(fake_queue):
+    """Jobs that show up in the queue late are waited on normally."""
+    fake_queue.batch_system.snapshots = [
+        [], [], [_row('1', 'running')], [_row('1', 'completed')],
+    ]
+    assert fake_queue.wait(['1'], return_disp=True, notify=False) is True
+    assert fake_queue.batch_system.queries == 4
+
+
+def test_wait_array_child(fake_queue):
+    """Array children are waited on by their own state."""
+    fake_queue.batch_system.snapshots = [
+        [_row('1', 'running', '1'), _row('1', 'running', '2')],
+        [_row('1', 'completed', '1'), _row('1', 'running', '2')],
+    ]
+    assert fake_queue.wait(['1_1'], notify=False) is True
+    assert fake_queue.jobs['1'].state == 'running'
+    fake_queue.batch_system.snapshots = [
+        [_row('1', 'completed', '1'), _row('1', 'failed', '2')],
+    ]
+    assert fake_queue.wait(['1_1', '1_2'], notify=False) is False
+
+
+def test_as_completed(fake_queue):
+    """Jobs are yielded in the order they finish, not the order given."""
+    fake_queue.batch_system.snapshots = [
+        [_row('1', 'running'), _row('2', 'running'), _row('3', 'pending')],
+        [_row('1', 'running'), _row('2', 'completed'), _row('3', 'failed')],
+        [_row('1', 'completed'), _row('2', 'completed'),
+         _row('3', 'failed')],
+    ]
+    jobs = [_FakeJob('1'), _FakeJob('2'), _FakeJob('3')]
+    done = [(job.id, job.state) for job in fake_queue.as_completed(jobs)]
+    assert done == [('2', 'completed'), ('3', 'failed'), ('1', 'completed')]
+
+
+def test_as_completed_files(fake_queue):
+    """Completed jobs are held back until their files appear."""
+    fake_queue.batch_system.rows = [_row('1', 'completed'),
+                                    _row('2', 'completed')]
+    late = _FakeJob('1', files=False)
+    jobs = [late, _FakeJob('2')]
+    done = fake_queue.as_completed(jobs)
+    assert next(done).id == '2'
+    late.files = True
+    assert next(done).id == '1'
+
+
+def test_as_completed_timeout(fake_queue):
+    """QueueError is raised if jobs are not done in time."""
+    fake_queue.batch_system.rows = [_row('1', 'running'),
+                                    _row('2', 'completed')]
+    done = fake_queue.as_completed([_FakeJob('1'), _FakeJob('2')],
+                                   timeout=10)
+    assert next(done).id == '2'
+    with pytest.raises(fyrd.queue.QueueError):
+        next(done)
+
+
+def test_as_completed_disappeared(fake_queue):
+    """Jobs that never appear are yielded, failed unless files exist."""
+    fake_queue.batch_system.rows = []
+    jobs = [_FakeJob('1'), _FakeJob('2', files=False)]
+    done = {job.id: job.state for job in fake_queue.as_completed(jobs)}
+    assert done == {'1': 'completed', '2': 'failed'}
+
+
+def test_queue_changes(fake_queue):
+    """Updates are diffed against the previous snapshot."""
+    queue = fake_queue
+    batch = queue.batch_system
+    seen = []
+    queue.on_change(seen.append)
+    batch.rows = [('1', None, 'a', 'bob', 'p', 'pending', None, 1, 1, None),
+                  ('2', '1', 'b', 'bob', 'p', 'running', None, 1, 1, None)]
+    queue._update()
+    assert sorted((c.event, c.job_id, str(c.array_id)) for c in seen) == [
+        ('new', '1', 'None'), ('new', '2', '1'), ('new', '2', 'None')
+    ]
+    del seen[:]
+    batch.rows = [('1', None, 'a', 'bob', 'p', 'running', None, 1, 1, None)]
+    queue._update()
+    assert seen == [
+        fyrd.queue.QueueChange('changed', '1', None, 'pending', 'running'),
+        fyrd.queue.QueueChange('disappeared', '2', None, 'running',
+                               'completed'),
+    ]
+    assert queue.last_changes == seen
+    queue._update()
+    assert queue.last_changes == []
+
+
+def test_queue_child_changes(fake_queue):
+    """Array children missing from an update are reported as disappeared."""
+    batch = fake_queue.batch_system
+    batch.rows = [_row('1', 'running', '1'), _row('1', 'running', '2')]
+    fake_queue._update()
+    batch.rows = [_row('1', 'running', '2')]
+    fake_queue._update()
+    assert fake_queue.last_changes == [
+        fyrd.queue.QueueChange('disappeared', '1', '1', 'running',
+                               'completed'),
+    ]
+    assert fake_queue.jobs['1'].children['1'].disappeared
+    assert fake_queue.jobs['1'].state == 'running'
+    fake_queue._update()
+    assert fake_queue.last_changes == []
+
+
+def test_queue_changes_backoff(fake_queue):
+    """changes() only resets the poll interval when there are changes."""
+    batch = fake_queue.batch_system
+    batch.snapshots = [[_row('1', 'pending')], [_row('1', 'running')],
+                       [_row('1', 'running')]]
+    policies = []
+    new_policy = fake_queue._new_policy
+
+    def track(*args, **kwds):
+        policies.append(new_policy(*args, **kwds))
+        return policies[-1]
+    fake_queue._new_policy = track
+    events = [(c.event, c.new_state) for c in fake_queue.changes(timeout=20)]
+    assert events == [('new', 'pending'), ('changed', 'running')]
+    assert policies[0].resets == 2
+
+
+@pytest.mark.skipif(pd is None, reason="pandas is not installed")
+def test_to_frame(fake_queue):
+    """The queue is exported as a frame, one row per job or array child."""
+    queue = fake_queue
+    batch = queue.batch_system
+    batch.rows = [('1', None, 'a', 'bob', 'p', 'running', 'n[1-2]', 2, 4,
+                   None),
+                  ('2', '1', 'b', 'amy', 'p', 'completed', None, 1, 1, 3),
+                  ('2', '2', 'b', 'amy', 'p', 'pending', None, None, None,
+                   None)]
+    queue._update()
+    frame = queue.to_frame(update=False)
+    assert list(frame.job_id) == ['1', '2', '2']
+    assert list(frame.array_id.fillna('-')) == ['-', '1', '2']
+    assert list(frame.state) == ['running', 'completed', 'pending']
+    assert set(frame.owner.cat.categories) == {'bob', 'amy'}
+    assert frame.nodes[0] == 2 and frame.threads[0] == 8
+    assert frame.exitcode[1] == 3 and frame.exitcode.isna()[2]
+
+
+needs_aio = pytest.mark.skipif(sys.version_info < (3, 7),
+                               reason="The asyncio API needs python 3.7")
+
+
+@needs_aio
+def test_async_wait(fake_queue):
+    """All async waits share one poller and one query per tick."""
+    fake_queue.batch_system.snapshots = [
+        [_row('1', 'running'), _row('2', 'pending')],
+        [_row('1', 'completed'), _row('2', 'running')],
+        [_row('1', 'completed'), _row('2', 'completed')],
+    ]
+
+    async def wait():
+        return await asyncio.gather(fake_queue.async_wait(['1']),
+                                    fake_queue.async_wait(['1', '2']))
+
+    assert asyncio.run(wait()) == [True, True]
+    assert fake_queue.batch_system.queries == 3
+
+
+@needs_aio
+def test_async_wait_states(fake_queue):
+    """Failed and disappeared jobs resolve the wait."""
+    fake_queue.batch_system.rows = [_row('1', 'failed'),
+                                    _row('2', 'completed', '1')]
+    assert asyncio.run(fake_queue.async_wait(['1'])) is False
+    assert asyncio.run(fake_queue.async_wait(['2_1'])) is True
+    assert asyncio.run(
+        fake_queue.async_wait(['3'], return_disp=True)
+    ) == 'disappeared'
+
+
+@needs_aio
+def test_async_as_completed(fake_queue):
+    """Jobs are yielded in the order they finish."""
+    fake_queue.batch_system.snapshots = [
+        [_row('1', 'running'), _row('2', 'running')],
+        [_row('1', 'running'), _row('2', 'completed')],
+        [_row('1', 'completed'), _row('2', 'completed')],
+    ]
+    jobs = [_FakeJob('1'), _FakeJob('2')]
+
+    async def collect():
+        return [job.id async for job in fake_queue.async_as_completed(jobs)]
+
+    assert asyncio.run(collect()) == ['2', '1']
+    assert [job.state for job in jobs] == ['completed', 'completed']
+
+
+@needs_aio
+def test_async_as_completed_timeout(fake_queue):
+    """A timeout raises QueueError and stops the poller."""
+    fake_queue.batch_system.rows = [_row('1', 'running')]
+
+    async def collect():
+        async for _ in fake_queue.async_as_completed([_FakeJob('1')],
+                                                     timeout=0.05):
+            pass
+
+    with pytest.raises(fyrd.queue.QueueError):
+        asyncio.run(collect())
+
+
+@needs_aio
+def test_async_poller_error(fake_queue):
+    """A failed queue update is raised in every waiting coroutine."""
+    def broken(**kwds):
+        raise fyrd.batch_systems.BatchSystemError('broken')
+    fake_queue.batch_system.queue_parser = broken
+
+    async def wait():
+        return await asyncio.gather(fake_queue.async_wait(['1']),
+                                    fake_queue.async_wait(['2']),
+                                    return_exceptions=True)
+
+    errors = asyncio.run(wait())
+    assert [type(err) for err in errors] == [
+        fyrd.batch_systems.BatchSystemError
+    ] * 2
+
+
+class _ChangesBatch(_FakeBatch):
+
+    """Send only the rows changed since the last token, like local."""
+
+    def __init__(self):
+        """Changes are set by the test as (full, rows, deleted)."""
+        super(_ChangesBatch, self).__init__()
+        self.changes = []
+        self.tokens  = []
+
+    def queue_changes(self, token=None, user=None, partition=None):
+        """Return the next change set, with a new token."""
+        self.tokens.append(token)
+        full, rows, deleted = self.changes.pop(0)
+        return len(self.tokens), full, iter(rows), deleted
+
+
+def test_queue_delta(fake_queue):
+    """Jobs missing from a change set are kept, deleted jobs disappear."""
+    batch = _ChangesBatch()
+    fake_queue.batch_system = batch
+    batch.changes = [
+        (True, [_row('1', 'running'), _row('2', 'running'),
+                _row('3', 'running', '1'), _row('3', 'running', '2')], []),
+        (False, [_row('1', 'completed'), _row('3', 'completed', '1')],
+         ['2']),
+        (True, [_row('3', 'completed', '1')], []),
+    ]
+    fake_queue._update()
+    fake_queue._update()
+    assert sorted(fake_queue.last_changes) == [
+        fyrd.queue.QueueChange('changed', '1', None, 'running', 'completed'),
+        fyrd.queue.QueueChange('changed', '3', '1', 'running', 'completed'),
+        fyrd.queue.QueueChange('disappeared', '2', None, 'running',
+                               'completed'),
+    ]
+    assert fake_queue.jobs['3'].children['2'].state == 'running'
+    # A full update marks unfinished jobs that are missing as disappeared,
+    # finished jobs may be left out
+    fake_queue._update()
+    assert batch.tokens == [None, 1, 2]
+    assert {(c.event, c.job_id, c.array_id)
+            for c in fake_queue.last_changes} == {
+        ('disappeared', '3', '2'), ('changed', '3', None)
+    }
+    assert not fake_queue.jobs['1'].disappeared
+
+
+def test_queue_exitcode(fake_queue):
+    """A row without an exit code keeps the one already known."""
+    fake_queue.batch_system.snapshots = [
+        [('1', None, 'job', 'bob', 'p', 'completed', None, 1, 1, 3)],
+        [('1', None, 'job', 'bob', 'p', 'completed', None, 1, 1, None)],
+    ]
+    fake_queue._update()
+    fake_queue._update()
+    assert fake_queue.jobs['1'].exitcode == 3
+
+
+@needs_aio
+@pytest.mark.parametrize('auto_submit', [True, False])
+def test_async_auto_submit(fake_queue, monkeypatch, auto_submit):
+    """Unsubmitted jobs are submitted first only if auto_submit is set."""
+    get_option = fyrd.conf.get_option
+    monkeypatch.setattr(
+        fyrd.conf, 'get_option',
+        lambda section, key, *args: auto_submit if key == 'auto_submit'
+        else get_option(section, key, *args)
+    )
+    fake_queue.batch_system.rows = [_row('1', 'completed')]
+    job = _FakeJob('1')
+    job.submitted = False
+    job.submit = lambda: setattr(job, 'submitted', True)
+    if auto_submit:
+        assert asyncio.run(fake_queue._async_finish(job)) is job
+        assert job.submitted and job.state == 'completed'
+    else:
+        with pytest.raises(fyrd.ClusterError):
+            asyncio.run(fake_queue._async_finish(job))
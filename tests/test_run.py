@@ -25,3 +25,14 @@ def test_which():
     """Test getting paths."""
     ls = fyrd.run.which('ls')
     ls = fyrd.run.which(ls)
+
+
+def test_user_cache():
+    """User lookups are cached."""
+    fyrd.run._uid_names.clear()
+    name = fyrd.run.uid_to_name(os.getuid())
+    assert fyrd.run.uid_to_name(str(os.getuid())) == name
+    assert fyrd.run.name_to_uid(name) == os.getuid()
+    stats = fyrd.run.user_cache_stats()
+    assert stats['uid_to_name']['hits'] == 1
+    assert stats['uid_to_name']['misses'] == 1
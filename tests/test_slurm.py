@@ -0,0 +1,103 @@
+"""Test slurm output parsing without a cluster."""
+import os
+import sys
+sys.path.append(os.path.abspath('.'))
+from fyrd.batch_systems import slurm
+
+
+def _fake_cmd(outputs, calls):
+    """Return a throttle.cmd replacement giving outputs in order."""
+    def cmd(kind, qargs, tries=1):
+        calls.append(' '.join(qargs))
+        return 0, outputs.pop(0), ''
+    return cmd
+
+
+def test_sacct_history(monkeypatch):
+    """Only new sacct rows are requested and merged into the history."""
+    calls = []
+    monkeypatch.setattr(slurm._throttle, 'cmd', _fake_cmd([
+        '1|a|bob|p|COMPLETED|n1|1|1|0:0|\n'
+        '1.batch|batch||p|COMPLETED|n1|1|1|0:0|\n'
+        '2|b|bob|p|RUNNING|n1|1|1|0:0|',
+        '2|b|bob|p|COMPLETED|n1|1|1|0:0|\n3|c|bob|p|PENDING||1|1|0:0|',
+    ], calls))
+    server = slurm.SlurmServer()
+    _, rows = server._sacct('bob')
+    assert [i[0] for i in rows] == ['1', '2']
+    assert '--starttime' not in calls[0]
+    _, rows = server._sacct('bob')
+    assert '--starttime' in calls[1]
+    assert [(i[0], i[4]) for i in rows] == [
+        ('1', 'COMPLETED'), ('2', 'COMPLETED'), ('3', 'PENDING')
+    ]
+
+
+def test_sacct_changes(monkeypatch):
+    """Only changed sacct rows are sent, lookups by ID use the history."""
+    calls = []
+    outputs = [
+        '1|a|bob|p|RUNNING|n1|1|1|0:0|\n2|b|bob|p|RUNNING|n1|1|1|0:0|',
+        '1|a|bob|p|RUNNING|n1|1|1|0:0|\n2|b|bob|p|FAILED|n1|1|1|0:1|',
+        '',
+    ]
+    monkeypatch.setattr(slurm._throttle, 'cmd', _fake_cmd(outputs, calls))
+    monkeypatch.setattr(slurm._throttle, 'cmd_lines',
+                        lambda kind, qargs: iter([]))
+    server = slurm.SlurmServer()
+    token, full, rows, deleted = server.queue_changes(user='bob')
+    assert full and not deleted
+    assert [(i[0], i[5]) for i in rows] == [('1', 'running'), ('2', 'running')]
+    token, _, rows, _ = server.queue_changes(token, user='bob')
+    assert [(i[0], i[5], i[9]) for i in rows] == [('2', 'failed', 1)]
+    token, _, rows, _ = server.queue_changes(token, user='bob')
+    assert rows == []
+    # Tokens from another server get everything
+    token[0] = 'old'
+    outputs.append('')
+    _, _, rows, _ = server.queue_changes(token, user='bob')
+    assert [i[0] for i in rows] == ['1', '2']
+    # sacct failing for job IDs falls back to the history
+    monkeypatch.setattr(slurm._throttle, 'cmd',
+                        lambda kind, qargs, tries=1: (1, '', 'down'))
+    assert server._sacct('bob', job_ids=['2'])[1] == [
+        ('2', 'b', 'bob', 'p', 'FAILED', 'n1', '1', '1', '0:1')
+    ]
+
+
+def test_squeue_delimited(monkeypatch):
+    """Delimited squeue output is parsed and merged with sacct."""
+    sep = slurm.SQUEUE_DELIM
+    squeue = [
+        sep.join(['10', 'N/A', 'a', 'bob', 'p', 'RUNNING', 'n[1,3]', '1',
+                  '2']),
+        sep.join(['11', 'N/A', 'b', 'bob', 'p', 'COMPLETED', 'n1', '1', '1']),
+    ]
+    monkeypatch.setattr(slurm._throttle, 'cmd_lines',
+                        lambda kind, qargs: iter(squeue))
+    monkeypatch.setattr(slurm._throttle, 'cmd', _fake_cmd(
+        ['10|a|bob|p|RUNNING|n1|1|2|0:0|\n11|b|bob|p|COMPLETED|n1|1|1|0:3|'],
+        []
+    ))
+    rows = list(slurm.SlurmServer().queue_parser(user='bob'))
+    assert [(i[0], i[5], i[9]) for i in rows] == [
+        ('10', 'running', None), ('11', 'completed', 3)
+    ]
+    assert rows[0][6] == ['n1', 'n3']
+
+
+def test_squeue_done_exitcode(monkeypatch):
+    """Finished jobs still in squeue keep their sacct exit code."""
+    sep = slurm.SQUEUE_DELIM
+    squeue = [sep.join(['10', 'N/A', 'a', 'bob', 'p', 'COMPLETED', 'n1', '1',
+                        '1'])]
+    monkeypatch.setattr(slurm._throttle, 'cmd_lines',
+                        lambda kind, qargs: iter(squeue))
+    monkeypatch.setattr(slurm._throttle, 'cmd', _fake_cmd(
+        ['10|a|bob|p|COMPLETED|n1|1|1|0:3|'] * 2, []
+    ))
+    server = slurm.SlurmServer()
+    token = None
+    for _ in range(2):
+        token, _, rows, _ = server.queue_changes(token, user='bob')
+        assert [(i[0], i[5], i[9]) for i in rows] == [('10', 'completed', 3)]
@@ -0,0 +1,46 @@
+"""Test the shared queue snapshot."""
+import os
+import sys
+import threading
+from time import sleep
+sys.path.append(os.path.abspath('.'))
+import fyrd
+
+
+def test_shared_refresh(tmpdir):
+    """Only one of many concurrent readers queries the queue."""
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        sleep(0.3)
+        return [('1', None, 'job', 'me', 'p', 'running', [], 1, 1, None)]
+
+    caches = [fyrd.snapshot.SnapshotCache('slurm', max_age=10,
+                                          directory=str(tmpdir))
+              for _ in range(5)]
+    results = []
+    threads = [
+        threading.Thread(target=lambda c=c: results.append(c.get(fetch)))
+        for c in caches
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(r == results[0] for r in results)
+
+
+def test_expiry(tmpdir):
+    """Old snapshots are refreshed, filters use separate files."""
+    cache = fyrd.snapshot.SnapshotCache('slurm', max_age=0.2,
+                                        directory=str(tmpdir))
+    assert cache.get(lambda: [1]) == [1]
+    assert cache.get(lambda: [2]) == [1]
+    sleep(0.3)
+    assert cache.get(lambda: [3]) == [3]
+    other = fyrd.snapshot.SnapshotCache('slurm', user='bob', max_age=10,
+                                        directory=str(tmpdir))
+    assert other.path != cache.path
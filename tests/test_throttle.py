@@ -0,0 +1,41 @@
+"""Test the scheduler rate limiter."""
+import os
+import sys
+from time import time
+sys.path.append(os.path.abspath('.'))
+import fyrd
+
+
+def test_rate():
+    """Tokens are handed out at the rate after the burst."""
+    bucket = fyrd.throttle.TokenBucket(20, burst=1)
+    start = time()
+    for _ in range(5):
+        bucket.acquire()
+    assert time() - start >= 0.19
+    assert bucket.acquired == 5
+    assert bucket.throttled == 4
+
+
+def test_shared(tmpdir):
+    """Buckets using the same lock file share tokens."""
+    lock_file = str(tmpdir.join('submit.lock'))
+    first = fyrd.throttle.TokenBucket(10, burst=2, lock_file=lock_file)
+    second = fyrd.throttle.TokenBucket(10, burst=2, lock_file=lock_file)
+    first.acquire()
+    first.acquire()
+    assert second.acquire() > 0.05
+
+
+def test_backoff():
+    """Busy errors pause the bucket and double the pause."""
+    bucket = fyrd.throttle.TokenBucket(0)
+    assert bucket.backoff() == fyrd.throttle.BUSY_START
+    assert bucket.backoff() == fyrd.throttle.BUSY_START*2
+    bucket.ok()
+    bucket._state[2] = 0
+    assert bucket.acquire() == 0
+    assert fyrd.throttle.is_busy(
+        'sbatch: error: Socket timed out on send/recv operation'
+    )
+    assert not fyrd.throttle.is_busy('sbatch: error: invalid partition')
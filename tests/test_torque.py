@@ -0,0 +1,43 @@
+"""Test torque output parsing without a cluster."""
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath('.'))
+from fyrd.batch_systems import torque
+
+XML = (
+    '<Data><Job><Job_Id>12.host</Job_Id><Job_Name>a</Job_Name>'
+    '<Job_Owner>bob@host</Job_Owner><job_state>C</job_state>'
+    '<queue>batch</queue><exit_status>0</exit_status>'
+    '<Variable_List>PS1=\x1b[0m</Variable_List></Job>'
+    '<Job><Job_Id>13[2].host</Job_Id><Job_Name>b</Job_Name>'
+    '<Job_Owner>bob@host</Job_Owner><job_state>R</job_state>'
+    '<queue>batch</queue><exec_host>n1/0-1</exec_host></Job></Data>'
+)
+
+
+def test_stream_jobs(tmpdir):
+    """qstat XML is streamed with control characters removed."""
+    xml = tmpdir.join('qstat.xml')
+    xml.write(XML)
+    ids = [job.find('Job_Id').text
+           for job in torque._stream_jobs(['cat', str(xml)])]
+    assert ids == ['12.host', '13[2].host']
+    with pytest.raises(torque._CalledProcessError):
+        list(torque._stream_jobs(['sh', '-c', 'echo Unknown Job >&2; exit 1']))
+
+
+def test_queue_parser(tmpdir, monkeypatch):
+    """Jobs are parsed from the stream."""
+    xml = tmpdir.join('qstat.xml')
+    xml.write(XML)
+    stream = torque._stream_jobs
+    monkeypatch.setattr(torque, '_stream_jobs',
+                        lambda qargs: stream(['cat', str(xml)]))
+    jobs = list(torque.TorqueServer().queue_parser(user='bob'))
+    assert [(j[0], j[1], j[5], j[9]) for j in jobs] == [
+        ('12', None, 'completed', 0), ('13', '2', 'running', None)
+    ]
+    assert jobs[1][6] == ['n1']
+    assert jobs[1][6].counts() == {'n1': 2}
+    assert jobs[1][7] == 2
@@ -0,0 +1,71 @@
+"""Test waiting for output files."""
+import os
+import sys
+import threading
+from time import time, sleep
+sys.path.append(os.path.abspath('.'))
+import fyrd
+
+
+def _write_later(path, delay):
+    """Write path after delay seconds in a thread."""
+    def write():
+        sleep(delay)
+        with open(path, 'w') as fout:
+            fout.write('done\n')
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread
+
+
+def _check_watcher(watcher, tmpdir):
+    """Check a watcher finds files and times out."""
+    paths = [str(tmpdir.join('job.out')), str(tmpdir.join('job.err'))]
+    threads = [_write_later(p, 0.3) for p in paths]
+    start = time()
+    assert watcher.wait(paths, 10)
+    assert time() - start < 5
+    for thread in threads:
+        thread.join()
+    assert watcher.wait(paths, 0)
+    assert not watcher.wait([str(tmpdir.join('missing.out'))], 0.5)
+
+
+def test_inotify(tmpdir):
+    """Use inotify on Linux."""
+    watcher = fyrd.watch.FileWatcher()
+    if sys.platform.startswith('linux'):
+        assert watcher.active
+    _check_watcher(watcher, tmpdir)
+
+
+def test_polling(tmpdir):
+    """Fall back to polling."""
+    watcher = fyrd.watch.FileWatcher(use_inotify=False)
+    assert not watcher.active
+    _check_watcher(watcher, tmpdir)
+
+
+def test_unwatch(tmpdir):
+    """Directories are no longer watched once nobody waits on them."""
+    watcher = fyrd.watch.FileWatcher()
+    path = str(tmpdir.join('job.out'))
+    _write_later(path, 0.2).join()
+    assert watcher.wait([path], 1)
+    assert watcher.directories == {}
+    assert watcher._waiting == {}
+
+
+def test_poll_policy(tmpdir):
+    """The polling policy class of the queue is used."""
+    made = []
+
+    class Policy(fyrd.poll.PollPolicy):
+        def __init__(self, **kwds):
+            made.append(kwds)
+            super(Policy, self).__init__(**kwds)
+    watcher = fyrd.watch.FileWatcher(use_inotify=False)
+    assert not watcher.wait([str(tmpdir.join('missing.out'))], 0.2,
+                            poll_policy=Policy)
+    assert made == [{'initial': fyrd.watch.POLL_START,
+                     'maximum': fyrd.watch.POLL_START}]